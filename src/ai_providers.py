@@ -0,0 +1,1121 @@
+"""
+AI 服务商接口
+anki_llm_forge.py 与 anki_enhancer.py 共用的服务商实现，所有服务商共享同一套速率限制逻辑
+同时提供同步接口 generate_content 和异步接口 agenerate_content
+"""
+
+import google.generativeai as genai
+import os
+import re
+import json
+import random
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from abc import ABC, abstractmethod
+
+try:
+    import httpx  # openai SDK 的依赖，用于配置连接池
+except ImportError:
+    httpx = None
+
+from rate_limiter import RateLimiter, estimate_tokens, is_rate_limit_error, get_retry_after
+from run_metrics import StageTimer, LatencyHistogram
+from circuit_breaker import CircuitBreaker, CircuitOpenError, is_health_failure
+
+
+class UsageStats:
+    """累计每次调用的 token 用量与耗时（多线程共享）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latency = 0.0
+        # 达到 max_tokens 上限被截断的响应数
+        self.truncated = 0
+        # 每次调用的输出 token 数分布，用于按 Profile 确定 max_tokens
+        self.completion_lengths = LatencyHistogram()
+
+    def add(self, prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0):
+        """累加一次响应的 token 用量"""
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            if completion_tokens:
+                self.completion_lengths.add(completion_tokens)
+
+    def completion_estimate(self) -> int:
+        """按已观测的每次调用输出 token 数（p95）估算下一次调用的输出长度，尚无样本时为 0"""
+        with self._lock:
+            return round(self.completion_lengths.percentile(0.95))
+
+    def add_truncated(self):
+        """记录一次因达到 max_tokens 上限而被截断的响应"""
+        with self._lock:
+            self.truncated += 1
+
+    def add_call(self, latency: float, error: bool = False):
+        """记录一次调用的耗时（秒）"""
+        with self._lock:
+            self.latency += latency
+            if error:
+                self.errors += 1
+            else:
+                self.calls += 1
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """输入 token 中命中服务商前缀缓存的比例"""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def to_dict(self) -> Dict:
+        """导出为指标文件中的一条记录"""
+        with self._lock:
+            attempts = self.calls + self.errors
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cache_hit_ratio": round(self.cache_hit_ratio, 4),
+                "truncated": self.truncated,
+                "completion_tokens_per_call": {
+                    "p50": round(self.completion_lengths.percentile(0.5)),
+                    "p95": round(self.completion_lengths.percentile(0.95)),
+                    "p99": round(self.completion_lengths.percentile(0.99)),
+                    "max": self.completion_lengths.max
+                },
+                "latency_seconds": round(self.latency, 3),
+                "avg_latency_seconds": round(self.latency / attempts, 3) if attempts else 0.0
+            }
+
+
+class AIProvider(ABC):
+    """AI 服务商抽象基类"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        # 按 providers.* 中的 requests_per_minute / tokens_per_minute 限速
+        self.rate_limiter = RateLimiter.from_config(config)
+        # 连接池与超时设置（秒）
+        self.pool_size = config.get("pool_size", 100)
+        self.timeout = config.get("timeout", 600)
+        self.connect_timeout = config.get("connect_timeout", 5)
+        # 服务商返回的 token 用量（含前缀缓存命中的 token）
+        self.usage = UsageStats()
+        # 各阶段耗时分布（速率限制等待、服务商调用；生成器/增强器在同一实例上记录其余阶段）
+        self.timings = StageTimer()
+        # 生成参数（max_tokens / temperature / stop_sequences），由生成器/增强器按 Profile 设置
+        self.generation_options: Dict = {}
+
+    def set_generation_options(self, options: Dict):
+        """设置生成参数，未设置的参数使用服务商默认值（组合服务商覆盖以同步到各服务商）"""
+        self.generation_options = {key: value for key, value in options.items() if value is not None}
+
+    def _check_finish_reason(self, finish_reason):
+        """响应因达到 max_tokens 上限结束时计数并警告（被截断的 JSON 通常无法解析）"""
+        if finish_reason is None:
+            return
+        reason = getattr(finish_reason, "name", str(finish_reason)).lower()
+        if reason in ("length", "max_tokens"):
+            self.usage.add_truncated()
+            self.logger.warning(
+                f"响应达到 max_tokens 上限 ({self.generation_options.get('max_tokens', '默认值')}) 被截断，"
+                f"可调大 Profile 的 max_tokens"
+            )
+
+    def _on_error(self, error: Exception):
+        """调用失败时检查是否为 429，是则通知限速器降速"""
+        if is_rate_limit_error(error):
+            self.logger.warning("服务商返回速率限制 (429)，自动降低请求速率")
+            self.rate_limiter.on_rate_limited(get_retry_after(error))
+
+    def _token_reservation(self, prompt: str, system_prompt: str = "") -> int:
+        """
+        请求前预留的 TPM 预算：输入 token 估算加上输出上限
+
+        输出上限取 Profile 的 max_tokens，未设置时按已观测的输出长度估算；
+        请求结束后退还预留，并按 _record_usage / _estimate_usage 记录的实际用量扣减
+        """
+        completion = self.generation_options.get("max_tokens")
+        if completion is None:
+            completion = self.usage.completion_estimate()
+        return estimate_tokens(system_prompt + prompt) + completion
+
+    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """生成内容：调用前申请速率预算，遇到 429 时通知限速器降速；记录每次调用的耗时"""
+        reserved = self._token_reservation(prompt, system_prompt)
+        wait = self.rate_limiter.acquire(reserved)
+        self.timings.add("rate_limit_wait", wait)
+        start = time.perf_counter()
+        try:
+            response_text = self._generate_content(prompt, system_prompt)
+        except Exception as e:
+            self._record_call(time.perf_counter() - start, error=True)
+            self._on_error(e)
+            raise
+        finally:
+            self.rate_limiter.release_tokens(reserved)
+        self._record_call(time.perf_counter() - start)
+        self.rate_limiter.on_success()
+        return response_text
+
+    async def agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """generate_content 的异步版本，可在同一个事件循环中并发大量请求"""
+        reserved = self._token_reservation(prompt, system_prompt)
+        wait = await self.rate_limiter.acquire_async(reserved)
+        self.timings.add("rate_limit_wait", wait)
+        start = time.perf_counter()
+        try:
+            response_text = await self._agenerate_content(prompt, system_prompt)
+        except Exception as e:
+            self._record_call(time.perf_counter() - start, error=True)
+            self._on_error(e)
+            raise
+        finally:
+            self.rate_limiter.release_tokens(reserved)
+        self._record_call(time.perf_counter() - start)
+        self.rate_limiter.on_success()
+        return response_text
+
+    def _record_call(self, latency: float, error: bool = False):
+        """记录一次服务商调用的耗时"""
+        self.usage.add_call(latency, error)
+        self.timings.add("network", latency)
+
+    def generate_content_stream(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """
+        流式生成：逐段产出响应文本
+
+        调用方提前关闭迭代器（close()）时关闭连接，服务商随之停止生成；
+        提前关闭按成功调用记录耗时，首段文本的等待时间计入 first_token 阶段
+        """
+        reserved = self._token_reservation(prompt, system_prompt)
+        wait = self.rate_limiter.acquire(reserved)
+        self.timings.add("rate_limit_wait", wait)
+        start = time.perf_counter()
+        chunks = self._stream_content(prompt, system_prompt)
+        first_chunk = True
+        try:
+            for chunk in chunks:
+                if first_chunk:
+                    self.timings.add("first_token", time.perf_counter() - start)
+                    first_chunk = False
+                yield chunk
+        except GeneratorExit:
+            self._record_call(time.perf_counter() - start)
+            self.rate_limiter.on_success()
+            raise
+        except Exception as e:
+            self._record_call(time.perf_counter() - start, error=True)
+            self._on_error(e)
+            raise
+        finally:
+            chunks.close()
+            self.rate_limiter.release_tokens(reserved)
+        self._record_call(time.perf_counter() - start)
+        self.rate_limiter.on_success()
+
+    async def agenerate_content_stream(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """generate_content_stream 的异步版本，提前结束时调用 aclose()"""
+        reserved = self._token_reservation(prompt, system_prompt)
+        wait = await self.rate_limiter.acquire_async(reserved)
+        self.timings.add("rate_limit_wait", wait)
+        start = time.perf_counter()
+        chunks = self._astream_content(prompt, system_prompt)
+        first_chunk = True
+        try:
+            async for chunk in chunks:
+                if first_chunk:
+                    self.timings.add("first_token", time.perf_counter() - start)
+                    first_chunk = False
+                yield chunk
+        except GeneratorExit:
+            self._record_call(time.perf_counter() - start)
+            self.rate_limiter.on_success()
+            raise
+        except Exception as e:
+            self._record_call(time.perf_counter() - start, error=True)
+            self._on_error(e)
+            raise
+        finally:
+            await chunks.aclose()
+            self.rate_limiter.release_tokens(reserved)
+        self._record_call(time.perf_counter() - start)
+        self.rate_limiter.on_success()
+
+    @abstractmethod
+    def _generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """实际调用服务商接口，子类必须实现"""
+        pass
+
+    def _stream_content(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """流式调用服务商接口，默认一次性返回完整响应，子类可覆盖为真正的流式实现"""
+        yield self._generate_content(prompt, system_prompt)
+
+    async def _astream_content(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """_stream_content 的异步版本"""
+        yield await self._agenerate_content(prompt, system_prompt)
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """异步调用服务商接口，默认在线程中执行同步实现，子类可覆盖为原生异步实现"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self._generate_content, prompt, system_prompt))
+
+    async def aclose(self):
+        """关闭异步客户端持有的连接，事件循环结束前调用"""
+        pass
+
+    def provider_stats(self) -> Dict:
+        """写入运行指标的附加统计（组合服务商覆盖）"""
+        return {}
+
+    def _usage_from_response(self, response) -> Tuple[int, int, int]:
+        """从响应中读取 (输入 token, 输出 token, 缓存命中 token)，子类按服务商格式实现"""
+        return 0, 0, 0
+
+    def _record_usage(self, response):
+        """记录一次调用的 token 用量并按实际用量扣减 TPM 预算，响应中没有用量信息时忽略"""
+        try:
+            prompt_tokens, completion_tokens, cached_tokens = self._usage_from_response(response)
+        except (AttributeError, TypeError):
+            return
+        self.usage.add(prompt_tokens or 0, completion_tokens or 0, cached_tokens or 0)
+        self.rate_limiter.charge_tokens((prompt_tokens or 0) + (completion_tokens or 0))
+
+    def _estimate_usage(self, prompt: str, system_prompt: str, response_text: str):
+        """服务商没有返回用量时（如流式响应提前结束）按文本长度估算"""
+        prompt_tokens, completion_tokens = estimate_tokens(system_prompt + prompt), estimate_tokens(response_text)
+        self.usage.add(prompt_tokens, completion_tokens)
+        self.rate_limiter.charge_tokens(prompt_tokens + completion_tokens)
+
+
+class GeminiProvider(AIProvider):
+    """Google Gemini 服务商"""
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        os.environ["GOOGLE_API_KEY"] = config["api_key"]
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        self.model = genai.GenerativeModel(config['model'])
+        self.logger.info(f"已初始化 Gemini 模型: {config['model']}")
+
+    def _generation_config(self) -> Optional[Dict]:
+        """Gemini 的生成参数，未设置时使用 SDK 默认值"""
+        names = {"max_tokens": "max_output_tokens", "temperature": "temperature", "stop_sequences": "stop_sequences"}
+        config = {names[key]: value for key, value in self.generation_options.items()}
+        return config or None
+
+    @staticmethod
+    def _finish_reason(response):
+        try:
+            return response.candidates[0].finish_reason
+        except (AttributeError, IndexError):
+            return None
+
+    def _generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """使用 Gemini 生成内容"""
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self._generation_config(),
+            request_options={"timeout": self.timeout}
+        )
+        self._record_usage(response)
+        self._check_finish_reason(self._finish_reason(response))
+        return response.text
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """使用 Gemini 原生异步接口生成内容"""
+        response = await self.model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(),
+            request_options={"timeout": self.timeout}
+        )
+        self._record_usage(response)
+        self._check_finish_reason(self._finish_reason(response))
+        return response.text
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """读取流式响应片段的文本，没有文本的片段（如只含结束原因）返回空字符串"""
+        try:
+            return chunk.text
+        except ValueError:
+            return ""
+
+    def _stream_content(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """使用 Gemini 流式接口逐段生成"""
+        response = self.model.generate_content(
+            prompt,
+            stream=True,
+            generation_config=self._generation_config(),
+            request_options={"timeout": self.timeout}
+        )
+        received = []
+        finished = False
+        try:
+            for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    received.append(text)
+                    yield text
+            finished = True
+        finally:
+            if finished:
+                self._record_usage(response)
+                self._check_finish_reason(self._finish_reason(response))
+            else:
+                self._estimate_usage(prompt, system_prompt, "".join(received))
+
+    async def _astream_content(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """使用 Gemini 异步流式接口逐段生成"""
+        response = await self.model.generate_content_async(
+            prompt,
+            stream=True,
+            generation_config=self._generation_config(),
+            request_options={"timeout": self.timeout}
+        )
+        received = []
+        finished = False
+        try:
+            async for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    received.append(text)
+                    yield text
+            finished = True
+        finally:
+            if finished:
+                self._record_usage(response)
+                self._check_finish_reason(self._finish_reason(response))
+            else:
+                self._estimate_usage(prompt, system_prompt, "".join(received))
+
+    def _usage_from_response(self, response) -> Tuple[int, int, int]:
+        """Gemini 的用量在 usage_metadata 中，隐式缓存命中计入 cached_content_token_count"""
+        usage = response.usage_metadata
+        return (
+            usage.prompt_token_count,
+            usage.candidates_token_count,
+            getattr(usage, "cached_content_token_count", 0)
+        )
+
+
+class QiniuProvider(AIProvider):
+    """七牛云 AI 服务商（DeepSeek）"""
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        if httpx is None:
+            raise ImportError("请安装 httpx 库: pip install httpx")
+        try:
+            from openai import OpenAI
+            # 复用长连接，避免每次请求重新握手
+            self.client = OpenAI(
+                base_url=config["base_url"],
+                api_key=config["api_key"],
+                http_client=httpx.Client(
+                    limits=self._pool_limits(),
+                    timeout=self._timeouts()
+                )
+            )
+            self.model = config['model']
+            self.logger.info(f"已初始化七牛云 AI 模型: {config['model']}")
+        except ImportError:
+            raise ImportError("请安装 openai 库: pip install openai")
+
+        # 异步客户端绑定到创建它的事件循环，按需创建
+        self._async_client = None
+        self._async_loop = None
+
+    def _pool_limits(self):
+        """连接池大小（同时也是保持长连接的上限）"""
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size
+        )
+
+    def _timeouts(self):
+        """请求超时与连接超时"""
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def _get_async_client(self):
+        """获取当前事件循环对应的异步客户端"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(
+                base_url=self.config["base_url"],
+                api_key=self.config["api_key"],
+                http_client=httpx.AsyncClient(
+                    limits=self._pool_limits(),
+                    timeout=self._timeouts()
+                )
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    def _build_messages(self, prompt: str, system_prompt: str = "") -> list:
+        """
+        构建 Chat Completions 消息列表
+
+        固定的系统提示词在前、用户提示词（卡片内容在末尾）在后，
+        同一 Profile 的请求共享相同的前缀，可以命中服务商的上下文缓存
+        """
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def _completion_options(self) -> Dict:
+        """Chat Completions 的生成参数，未设置 max_tokens 时为 4096"""
+        options = {"max_tokens": self.generation_options.get("max_tokens", 4096)}
+        if "temperature" in self.generation_options:
+            options["temperature"] = self.generation_options["temperature"]
+        if "stop_sequences" in self.generation_options:
+            options["stop"] = self.generation_options["stop_sequences"]
+        return options
+
+    def _generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """使用七牛云 AI 生成内容"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(prompt, system_prompt),
+            stream=False,
+            **self._completion_options()
+        )
+        self._record_usage(response)
+        self._check_finish_reason(response.choices[0].finish_reason)
+        return response.choices[0].message.content
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """使用七牛云 AI 异步生成内容"""
+        response = await self._get_async_client().chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(prompt, system_prompt),
+            stream=False,
+            **self._completion_options()
+        )
+        self._record_usage(response)
+        self._check_finish_reason(response.choices[0].finish_reason)
+        return response.choices[0].message.content
+
+    def _stream_options(self) -> Dict:
+        """流式请求参数：stream_include_usage 为 true 时请求在最后一个片段中返回用量"""
+        if self.config.get("stream_include_usage", True):
+            return {"stream_options": {"include_usage": True}}
+        return {}
+
+    def _consume_chunk(self, chunk) -> Tuple[str, bool]:
+        """处理一个流式片段：记录用量（最后一个片段），返回 (增量文本, 是否包含用量)"""
+        has_usage = bool(getattr(chunk, "usage", None))
+        if has_usage:
+            self._record_usage(chunk)
+        if chunk.choices:
+            self._check_finish_reason(chunk.choices[0].finish_reason)
+            return chunk.choices[0].delta.content or "", has_usage
+        return "", has_usage
+
+    def _finish_stream(self, prompt: str, system_prompt: str, received: List[str], usage_recorded: bool):
+        """流提前关闭（没有收到用量片段）时估算用量"""
+        if not usage_recorded:
+            self._estimate_usage(prompt, system_prompt, "".join(received))
+
+    def _stream_content(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """使用七牛云 AI 流式生成，关闭时断开连接，服务商停止生成"""
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(prompt, system_prompt),
+            stream=True,
+            **self._completion_options(),
+            **self._stream_options()
+        )
+        received = []
+        usage_recorded = False
+        try:
+            for chunk in stream:
+                text, has_usage = self._consume_chunk(chunk)
+                usage_recorded = usage_recorded or has_usage
+                if text:
+                    received.append(text)
+                    yield text
+        finally:
+            stream.close()
+            self._finish_stream(prompt, system_prompt, received, usage_recorded)
+
+    async def _astream_content(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """使用七牛云 AI 异步流式生成"""
+        stream = await self._get_async_client().chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(prompt, system_prompt),
+            stream=True,
+            **self._completion_options(),
+            **self._stream_options()
+        )
+        received = []
+        usage_recorded = False
+        try:
+            async for chunk in stream:
+                text, has_usage = self._consume_chunk(chunk)
+                usage_recorded = usage_recorded or has_usage
+                if text:
+                    received.append(text)
+                    yield text
+        finally:
+            await stream.close()
+            self._finish_stream(prompt, system_prompt, received, usage_recorded)
+
+    def _usage_from_response(self, response) -> Tuple[int, int, int]:
+        """
+        OpenAI 兼容格式的用量
+
+        DeepSeek 的上下文缓存命中在 prompt_cache_hit_tokens 中，
+        OpenAI 格式在 prompt_tokens_details.cached_tokens 中
+        """
+        usage = response.usage
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+        if cached_tokens is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(details, "cached_tokens", 0) if details else 0
+        return usage.prompt_tokens, usage.completion_tokens, cached_tokens
+
+    async def aclose(self):
+        """关闭异步客户端的连接池"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+            self._async_loop = None
+
+
+class MockProviderError(Exception):
+    """MockProvider 按 error_rate / rate_limit_rate 模拟的服务商错误"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockProvider(AIProvider):
+    """
+    离线模拟服务商：不访问网络、不消耗额度，用于基准测试和调试
+
+    批量提示词（以 "Items (N):" / "Cards (N):" 结尾）返回 N 个对象的 JSON 数组；
+    单条提示词按 response_format 返回 JSON 对象或纯文本，设置 response 时原样返回该文本。
+    延迟服从对数正态分布（中位数 latency_ms 毫秒，离散度 latency_sigma），
+    按 error_rate / rate_limit_rate 的概率抛出 500 / 429 错误。
+    """
+
+    _BATCH_COUNT_PATTERN = re.compile(r'\((\d+)\):\n\[')
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.model = config.get("model", "mock")
+        self.output_fields = config.get("output_fields", ["content"])
+        self.response_format = config.get("response_format", "json")
+        self.response = config.get("response")
+        self.value_template = config.get("value_template", "mock {field} {call}")
+        self.latency_ms = config.get("latency_ms", 0)
+        self.latency_sigma = config.get("latency_sigma", 0.5)
+        self.error_rate = config.get("error_rate", 0.0)
+        self.rate_limit_rate = config.get("rate_limit_rate", 0.0)
+        # 附加在响应末尾的内容，模拟模型在 JSON 之后继续输出
+        self.trailing_text = config.get("trailing_text", "")
+        self.stream_chunk_size = config.get("stream_chunk_size", 16)
+
+        self._random = random.Random(config.get("seed"))
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.logger.info(f"已初始化模拟服务商: 延迟中位数 {self.latency_ms} ms，错误率 {self.error_rate}")
+
+    def _next_call(self) -> Tuple[int, float, float]:
+        """返回 (调用序号, 本次延迟秒数, 错误判定用的随机数)"""
+        with self._lock:
+            self._calls += 1
+            latency = 0.0
+            if self.latency_ms:
+                latency = self.latency_ms / 1000 * self._random.lognormvariate(0, self.latency_sigma)
+            return self._calls, latency, self._random.random()
+
+    def _check_error(self, roll: float):
+        if roll < self.rate_limit_rate:
+            raise MockProviderError("模拟速率限制 (429)", status_code=429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise MockProviderError("模拟服务商错误 (500)")
+
+    def _values(self, call: int) -> Dict[str, str]:
+        return {field: self.value_template.format(field=field, call=call) for field in self.output_fields}
+
+    def _respond(self, call: int, prompt: str) -> str:
+        """构造响应文本"""
+        match = self._BATCH_COUNT_PATTERN.search(prompt)
+        if match:
+            text = json.dumps(
+                [{"id": str(i), **self._values(call)} for i in range(int(match.group(1)))],
+                ensure_ascii=False
+            )
+        elif self.response is not None:
+            text = self.response
+        elif self.response_format == "text":
+            text = "\n".join(self._values(call).values())
+        else:
+            text = json.dumps(self._values(call), ensure_ascii=False)
+        return text + self.trailing_text
+
+    def _generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """模拟同步调用"""
+        call, latency, roll = self._next_call()
+        if latency:
+            time.sleep(latency)
+        self._check_error(roll)
+        text = self._respond(call, prompt)
+        self._estimate_usage(prompt, system_prompt, text)
+        return text
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """模拟异步调用，等待期间不阻塞事件循环"""
+        call, latency, roll = self._next_call()
+        if latency:
+            await asyncio.sleep(latency)
+        self._check_error(roll)
+        text = self._respond(call, prompt)
+        self._estimate_usage(prompt, system_prompt, text)
+        return text
+
+    def _split(self, text: str) -> List[str]:
+        size = max(1, self.stream_chunk_size)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def _stream_content(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """模拟流式调用：延迟平均分摊到各个片段上，只按已产出的文本估算用量"""
+        call, latency, roll = self._next_call()
+        chunks = self._split(self._respond(call, prompt))
+        received = []
+        try:
+            for index, chunk in enumerate(chunks):
+                if latency:
+                    time.sleep(latency / len(chunks))
+                if index == 0:
+                    self._check_error(roll)
+                received.append(chunk)
+                yield chunk
+        finally:
+            self._estimate_usage(prompt, system_prompt, "".join(received))
+
+    async def _astream_content(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """_stream_content 的异步版本"""
+        call, latency, roll = self._next_call()
+        chunks = self._split(self._respond(call, prompt))
+        received = []
+        try:
+            for index, chunk in enumerate(chunks):
+                if latency:
+                    await asyncio.sleep(latency / len(chunks))
+                if index == 0:
+                    self._check_error(roll)
+                received.append(chunk)
+                yield chunk
+        finally:
+            self._estimate_usage(prompt, system_prompt, "".join(received))
+
+
+class FailoverProvider(AIProvider):
+    """
+    按优先级使用多个服务商，每个服务商带一个熔断器
+
+    当前服务商调用失败（速率限制、5xx、超时等）时，本次请求立即改用下一个服务商；
+    连续失败达到阈值后熔断，冷却结束后放行探测请求，成功即切回优先级更高的服务商。
+    各服务商仍使用自己的速率限制，用量与耗时统一记录在本实例的 usage / timings 中。
+    """
+
+    def __init__(self, providers: List[Tuple[str, AIProvider]]):
+        primary_name, primary = providers[0]
+        super().__init__(primary.config)
+        self.providers = providers
+        self.breakers = {name: CircuitBreaker.from_config(name, provider.config) for name, provider in providers}
+        # 是否启用速率预算以主服务商为准（未启用时生成器按 request_delay 间隔请求）
+        self.rate_limiter = primary.rate_limiter
+        for _, provider in providers:
+            provider.usage = self.usage
+            provider.timings = self.timings
+        self.active = primary_name
+
+    def set_generation_options(self, options: Dict):
+        super().set_generation_options(options)
+        for _, provider in self.providers:
+            provider.set_generation_options(options)
+
+    def _use(self, name: str):
+        if name != self.active:
+            self.logger.warning(f"服务商切换: {self.active} → {name}")
+            self.active = name
+
+    def _on_failure(self, name: str, error: Exception) -> bool:
+        """记录失败，返回是否应改用下一个服务商"""
+        self.breakers[name].record(error)
+        if not is_health_failure(error):
+            return False
+        self.logger.warning(f"服务商 {name} 调用失败: {error}")
+        return True
+
+    def _generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """依次尝试未熔断的服务商"""
+        last_error: Optional[Exception] = None
+        for name, provider in self.providers:
+            if not self.breakers[name].allow_request():
+                continue
+            try:
+                response_text = provider.generate_content(prompt, system_prompt)
+            except Exception as e:
+                if not self._on_failure(name, e):
+                    raise
+                last_error = e
+                continue
+            self.breakers[name].record_success()
+            self._use(name)
+            return response_text
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError("所有服务商均处于熔断状态")
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """_generate_content 的异步版本"""
+        last_error: Optional[Exception] = None
+        for name, provider in self.providers:
+            if not self.breakers[name].allow_request():
+                continue
+            try:
+                response_text = await provider.agenerate_content(prompt, system_prompt)
+            except Exception as e:
+                if not self._on_failure(name, e):
+                    raise
+                last_error = e
+                continue
+            self.breakers[name].record_success()
+            self._use(name)
+            return response_text
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError("所有服务商均处于熔断状态")
+
+    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """速率限制与用量记录由各服务商自己完成"""
+        return self._generate_content(prompt, system_prompt)
+
+    async def agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """generate_content 的异步版本"""
+        return await self._agenerate_content(prompt, system_prompt)
+
+    def generate_content_stream(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """流式版本：收到第一段文本之前失败时改用下一个服务商，之后不再切换"""
+        last_error: Optional[Exception] = None
+        for name, provider in self.providers:
+            if not self.breakers[name].allow_request():
+                continue
+            stream = provider.generate_content_stream(prompt, system_prompt)
+            try:
+                first_chunk = next(stream, None)
+            except Exception as e:
+                if not self._on_failure(name, e):
+                    raise
+                last_error = e
+                continue
+            self.breakers[name].record_success()
+            self._use(name)
+            try:
+                if first_chunk is not None:
+                    yield first_chunk
+                yield from stream
+            finally:
+                stream.close()
+            return
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError("所有服务商均处于熔断状态")
+
+    async def agenerate_content_stream(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """generate_content_stream 的异步版本"""
+        last_error: Optional[Exception] = None
+        for name, provider in self.providers:
+            if not self.breakers[name].allow_request():
+                continue
+            stream = provider.agenerate_content_stream(prompt, system_prompt)
+            try:
+                first_chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            except Exception as e:
+                if not self._on_failure(name, e):
+                    raise
+                last_error = e
+                continue
+            self.breakers[name].record_success()
+            self._use(name)
+            try:
+                if first_chunk is not None:
+                    yield first_chunk
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+            return
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError("所有服务商均处于熔断状态")
+
+    async def aclose(self):
+        for _, provider in self.providers:
+            await provider.aclose()
+
+    def provider_stats(self) -> Dict:
+        return {"active_provider": self.active, **{
+            f"circuit_{name}": breaker.state for name, breaker in self.breakers.items()
+        }}
+
+
+class HedgedProvider(AIProvider):
+    """
+    对冲请求：调用超过已观测延迟的分位数（默认 p95）仍未返回时，
+    再向同一服务商（或 hedge_provider）发出一个相同的请求，采用先返回的结果并取消另一个
+
+    额外请求数不超过总请求数的 budget 比例；样本不足 min_samples 时不对冲。
+    同步模式下被放弃的请求无法中断，会在后台守护线程中完成，结果被丢弃；
+    守护线程不会阻止进程退出，也不需要在处理结束时关闭。
+    """
+
+    def __init__(
+        self,
+        primary: AIProvider,
+        secondary: Optional[AIProvider] = None,
+        percentile: float = 0.95,
+        budget: float = 0.1,
+        min_samples: int = 10,
+        hedge_after: Optional[float] = None
+    ):
+        super().__init__(primary.config)
+        self.primary = primary
+        self.secondary = secondary or primary
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.hedge_after = hedge_after
+
+        # 用量、耗时与限速沿用主服务商的对象，指标中包含对冲请求的开销
+        self.usage = primary.usage
+        self.timings = primary.timings
+        self.rate_limiter = primary.rate_limiter
+        if self.secondary is not primary:
+            self.secondary.usage = self.usage
+            self.secondary.timings = self.timings
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latency = LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def set_generation_options(self, options: Dict):
+        super().set_generation_options(options)
+        self.primary.set_generation_options(options)
+        self.secondary.set_generation_options(options)
+
+    @classmethod
+    def from_settings(cls, primary: AIProvider, providers_config: Dict, global_settings: Dict) -> "HedgedProvider":
+        """按 global_settings 中的 hedge_* 设置包装主服务商"""
+        secondary_name = global_settings.get("hedge_provider")
+        return cls(
+            primary,
+            secondary=create_ai_provider(providers_config, secondary_name) if secondary_name else None,
+            percentile=global_settings.get("hedge_percentile", 0.95),
+            budget=global_settings.get("hedge_budget", 0.1),
+            min_samples=global_settings.get("hedge_min_samples", 10),
+            hedge_after=global_settings.get("hedge_after_seconds")
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """发出对冲请求前等待的秒数，样本不足时返回 None（不对冲）"""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            if self._latency.count < self.min_samples:
+                return None
+            return self._latency.percentile(self.percentile)
+
+    def _start_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _take_budget(self) -> bool:
+        """额外请求的预算：对冲次数不超过总请求数的 budget 比例"""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def _observe(self, latency: float):
+        with self._lock:
+            self._latency.add(latency)
+
+    def _call_primary(self, prompt: str, system_prompt: str) -> str:
+        start = time.perf_counter()
+        response_text = self.primary.generate_content(prompt, system_prompt)
+        self._observe(time.perf_counter() - start)
+        return response_text
+
+    async def _acall_primary(self, prompt: str, system_prompt: str) -> str:
+        start = time.perf_counter()
+        try:
+            response_text = await self.primary.agenerate_content(prompt, system_prompt)
+        except asyncio.CancelledError:
+            # 被对冲请求抢先时，已等待的时间作为延迟的下限计入
+            self._observe(time.perf_counter() - start)
+            raise
+        self._observe(time.perf_counter() - start)
+        return response_text
+
+    @staticmethod
+    def _submit(fn, *args) -> Future:
+        """在守护线程中执行 fn，返回 Future"""
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args))
+            except BaseException as error:
+                future.set_exception(error)
+
+        threading.Thread(target=run, name="hedge", daemon=True).start()
+        return future
+
+    def _won(self, hedged: bool):
+        if hedged:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def _generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        self._start_request()
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._call_primary(prompt, system_prompt)
+
+        primary = self._submit(self._call_primary, prompt, system_prompt)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self._take_budget():
+            return primary.result()
+
+        self.logger.debug(f"请求超过 {delay:.2f} 秒未返回，发出对冲请求")
+        hedge = self._submit(self.secondary.generate_content, prompt, system_prompt)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self._won(future is hedge)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        self._start_request()
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._acall_primary(prompt, system_prompt))
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._take_budget():
+            return await primary
+
+        self.logger.debug(f"请求超过 {delay:.2f} 秒未返回，发出对冲请求")
+        hedge = asyncio.ensure_future(self.secondary.agenerate_content(prompt, system_prompt))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._won(task is hedge)
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """速率限制与用量记录由被包装的服务商完成"""
+        return self._generate_content(prompt, system_prompt)
+
+    async def agenerate_content(self, prompt: str, system_prompt: str = "") -> str:
+        """generate_content 的异步版本"""
+        return await self._agenerate_content(prompt, system_prompt)
+
+    def generate_content_stream(self, prompt: str, system_prompt: str = "") -> Iterator[str]:
+        """流式请求不做对冲，直接使用主服务商"""
+        return self.primary.generate_content_stream(prompt, system_prompt)
+
+    def agenerate_content_stream(self, prompt: str, system_prompt: str = "") -> AsyncIterator[str]:
+        """agenerate_content_stream 同样不做对冲"""
+        return self.primary.agenerate_content_stream(prompt, system_prompt)
+
+    async def aclose(self):
+        await self.primary.aclose()
+        if self.secondary is not self.primary:
+            await self.secondary.aclose()
+
+    def provider_stats(self) -> Dict:
+        return {
+            **self.primary.provider_stats(),
+            "hedged_requests": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_seconds": self.hedge_delay()
+        }
+
+
+def create_ai_provider(config: Dict, provider_name: str, failover: Optional[List[str]] = None) -> AIProvider:
+    """
+    工厂方法：根据配置创建对应的 AI 服务商实例
+
+    给出 failover（备用服务商名称列表，按优先级排列，可为空列表）时，
+    返回为每个服务商配备熔断器的 FailoverProvider
+    """
+    if failover is not None:
+        names = [provider_name] + [name for name in failover if name != provider_name]
+        return FailoverProvider([(name, create_ai_provider(config, name)) for name in names])
+
+    if provider_name == "gemini":
+        if "gemini" not in config:
+            raise ValueError("配置中缺少 gemini 配置项")
+        return GeminiProvider(config["gemini"])
+
+    elif provider_name in ["qiniu", "deepseek"]:
+        if "qiniu" not in config:
+            raise ValueError("配置中缺少 qiniu 配置项")
+        return QiniuProvider(config["qiniu"])
+
+    elif provider_name == "mock":
+        return MockProvider(config.get("mock", {}))
+
+    else:
+        raise ValueError(f"不支持的服务商: {provider_name}，请选择 'gemini'、'qiniu' 或 'mock'")
@@ -5,98 +5,38 @@ Anki Card Enhancer: Anki 卡片内容增强工具
 """
 
 import pandas as pd
-import google.generativeai as genai
 import os
 import re
-import time
 import json
 import logging
 import argparse
 from pathlib import Path
-from tqdm import tqdm
-from typing import Dict, List, Optional, Any
-from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Iterable, Iterator
 
+from checkpoint_store import CheckpointStore
+from anki_export import open_anki_writer
+from card_pipeline import CardPipeline, has_trailing_placeholder
+from stream_parser import JsonStreamScanner, TextSectionScanner, output_sections
+from run_metrics import build_run_record, append_run_metrics, write_prometheus, output_length_report
 
-# ================= AI 服务商接口 =================
-class AIProvider(ABC):
-    """AI 服务商抽象基类"""
-
-    def __init__(self, config: Dict):
-        self.config = config
-        self.logger = logging.getLogger(__name__)
-
-    @abstractmethod
-    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
-        """生成内容，子类必须实现"""
-        pass
-
-
-class GeminiProvider(AIProvider):
-    """Google Gemini 服务商"""
-
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        os.environ["GOOGLE_API_KEY"] = config["api_key"]
-        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-        self.model = genai.GenerativeModel(config['model'])
-        self.logger.info(f"已初始化 Gemini 模型: {config['model']}")
-
-    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
-        """使用 Gemini 生成内容"""
-        response = self.model.generate_content(prompt)
-        return response.text
-
-
-class QiniuProvider(AIProvider):
-    """七牛云 AI 服务商（DeepSeek）"""
-
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        try:
-            from openai import OpenAI
-            self.client = OpenAI(
-                base_url=config["base_url"],
-                api_key=config["api_key"]
-            )
-            self.model = config['model']
-            self.logger.info(f"已初始化七牛云 AI 模型: {config['model']}")
-        except ImportError:
-            raise ImportError("请安装 openai 库: pip install openai")
-
-    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
-        """使用七牛云 AI 生成内容"""
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            stream=False,
-            max_tokens=4096
-        )
-        return response.choices[0].message.content
 
+# ================= Profile 管理 =================
+# 批量模式提示词：固定的任务说明在前，变化的卡片列表放在最后，
+# 使同一 Profile 的所有请求共享相同的前缀（便于服务商的前缀缓存命中）；
+# 原任务要求的纯文本输出放在 enhanced_back 字段中
+BATCH_PROMPT_TEMPLATE = """You will enhance a batch of cards in a single response. Apply exactly the same task to every card.
 
-def create_ai_provider(config: Dict, provider_name: str) -> AIProvider:
-    """工厂方法：根据配置创建对应的 AI 服务商实例"""
-    if provider_name == "gemini":
-        if "gemini" not in config:
-            raise ValueError("配置中缺少 gemini 配置项")
-        return GeminiProvider(config["gemini"])
+Task description (apply it to each card's own front_text and back_text):
+---
+{task}
+---
 
-    elif provider_name in ["qiniu", "deepseek"]:
-        if "qiniu" not in config:
-            raise ValueError("配置中缺少 qiniu 配置项")
-        return QiniuProvider(config["qiniu"])
+Return ONLY a JSON array with one object per card. Each object must contain "id" (copied from the card) and "enhanced_back": a string holding the complete enhanced back content, written exactly as the task description requires.
 
-    else:
-        raise ValueError(f"不支持的服务商: {provider_name}，请选择 'gemini' 或 'qiniu'")
+Cards ({count}):
+{items}"""
 
 
-# ================= Profile 管理 =================
 class EnhancementProfile:
     """增强场景配置类"""
 
@@ -108,20 +48,67 @@ class EnhancementProfile:
         self.output_format = profile_config.get("output_format", "text")
         self.input_fields = profile_config.get("input_fields", ["front_text", "back_text"])
         self.output_fields = profile_config.get("output_fields", ["front_text", "enhanced_back"])
+        # 固定前缀（需显式开启）：提示词中的固定说明在前，卡片内容放在最后
+        self.stable_prompt_prefix = profile_config.get("stable_prompt_prefix", False)
+        # 生成参数：按任务需要的输出长度设置 max_tokens，未设置时使用服务商默认值
+        self.max_tokens = profile_config.get("max_tokens")
+        self.temperature = profile_config.get("temperature")
+        stop_sequences = profile_config.get("stop_sequences")
+        self.stop_sequences = [stop_sequences] if isinstance(stop_sequences, str) else stop_sequences
 
     def validate(self) -> bool:
         """验证 Profile 配置是否有效"""
         if not self.user_prompt_template:
             raise ValueError(f"Profile '{self.name}' 缺少 user_prompt_template")
+        if self.max_tokens is not None and (not isinstance(self.max_tokens, int) or self.max_tokens <= 0):
+            raise ValueError(f"Profile '{self.name}' 的 max_tokens 必须是正整数")
         if not self.output_format:
             raise ValueError(f"Profile '{self.name}' 缺少 output_format")
         return True
 
-    def format_prompt(self, front_text: str, back_text: str) -> str:
-        """格式化增强提示词"""
+    def generation_options(self) -> Dict:
+        """传给服务商的生成参数（max_tokens / temperature / stop_sequences）"""
+        return {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "stop_sequences": self.stop_sequences
+        }
+
+    def static_instructions(self) -> str:
+        """提示词的固定部分：变量替换为对 <front_text> / <back_text> 输入块的引用"""
         return self.user_prompt_template.format(
-            front_text=front_text,
-            back_text=back_text
+            front_text="<front_text>",
+            back_text="<back_text>"
+        )
+
+    def format_prompt(self, front_text: str, back_text: str) -> str:
+        """
+        格式化增强提示词
+
+        开启 stable_prompt_prefix 且模板中变量之后还有固定说明时，固定说明保持原位（变量处引用输入块），
+        卡片的正面和背面作为输入块追加在末尾，所有请求的前缀逐字节相同。
+        """
+        if not self.stable_prompt_prefix or has_trailing_placeholder(self.user_prompt_template):
+            return self.user_prompt_template.format(
+                front_text=front_text,
+                back_text=back_text
+            )
+        return (
+            f"{self.static_instructions()}\n\n"
+            f"<front_text>\n{front_text}\n</front_text>\n"
+            f"<back_text>\n{back_text}\n</back_text>"
+        )
+
+    def format_batch_prompt(self, cards: List[Tuple[str, str]]) -> str:
+        """将多张 (front_text, back_text) 卡片打包为一个提示词，卡片 id 为其在列表中的位置"""
+        items = [
+            {"id": str(i), "front_text": front_text, "back_text": back_text}
+            for i, (front_text, back_text) in enumerate(cards)
+        ]
+        return BATCH_PROMPT_TEMPLATE.format(
+            task=self.static_instructions(),
+            count=len(cards),
+            items=json.dumps(items, ensure_ascii=False, indent=2, default=str)
         )
 
 
@@ -151,33 +138,13 @@ class ProfileManager:
 
 
 # ================= Anki 卡片增强器 =================
-class AnkiCardEnhancer:
-    """Anki 卡片增强器 - 基于已有内容进行补充完善"""
+class AnkiCardEnhancer(CardPipeline):
+    """Anki 卡片增强器 - 基于已有内容进行补充完善（每条输入为 (front_text, back_text)）"""
 
-    def __init__(self, config: Dict):
-        self.config = config
-        self.logger = logging.getLogger(__name__)
+    action_label = "增强"
 
-        # 初始化全局设置
-        self.global_settings = config.get("global_settings", {})
-        self.provider_name = self.global_settings.get("provider", "gemini")
-
-        # 初始化 AI 服务商
-        providers_config = config.get("providers", {})
-        self.ai_provider = create_ai_provider(providers_config, self.provider_name)
-
-        # 初始化 Profile 管理器
-        profiles_config = config.get("profiles", {})
-        self.profile_manager = ProfileManager(profiles_config)
-
-        # 获取当前激活的 Profile
-        active_profile_name = self.global_settings.get("active_profile")
-        if not active_profile_name:
-            raise ValueError("配置中缺少 active_profile，请指定要使用的 Profile")
-
-        self.profile = self.profile_manager.get_profile(active_profile_name)
-        self.logger.info(f"使用增强 Profile: {self.profile.name}")
-        self.logger.info(f"Profile 描述: {self.profile.description}")
+    def __init__(self, config: Dict):
+        super().__init__(config, ProfileManager(config.get("profiles", {})))
 
     def clean_response(self, response_text: str) -> str:
         """清理 AI 返回的内容"""
@@ -187,21 +154,13 @@ class AnkiCardEnhancer:
         clean_text = re.sub(r'^```\w*\n', '', clean_text, flags=re.MULTILINE)
         return clean_text.strip()
 
-    def call_ai_with_retry(self, prompt: str, max_retries: int = 3, delay: float = 2) -> str:
-        """带重试机制的 AI 调用"""
-        for attempt in range(max_retries):
-            try:
-                response_text = self.ai_provider.generate_content(
-                    prompt,
-                    self.profile.system_prompt
-                )
-                return response_text
-            except Exception as e:
-                self.logger.warning(f"AI 调用失败（尝试 {attempt + 1}/{max_retries}）: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (attempt + 1))
-                else:
-                    raise
+    def _stream_scanner(self, expected_items: Optional[int] = None):
+        """批量请求在收到 expected_items 条后结束，单条纯文本请求按模板中的【小节】判断"""
+        if expected_items:
+            return JsonStreamScanner(expected_items=expected_items)
+        if self.profile.output_format == "json":
+            return JsonStreamScanner()
+        return TextSectionScanner(output_sections(self.profile.user_prompt_template))
 
     def enhance_card(self, front_text: str, back_text: str) -> Dict[str, str]:
         """
@@ -210,13 +169,15 @@ class AnkiCardEnhancer:
         输出: dict 包含 front_text, enhanced_back
         """
         # 1. 格式化提示词
-        prompt = self.profile.format_prompt(front_text, back_text)
+        with self.timings.measure("prompt"):
+            prompt = self.profile.format_prompt(front_text, back_text)
 
         # 2. 调用 AI
         response_text = self.call_ai_with_retry(prompt)
 
         # 3. 清洗响应
-        enhanced_back = self.clean_response(response_text)
+        with self.timings.measure("parse"):
+            enhanced_back = self.clean_response(response_text)
 
         # 4. 构建结果
         return {
@@ -224,6 +185,53 @@ class AnkiCardEnhancer:
             "enhanced_back": enhanced_back
         }
 
+    async def aenhance_card(self, front_text: str, back_text: str) -> Dict[str, str]:
+        """enhance_card 的异步版本"""
+        with self.timings.measure("prompt"):
+            prompt = self.profile.format_prompt(front_text, back_text)
+        response_text = await self.acall_ai_with_retry(prompt)
+        with self.timings.measure("parse"):
+            enhanced_back = self.clean_response(response_text)
+        return {
+            "front_text": front_text,
+            "enhanced_back": enhanced_back
+        }
+
+    def row_key(self, item: Tuple[str, str]) -> str:
+        """计算输入行的稳定键（Profile + 正面 + 背面原始内容），用于断点续传"""
+        front_text, back_text = item
+        return CheckpointStore.make_key(self.profile.name, front_text, back_text)
+
+    def _process_item(self, item: Tuple[str, str]) -> Dict[str, str]:
+        return self.enhance_card(*item)
+
+    async def _aprocess_item(self, item: Tuple[str, str]) -> Dict[str, str]:
+        return await self.aenhance_card(*item)
+
+    def _clean_batch_response(self, response_text: str) -> str:
+        return response_text.replace('```json', '').replace('```', '').strip()
+
+    def _batch_card(self, item: Tuple[str, str], output: Optional[Dict]) -> Optional[Dict[str, str]]:
+        """批量响应中的对象包含非空的 enhanced_back 时构建卡片"""
+        enhanced_back = (output or {}).get("enhanced_back")
+        if not isinstance(enhanced_back, str) or not enhanced_back.strip():
+            return None
+        return {
+            "front_text": item[0],
+            "enhanced_back": self.clean_response(enhanced_back)
+        }
+
+    def _front_text(self, item: Tuple[str, str]) -> str:
+        return item[0]
+
+    def _error_card(self, item: Tuple[str, str], error: Exception) -> Dict[str, str]:
+        """创建一个部分填充的卡片，保留原始内容"""
+        front_text, back_text = item
+        return {
+            "front_text": front_text,
+            "enhanced_back": f"[增强失败: {str(error)[:100]}...]\n\n原始内容:\n{back_text}"
+        }
+
     def enhance_cards(
         self,
         input_df: pd.DataFrame,
@@ -244,64 +252,64 @@ class AnkiCardEnhancer:
         if not all(col in input_df.columns for col in required_columns):
             raise ValueError(f"输入数据缺少必需的列: {required_columns}")
 
-        # 检查是否有缓存
-        start_index = 0
-        if cache_file and Path(cache_file).exists():
-            self.logger.info(f"发现缓存文件，从断点继续...")
-            cache_df = pd.read_csv(cache_file)
-
-            # 验证缓存列匹配
-            required_cache_columns = ["front_text", "enhanced_back"]
-            if all(col in cache_df.columns for col in required_cache_columns):
-                start_index = len(cache_df)
-                self.logger.info(f"已完成 {start_index} 条，剩余 {len(input_df) - start_index} 条")
-            else:
-                self.logger.warning("缓存文件的列与当前 Profile 不匹配，将重新生成")
-                start_index = 0
-
-        # 初始化结果
-        results = []
-
-        # 增强卡片
-        request_delay = self.global_settings.get("request_delay", 1.0)
-        max_retries = self.global_settings.get("max_retries", 3)
-        save_interval = self.global_settings.get("save_interval", 10)
-
-        for index in tqdm(range(start_index, len(input_df)), desc="增强卡片"):
-            front_text = input_df.loc[index, "front_text"]
-            back_text = input_df.loc[index, "back_text"]
+        input_rows = zip(input_df["front_text"].tolist(), input_df["back_text"].tolist())
+        return pd.DataFrame(list(self.enhance_cards_iter(input_rows, cache_file=cache_file)))
 
-            try:
-                # 增强卡片
-                enhanced_card = self.enhance_card(front_text, back_text)
-                results.append(enhanced_card)
-
-                self.logger.info(f"✅ 第 {index + 1}/{len(input_df)} 条增强成功")
-
-                # 定期保存进度
-                if cache_file and (index + 1) % save_interval == 0:
-                    df = pd.DataFrame(results)
-                    df.to_csv(cache_file, index=False)
-                    self.logger.info(f"💾 进度已保存（已完成 {index + 1} 条）")
+    def _load_checkpoint(self, checkpoint: CheckpointStore) -> Tuple[Dict[str, Dict[str, str]], List[Optional[Dict[str, str]]], int]:
+        """
+        读取断点日志中已完成的卡片
 
-                # 避免触发 API 速率限制
-                time.sleep(request_delay)
+        返回: (行键 -> 卡片, 旧版无键记录（按位置）, 日志记录数)
+        """
+        required_cache_columns = ["front_text", "enhanced_back"]
+        done, legacy_cards = {}, []
+        records = checkpoint.load()
+        for record in records:
+            card = record.get("card", record)
+            key = record.get("key")
+            usable = not record.get("error") and all(col in card for col in required_cache_columns)
+            if key is None:
+                # 旧版缓存没有行键（也不含原始背面），只能按位置对应
+                legacy_cards.append(card if usable else None)
+            elif usable:
+                done[key] = card
+            else:
+                # 失败的卡片和列不匹配的卡片需要重新增强
+                done.pop(key, None)
+        self.logger.info(f"断点日志中已完成 {len(done) + len(legacy_cards)} 条")
+        return done, legacy_cards, len(records)
 
-            except Exception as e:
-                self.logger.error(f"❌ 第 {index + 1} 条处理失败: {e}")
-                # 创建一个部分填充的卡片
-                results.append({
-                    "front_text": front_text,
-                    "enhanced_back": f"[增强失败: {str(e)[:100]}...]\n\n原始内容:\n{back_text}"
-                })
+    def _reuse_legacy(
+        self,
+        rows: Dict[int, Tuple[str, str]],
+        keys: Dict[int, str],
+        results: Dict,
+        legacy_cards: List[Optional[Dict[str, str]]],
+        checkpoint: CheckpointStore
+    ):
+        """旧版记录按位置采用（正面一致时），并补写行键，日志压缩时才能保留"""
+        for index, (front_text, _) in rows.items():
+            legacy = legacy_cards[index] if index < len(legacy_cards) else None
+            if results[index] is None and legacy and str(legacy.get("front_text")) == str(front_text):
+                results[index] = legacy
+                checkpoint.append({"key": keys[index], "card": legacy, "error": False})
+
+    def enhance_cards_iter(
+        self,
+        input_rows: Iterable[Tuple[str, str]],
+        cache_file: Optional[str] = None
+    ) -> Iterator[Dict[str, str]]:
+        """
+        流式增强卡片：分块读取输入，按输入顺序逐块产出增强后的卡片
 
-        # 最终保存
-        if cache_file:
-            df = pd.DataFrame(results)
-            df.to_csv(cache_file, index=False)
-            self.logger.info("💾 最终进度已保存")
+        Args:
+            input_rows: (front_text, back_text) 的可迭代对象
+            cache_file: 缓存文件路径（支持断点续传）
 
-        return pd.DataFrame(results)
+        Yields:
+            Dict[str, str]: 按输入顺序产出的卡片
+        """
+        return self._iter_cards(input_rows, cache_file)
 
 
 # ================= 工具函数 =================
@@ -382,37 +390,105 @@ def load_input_data(source: str) -> pd.DataFrame:
         raise ValueError(f"不支持的文件格式: {source_path.suffix}")
 
 
-def export_to_anki(df: pd.DataFrame, filename: str, encoding: str = 'utf-8'):
-    """导出为 Anki 可识别的格式 (Tab 分隔，两列)"""
+def iter_input_data(source: str, chunksize: int = 1000) -> Iterator[Tuple[str, str]]:
+    """
+    流式读取输入数据，逐条产出 (front_text, back_text)，内存占用与文件大小无关
+    要求: 数据必须包含至少两列（Front, Back）
+    支持: .txt (Tab分隔，分块), .csv（分块）, .xlsx（openpyxl 只读模式）, .xls,
+          .apkg（逐条读取卡包中的笔记，取前两个字段）
+    """
     logger = logging.getLogger(__name__)
+    source_path = Path(source)
+
+    if not source_path.exists():
+        raise FileNotFoundError(f"文件不存在: {source}")
 
-    # 创建副本，避免修改原数据
-    export_df = df.copy()
+    if source_path.suffix == '.txt':
+        logger.info(f"从 TXT 文件分块读取数据: {source}")
+        # 先只读表头：如果没有列名，默认第一列是 Front，第二列是 Back
+        header = pd.read_csv(source, sep='\t', encoding='utf-8', nrows=0)
+        if str(header.columns[0]).startswith('Unnamed'):
+            chunks = pd.read_csv(source, sep='\t', header=None, encoding='utf-8',
+                                 names=['Front', 'Back'], chunksize=chunksize)
+        else:
+            chunks = pd.read_csv(source, sep='\t', encoding='utf-8', chunksize=chunksize)
+        for chunk in chunks:
+            yield from zip(chunk.iloc[:, 0].tolist(), chunk.iloc[:, 1].tolist())
+
+    elif source_path.suffix == '.csv':
+        logger.info(f"从 CSV 文件分块读取数据: {source}")
+        for chunk in pd.read_csv(source, encoding='utf-8', chunksize=chunksize):
+            # 确保有至少两列
+            if len(chunk.columns) < 2:
+                raise ValueError("CSV 文件至少需要两列数据")
+            yield from zip(chunk.iloc[:, 0].tolist(), chunk.iloc[:, 1].tolist())
+
+    elif source_path.suffix == '.xlsx':
+        logger.info(f"从 Excel 文件流式读取数据: {source}")
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            # 与 pd.read_excel 一致：第一行为表头，取前两列
+            rows = workbook.active.iter_rows(min_row=2, max_col=2, values_only=True)
+            for row in rows:
+                if len(row) < 2:
+                    raise ValueError("Excel 文件至少需要两列数据")
+                if row[0] is not None:
+                    yield row[0], row[1]
+        finally:
+            workbook.close()
+
+    elif source_path.suffix == '.apkg':
+        logger.info(f"从 Anki 卡包流式读取笔记: {source}")
+        from anki_extractor import iter_apkg_notes
+        for note in iter_apkg_notes(source):
+            fields = note["fields"]
+            yield fields[0], fields[1] if len(fields) > 1 else ""
+
+    elif source_path.suffix == '.xls':
+        # openpyxl 不支持旧版 .xls，整体读取
+        df = load_input_data(source)
+        yield from zip(df['front_text'].tolist(), df['back_text'].tolist())
+
+    else:
+        raise ValueError(f"不支持的文件格式: {source_path.suffix}")
+
+
+def export_to_anki(cards, filename: str, encoding: str = 'utf-8', **apkg_options) -> int:
+    """
+    导出为 Anki 可识别的格式 (Tab 分隔，两列)
+
+    cards 可以是 DataFrame，也可以是逐张产出卡片的可迭代对象（如 enhance_cards_iter），
+    后者每增强一张卡片就清理并写入一行，不在内存中保留全部卡片。
+    filename 以 .apkg 结尾时直接生成 Front/Back 两个字段的卡包（apkg_options 传给 AnkiApkgWriter）。
+
+    Returns:
+        int: 导出的卡片数
+    """
+    logger = logging.getLogger(__name__)
 
-    # 只导出 Front 和 Enhanced Back 两列
-    output_df = pd.DataFrame({
-        'Front': export_df['front_text'],
-        'Back': export_df['enhanced_back']
-    })
+    if isinstance(cards, pd.DataFrame):
+        cards = (
+            {"front_text": front, "enhanced_back": back}
+            for front, back in zip(cards['front_text'], cards['enhanced_back'])
+        )
 
-    # 替换换行符（但在 Anki 中可以使用 <br> 或 <br/>）
-    for col in output_df.columns:
-        output_df[col] = output_df[col].astype(str).str.replace('\r\n', '<br>', regex=False)
-        output_df[col] = output_df[col].astype(str).str.replace('\n', '<br>', regex=False)
-        output_df[col] = output_df[col].astype(str).str.replace('\t', '    ', regex=False)
+    # 只导出 Front 和 Enhanced Back 两列，换行符和制表符在写入时一次替换
+    with open_anki_writer(filename, columns=["Front", "Back"], encoding=encoding, **apkg_options) as writer:
+        for card in cards:
+            writer.write({"Front": card["front_text"], "Back": card["enhanced_back"]})
 
-    # 导出
-    output_df.to_csv(filename, sep='\t', index=False, header=False, encoding=encoding)
     logger.info(f"✅ 文件已保存: {filename}")
-    logger.info(f"📊 共 {len(df)} 张卡片")
+    logger.info(f"📊 共 {writer.count} 张卡片")
 
     # 生成统计报告
     print("\n" + "="*50)
     print("增强完成！统计信息：")
-    print(f"  总卡片数: {len(df)}")
-    print(f"  字段数: 2 (Front + Enhanced Back)")
+    print(f"  总卡片数: {writer.count}")
+    print("  字段数: 2 (Front + Enhanced Back)")
     print(f"  导出文件: {filename}")
     print("="*50)
+    return writer.count
 
 
 # ================= 主程序 =================
@@ -547,32 +623,85 @@ def main():
             print("请通过命令行参数 -i 指定，或在配置文件中设置 input_file")
             return 1
 
-        logger.info("开始加载数据...")
-        input_df = load_input_data(input_file)
-        logger.info(f"数据加载完成，共 {len(input_df)} 条")
+        if not Path(input_file).exists():
+            raise FileNotFoundError(f"文件不存在: {input_file}")
+
+        # 流式模式下实时显示第一条响应（逐段打印模型输出）
+        if enhancer.stream_responses and global_settings.get("stream_preview", True):
+            preview_started = []
+
+            def live_preview(chunk: str):
+                if not preview_started:
+                    print("\n--- 实时预览（第一条响应）---")
+                    preview_started.append(True)
+                print(chunk, end="", flush=True)
 
-        # 8. 增强卡片
+            enhancer.preview_callback = live_preview
+
+        # 8. 增强卡片并逐张导出（边读取、边增强、边写入）
         logger.info("开始增强 Anki 卡片...")
-        enhanced_df = enhancer.enhance_cards(
-            input_df,
-            cache_file=cache_file
+        output_file = global_settings.get("output_file", "anki_enhanced.txt")
+        output_encoding = global_settings.get("output_encoding", "utf-8")
+
+        preview_cards = []
+
+        def keep_preview(cards: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+            for card in cards:
+                if len(preview_cards) < 3:
+                    preview_cards.append(card)
+                yield card
+
+        input_rows = iter_input_data(input_file)
+        export_to_anki(
+            keep_preview(enhancer.enhance_cards_iter(input_rows, cache_file=cache_file)),
+            output_file,
+            encoding=output_encoding,
+            deck_name=global_settings.get("deck_name"),
+            model_name=f"Anki Card Enhancer: {enhancer.profile.name}"
         )
 
         # 9. 打印预览
         print("\n--- 数据预览（前3条）---")
         try:
-            for idx in range(min(3, len(enhanced_df))):
+            for idx, card in enumerate(preview_cards):
                 print(f"\n【卡片 {idx + 1}】")
-                print(f"正面:\n{enhanced_df.loc[idx, 'front_text']}")
-                print(f"\n背面（前200字符）:\n{enhanced_df.loc[idx, 'enhanced_back'][:200]}...")
+                print(f"正面:\n{card['front_text']}")
+                print(f"\n背面（前200字符）:\n{str(card['enhanced_back'])[:200]}...")
         except (UnicodeEncodeError, UnicodeDecodeError) as e:
             print(f"[预览显示错误: {e}]")
-            print("数据已成功处理，文件将正常保存。")
-
-        # 10. 导出
-        output_file = global_settings.get("output_file", "anki_enhanced.txt")
-        output_encoding = global_settings.get("output_encoding", "utf-8")
-        export_to_anki(enhanced_df, output_file, encoding=output_encoding)
+            print("数据已成功处理，文件已正常保存。")
+
+        # 10. 各阶段耗时汇总（可选输出 Prometheus 文本格式）
+        if enhancer.timings.stages:
+            print("\n--- 各阶段耗时 ---")
+            print(enhancer.timings.summary_table())
+        prometheus_file = global_settings.get("prometheus_file")
+        if prometheus_file:
+            write_prometheus(prometheus_file, enhancer.timings, labels={"tool": "anki_enhancer", "profile": enhancer.profile.name})
+            logger.info(f"阶段耗时已写入 {prometheus_file}（Prometheus 文本格式）")
+
+        # 输出长度测量模式：按每次调用的输出 token 分布建议 Profile 的 max_tokens
+        if enhancer.measure_output_length:
+            print("\n--- 输出长度测量 ---")
+            print(output_length_report(
+                enhancer.ai_provider.usage,
+                current_limit=enhancer.profile.max_tokens,
+                batch_size=max(1, int(global_settings.get("batch_size", 1)))
+            ))
+
+        # 11. 写入运行指标（按 Profile 记录 token 用量与耗时）
+        metrics_file = global_settings.get("metrics_file", "run_metrics.jsonl")
+        if metrics_file:
+            record = build_run_record(
+                "anki_enhancer", enhancer.profile.name, enhancer.provider_name, enhancer.ai_provider, enhancer.run_stats
+            )
+            append_run_metrics(metrics_file, record)
+            usage = record["usage"]
+            logger.info(
+                f"运行指标已写入 {metrics_file}: {usage['calls']} 次调用，"
+                f"平均耗时 {usage['avg_latency_seconds']} 秒，"
+                f"{record['cards_per_second']} 张/秒"
+            )
 
         logger.info("="*50)
         logger.info("程序执行完成！")
@@ -0,0 +1,341 @@
+"""
+Anki 导出：逐张卡片写入 Tab 分隔的文本文件，或直接生成 .apkg 卡包
+每张卡片生成后立即清理并写入，内存占用与卡片总数无关
+"""
+
+import os
+import re
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import zipfile
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+
+# 一次遍历完成全部替换：换行 -> <br>，回车删除（\r\n 因此也只产生一个 <br>），制表符 -> 4 个空格
+_SANITIZE_TABLE = str.maketrans({"\n": "<br>", "\r": "", "\t": "    "})
+
+
+def sanitize_field(value: Any) -> str:
+    """将字段值转为 Anki 可导入的单行文本"""
+    if value is None:
+        return ""
+    return str(value).translate(_SANITIZE_TABLE)
+
+
+class AnkiTsvWriter:
+    """
+    流式写入 Anki 可识别的 Tab 分隔文件（无表头）
+
+    Args:
+        filename: 输出文件路径
+        columns: 按顺序导出的卡片字段；为空时使用第一张卡片的字段顺序
+        encoding: 输出编码（与 output_encoding 设置一致，如 utf-8、utf-8-sig、gbk）
+    """
+
+    def __init__(self, filename: str, columns: Optional[List[str]] = None, encoding: str = 'utf-8'):
+        self.filename = filename
+        self.columns = list(columns) if columns else None
+        self.encoding = encoding
+        self.count = 0
+        self.logger = logging.getLogger(__name__)
+
+        # 与 pandas.to_csv 的输出格式一致：最小引号、系统换行符
+        self._file = open(filename, 'w', encoding=encoding, newline='')
+        self._writer = csv.writer(self._file, delimiter='\t', lineterminator=os.linesep)
+
+    def write(self, card: Dict[str, Any]):
+        """清理并写入一张卡片，缺少的字段写为空"""
+        if self.columns is None:
+            self.columns = list(card.keys())
+        self._writer.writerow([sanitize_field(card.get(col)) for col in self.columns])
+        self.count += 1
+
+    def close(self):
+        """关闭文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ================= .apkg 卡包 =================
+# collection.anki2（schema 11）的建表语句，与 Anki 2.1 导出的卡包一致
+APKG_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+_HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
+def _strip_html(text: str) -> str:
+    """排序字段和校验和使用去掉 HTML 标签后的文本（与 Anki 一致）"""
+    return _HTML_TAG_PATTERN.sub('', text)
+
+
+def _stable_id(text: str) -> int:
+    """由名称计算稳定的 id，重复导出同名牌组/笔记类型时 Anki 会合并而不是新建"""
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:12], 16) % (1 << 40) + (1 << 40)
+
+
+class AnkiApkgWriter:
+    """
+    流式写入 Anki 卡包 (.apkg)：一个笔记类型、一个牌组，每张卡片对应一条笔记
+
+    笔记按 batch_size 分批 executemany 插入，整个牌组只在 close() 时提交一次事务；
+    数据库先写入临时文件，关闭时与媒体清单（及可选的媒体文件）一起打包为 zip。
+
+    Args:
+        filename: 输出 .apkg 路径
+        columns: 按顺序导出的卡片字段（即笔记类型的字段）；为空时使用第一张卡片的字段顺序
+        deck_name: 牌组名称，默认使用输出文件名
+        model_name: 笔记类型名称
+        tags: 添加到每条笔记上的标签
+        media_files: 需要一起打包的媒体文件路径（笔记中按文件名引用）
+        batch_size: 每次 executemany 插入的笔记数
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        columns: Optional[List[str]] = None,
+        deck_name: Optional[str] = None,
+        model_name: str = "Anki Assistant",
+        tags: Optional[List[str]] = None,
+        media_files: Optional[List[str]] = None,
+        batch_size: int = 1000
+    ):
+        self.filename = filename
+        self.columns = list(columns) if columns else None
+        self.deck_name = deck_name or Path(filename).stem
+        self.model_name = model_name
+        self.tags = " ".join(tags) if tags else ""
+        self.media_files = list(media_files or [])
+        self.batch_size = max(1, int(batch_size))
+        self.count = 0
+        self.logger = logging.getLogger(__name__)
+
+        self.model_id = _stable_id(f"model\x1f{model_name}")
+        self.deck_id = _stable_id(f"deck\x1f{self.deck_name}")
+        # 笔记/卡片 id 为毫秒时间戳加序号，保证同一次导出内唯一
+        self._now = int(time.time())
+        self._id_base = self._now * 1000
+        self._notes = []
+        self._cards = []
+        # 按内容计算的 guid -> 出现次数，内容完全相同的笔记按序号区分
+        self._guid_counts: Dict[str, int] = {}
+
+        # 临时数据库只用于打包，关闭日志与同步写盘
+        fd, self._db_path = tempfile.mkstemp(
+            suffix=".anki2", dir=str(Path(filename).resolve().parent)
+        )
+        os.close(fd)
+        self.conn = sqlite3.connect(self._db_path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(APKG_SCHEMA)
+
+    def write(self, card: Dict[str, Any]):
+        """清理并加入一张卡片，每满 batch_size 条批量插入一次"""
+        if self.columns is None:
+            self.columns = list(card.keys())
+        # \x1f 是 Anki 的字段分隔符，不能出现在字段内容中
+        fields = [sanitize_field(card.get(col)).replace("\x1f", " ") for col in self.columns]
+        sort_field = _strip_html(fields[0])
+        checksum = int(hashlib.sha1(sort_field.encode('utf-8')).hexdigest()[:8], 16)
+        guid = self._guid(fields)
+
+        item_id = self._id_base + self.count
+        self._notes.append((
+            item_id, guid, self.model_id, self._now, -1, f" {self.tags} " if self.tags else "",
+            "\x1f".join(fields), sort_field, checksum, 0, ""
+        ))
+        # 新卡片：type = queue = 0，due 为新卡片顺序
+        self._cards.append((
+            item_id, item_id, self.deck_id, 0, self._now, -1,
+            0, 0, self.count + 1, 0, 0, 0, 0, 0, 0, 0, 0, ""
+        ))
+        self.count += 1
+        if len(self._notes) >= self.batch_size:
+            self._flush_batch()
+
+    def _guid(self, fields: List[str]) -> str:
+        """
+        笔记 guid：由笔记类型和全部字段计算，重新导出同样的内容得到相同的 guid
+
+        Anki 按 guid 判断导入的笔记是否已存在，只用正面字段会让正面相同、背面不同的笔记互相覆盖；
+        内容完全相同的笔记再加上出现序号，保证同一卡包内 guid 唯一。
+        """
+        content = "\x1f".join([self.model_name] + fields)
+        guid = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+        occurrence = self._guid_counts.get(guid, 0)
+        self._guid_counts[guid] = occurrence + 1
+        if occurrence:
+            guid = hashlib.sha1(f"{content}\x1f{occurrence}".encode('utf-8')).hexdigest()[:16]
+        return guid
+
+    def _flush_batch(self):
+        """批量插入已缓冲的笔记和卡片（不提交，整个牌组共用一个事务）"""
+        if not self._notes:
+            return
+        self.conn.executemany(
+            "INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._notes
+        )
+        self.conn.executemany(
+            "INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._cards
+        )
+        self._notes = []
+        self._cards = []
+
+    def _model(self) -> Dict:
+        """笔记类型：第一个字段为正面，其余字段依次显示在背面"""
+        columns = self.columns or ["front_text"]
+        back = "<br>\n".join("{{%s}}" % name for name in columns[1:])
+        return {
+            "id": self.model_id,
+            "name": self.model_name,
+            "type": 0,
+            "mod": self._now,
+            "usn": -1,
+            "sortf": 0,
+            "did": self.deck_id,
+            "tmpls": [{
+                "name": "Card 1",
+                "ord": 0,
+                "qfmt": "{{%s}}" % columns[0],
+                "afmt": "{{FrontSide}}\n\n<hr id=answer>\n\n" + back,
+                "did": None,
+                "bqfmt": "",
+                "bafmt": ""
+            }],
+            "flds": [
+                {"name": name, "ord": i, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+                for i, name in enumerate(columns)
+            ],
+            "css": ".card {\n font-family: arial;\n font-size: 20px;\n text-align: center;\n"
+                   " color: black;\n background-color: white;\n}\n",
+            "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+                        "\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n"
+                        "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+            "latexPost": "\\end{document}",
+            "tags": [],
+            "vers": [],
+            "req": [[0, "any", [0]]]
+        }
+
+    def _deck(self, deck_id: int, name: str) -> Dict:
+        return {
+            "id": deck_id, "name": name, "mod": self._now, "usn": -1, "desc": "",
+            "dyn": 0, "conf": 1, "collapsed": False, "extendNew": 10, "extendRev": 50,
+            "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0]
+        }
+
+    def _write_collection_row(self):
+        """写入 col 表：牌组、笔记类型与默认学习选项"""
+        conf = {
+            "activeDecks": [1], "curDeck": 1, "newSpread": 0, "collapseTime": 1200,
+            "timeLim": 0, "estTimes": True, "dueCounts": True, "curModel": None,
+            "nextPos": self.count + 1, "sortType": "noteFld", "sortBackwards": False,
+            "addToCur": True
+        }
+        decks = {
+            "1": self._deck(1, "Default"),
+            str(self.deck_id): self._deck(self.deck_id, self.deck_name)
+        }
+        dconf = {"1": {
+            "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "timer": 0,
+            "autoplay": True, "replayq": True, "dyn": False,
+            "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500,
+                    "order": 1, "perDay": 20, "bury": True, "separate": True},
+            "rev": {"perDay": 100, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1,
+                    "maxIvl": 36500, "bury": True, "minSpace": 1},
+            "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0}
+        }}
+        self.conn.execute(
+            "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+            (
+                self._now - self._now % 86400, self._id_base, self._id_base,
+                json.dumps(conf), json.dumps({str(self.model_id): self._model()}),
+                json.dumps(decks), json.dumps(dconf)
+            )
+        )
+
+    def close(self):
+        """提交事务并打包为 .apkg"""
+        if self.conn is None:
+            return
+        try:
+            self._flush_batch()
+            self._write_collection_row()
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+            # 媒体文件在 zip 中以序号命名，media 清单记录序号到文件名的映射
+            media_map = {}
+            with zipfile.ZipFile(self.filename, 'w', zipfile.ZIP_DEFLATED) as apkg:
+                apkg.write(self._db_path, "collection.anki2")
+                for i, media_path in enumerate(self.media_files):
+                    apkg.write(media_path, str(i))
+                    media_map[str(i)] = os.path.basename(media_path)
+                apkg.writestr("media", json.dumps(media_map, ensure_ascii=False))
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            os.remove(self._db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_anki_writer(filename: str, columns: Optional[List[str]] = None, encoding: str = 'utf-8', **apkg_options):
+    """按输出文件扩展名选择导出格式：.apkg 直接生成卡包，其余为 Tab 分隔文本"""
+    if Path(filename).suffix.lower() == '.apkg':
+        return AnkiApkgWriter(filename, columns=columns, **apkg_options)
+    return AnkiTsvWriter(filename, columns=columns, encoding=encoding)
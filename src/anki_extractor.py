@@ -1,19 +1,324 @@
 import zipfile
 import sqlite3
 import os
+import re
+import csv
+import html
+import json
 import shutil
 import argparse
+import io
 import sys
+import time
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stdout
 from datetime import datetime
 
-def extract_anki_apkg(apkg_path, output_folder=None, save_to_file=True):
+try:
+    import zstandard  # 新版卡包 (collection.anki21b) 使用 zstd 压缩
+except ImportError:
+    zstandard = None
+
+# 每次从游标读取的笔记条数
+FETCH_BATCH_SIZE = 1000
+
+# 卡包中的数据库文件名，按优先级排列：
+# 新版 Anki 导出 anki21b（zstd 压缩）或 anki21，collection.anki2 只保留一个提示升级的占位数据库
+COLLECTION_MEMBERS = ["collection.anki21b", "collection.anki21", "collection.anki2"]
+
+# zstd 帧的魔数，用于识别新版卡包中压缩过的媒体清单和媒体文件
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _find_collection_member(zip_ref):
+    """选择卡包中最新格式的数据库文件"""
+    names = set(zip_ref.namelist())
+    for member in COLLECTION_MEMBERS:
+        if member in names:
+            return member
+    return None
+
+
+def _open_member(zip_ref, member):
+    """打开卡包中的文件，zstd 压缩的文件（anki21b）边读边解压"""
+    src = zip_ref.open(member)
+    if not member.endswith(".anki21b"):
+        return src
+    if zstandard is None:
+        src.close()
+        raise ImportError("读取新版卡包 (collection.anki21b) 需要安装 zstandard 库: pip install zstandard")
+    return zstandard.ZstdDecompressor().stream_reader(src, closefd=True)
+
+
+@contextmanager
+def open_collection(apkg_path, in_memory=False):
+    """
+    只从卡包中取出数据库文件并打开，不解压媒体文件
+
+    支持 collection.anki21b（zstd 压缩）、collection.anki21 和 collection.anki2，优先使用最新格式。
+
+    参数:
+        apkg_path: .apkg文件路径
+        in_memory: True 时将数据库读入内存（sqlite3 deserialize，需要 Python 3.11+），
+                   否则流式复制（解压）到临时文件，用完即删
+
+    返回:
+        sqlite3.Connection
+    """
+    with zipfile.ZipFile(apkg_path, 'r') as zip_ref:
+        member = _find_collection_member(zip_ref)
+        if member is None:
+            raise FileNotFoundError(f"未找到数据库文件 {' / '.join(COLLECTION_MEMBERS)}: {apkg_path}")
+
+        if in_memory and hasattr(sqlite3.Connection, "deserialize"):
+            with _open_member(zip_ref, member) as src:
+                data = src.read()
+            conn = sqlite3.connect(":memory:")
+            conn.deserialize(data)
+            tmp_path = None
+        else:
+            fd, tmp_path = tempfile.mkstemp(suffix=".anki2")
+            with os.fdopen(fd, 'wb') as dst, _open_member(zip_ref, member) as src:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+            conn = sqlite3.connect(tmp_path)
+
+    try:
+        yield conn
+    finally:
+        conn.close()
+        if tmp_path:
+            os.remove(tmp_path)
+
+
+def _read_varint(data, pos):
+    """读取 protobuf varint，返回 (值, 新位置)"""
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _parse_media_entries(data):
+    """
+    解析新版卡包的媒体清单（protobuf MediaEntries，只取文件名）
+    结构: MediaEntries { repeated MediaEntry entries = 1; }  MediaEntry { string name = 1; ... }
+    第 i 个条目对应 zip 中名为 str(i) 的文件
+    """
+    names = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        length, pos = _read_varint(data, pos)
+        entry, pos = data[pos:pos + length], pos + length
+        if key >> 3 != 1:
+            continue
+        name = ""
+        entry_pos = 0
+        while entry_pos < len(entry):
+            entry_key, entry_pos = _read_varint(entry, entry_pos)
+            wire_type = entry_key & 0x7
+            if wire_type == 0:
+                _, entry_pos = _read_varint(entry, entry_pos)
+            elif wire_type == 2:
+                value_length, entry_pos = _read_varint(entry, entry_pos)
+                value = entry[entry_pos:entry_pos + value_length]
+                entry_pos += value_length
+                if entry_key >> 3 == 1:
+                    name = value.decode('utf-8')
+            else:
+                break
+        names.append(name)
+    return {str(i): name for i, name in enumerate(names)}
+
+
+def _read_media_map(zip_ref):
+    """读取媒体清单：旧版为 JSON {序号: 文件名}，新版为 zstd 压缩的 protobuf"""
+    data = zip_ref.read("media")
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImportError("读取新版卡包的媒体文件需要安装 zstandard 库: pip install zstandard")
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            return _parse_media_entries(reader.read())
+    return json.loads(data.decode('utf-8') or "{}")
+
+
+def extract_media(apkg_path, output_folder):
+    """
+    按需解压卡包中的媒体文件，并按 media 清单还原为原始文件名
+
+    返回:
+        int: 解压的媒体文件数
+    """
+    with zipfile.ZipFile(apkg_path, 'r') as zip_ref:
+        names = set(zip_ref.namelist())
+        if "media" not in names:
+            return 0
+        media_map = _read_media_map(zip_ref)
+        if not media_map:
+            return 0
+
+        media_folder = os.path.join(output_folder, "media")
+        os.makedirs(media_folder, exist_ok=True)
+        count = 0
+        for member, filename in media_map.items():
+            if member not in names or not filename:
+                continue
+            # 只取文件名，防止清单中的路径写到目录之外
+            target = os.path.join(media_folder, os.path.basename(filename))
+            with zip_ref.open(member) as src, open(target, 'wb') as dst:
+                # 新版卡包中的媒体文件同样是 zstd 压缩的
+                compressed = src.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC
+                src.seek(0)
+                if compressed and zstandard is not None:
+                    with zstandard.ZstdDecompressor().stream_reader(src) as reader:
+                        shutil.copyfileobj(reader, dst, COPY_CHUNK_SIZE)
+                else:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+            count += 1
+        return count
+
+
+def get_notetypes(conn):
+    """
+    读取笔记类型及其字段名
+
+    新版数据库 (schema 18, anki21b) 使用 notetypes / fields 表，
+    旧版 (anki2 / anki21) 将笔记类型以 JSON 存在 col.models 中。
+
+    返回:
+        dict: {笔记类型 id: {"name": 名称, "fields": [字段名, ...]}}
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    notetypes = {}
+    if "notetypes" in tables and "fields" in tables:
+        for ntid, name in conn.execute("SELECT id, name FROM notetypes"):
+            notetypes[ntid] = {"name": name, "fields": []}
+        for ntid, _, name in conn.execute("SELECT ntid, ord, name FROM fields ORDER BY ntid, ord"):
+            notetypes.setdefault(ntid, {"name": str(ntid), "fields": []})["fields"].append(name)
+    else:
+        row = conn.execute("SELECT models FROM col").fetchone()
+        for mid, model in json.loads(row[0] if row and row[0] else "{}").items():
+            fields = sorted(model.get("flds", []), key=lambda field: field.get("ord", 0))
+            notetypes[int(mid)] = {
+                "name": model.get("name", mid),
+                "fields": [field["name"] for field in fields]
+            }
+    return notetypes
+
+
+# 换行类标签替换为空格，其余标签直接删除
+_HTML_TAG_PATTERN = re.compile(r'<\s*(/?)\s*(br|div|p|li|tr)\b[^>]*>|<[^>]*>', re.IGNORECASE)
+
+
+def clean_html(text):
+    """去除 HTML 标签和实体、合并多余空白（一次正则替换）"""
+    text = _HTML_TAG_PATTERN.sub(lambda m: ' ' if m.group(2) else '', text)
+    return ' '.join(html.unescape(text).split())
+
+
+def get_field_columns(conn, notetypes):
+    """
+    结构化输出的字段列：所有笔记类型的字段名按出现顺序合并（同名字段共用一列）
+    找不到笔记类型的笔记，以及字段数多于笔记类型定义的笔记（模式漂移），
+    多出的字段使用 字段N 作为列名（与 note_to_row 一致）
+    """
+    columns = []
+    for notetype in notetypes.values():
+        for name in notetype["fields"]:
+            if name not in columns:
+                columns.append(name)
+
+    # 按笔记类型统计笔记中实际的最大字段数（一次聚合查询，不读取笔记内容）
+    for mid, max_fields in conn.execute(
+        "SELECT mid, MAX(LENGTH(flds) - LENGTH(REPLACE(flds, char(31), '')) + 1) FROM notes GROUP BY mid"
+    ):
+        known = len(notetypes[mid]["fields"]) if mid in notetypes else 0
+        for i in range(known, max_fields or 0):
+            name = f"字段{i + 1}"
+            if name not in columns:
+                columns.append(name)
+    return columns
+
+
+def note_to_row(note, notetypes, strip_html=True):
+    """将笔记转为按字段名索引的字典（CSV 的一行）"""
+    notetype = notetypes.get(note["mid"])
+    names = notetype["fields"] if notetype else []
+    row = {}
+    for i, value in enumerate(note["fields"]):
+        name = names[i] if i < len(names) else f"字段{i + 1}"
+        row[name] = clean_html(value) if strip_html else value
+    row["note_id"] = note["id"]
+    row["notetype"] = notetype["name"] if notetype else note["mid"]
+    row["tags"] = " ".join(note["tags"])
+    return row
+
+
+def iter_notes(conn, batch_size=FETCH_BATCH_SIZE):
+    """
+    逐条读取 collection 数据库中的笔记，内存占用与笔记总数无关
+
+    参数:
+        conn: collection 数据库连接（见 open_collection）
+        batch_size: 每次 fetchmany 读取的条数
+
+    产出:
+        dict: {"id": 笔记 id, "mid": 笔记类型 id, "fields": 字段列表, "tags": 标签列表}
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, mid, flds, tags FROM notes ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for note_id, mid, flds, tags in rows:
+            yield {
+                "id": note_id,
+                "mid": mid,
+                "fields": flds.split('\x1f'),
+                "tags": tags.split()
+            }
+
+
+def count_notes(conn):
+    """统计笔记条数（不读取笔记内容）"""
+    return conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+
+def iter_apkg_notes(apkg_path, batch_size=FETCH_BATCH_SIZE, in_memory=False):
+    """
+    作为库使用的生成器：直接从卡包逐条产出笔记（格式同 iter_notes），不解压到磁盘
+    例如 anki_enhancer 可以直接以 .apkg 作为输入
+    """
+    with open_collection(apkg_path, in_memory) as conn:
+        yield from iter_notes(conn, batch_size)
+
+
+def extract_anki_apkg(apkg_path, output_folder=None, save_to_file=True, with_media=False, in_memory=False, stats=None,
+                      output_format="csv", strip_html=True):
     """
     提取Anki卡包文件内容
 
+    只从卡包中读取数据库文件，不解压整个卡包；媒体文件仅在 with_media=True 时解压。
+
     参数:
         apkg_path: .apkg文件路径
         output_folder: 输出文件夹路径，如果为None则自动生成
         save_to_file: 是否将结果保存到文件
+        with_media: 是否解压媒体文件到 输出文件夹/media
+        in_memory: 是否将数据库读入内存（否则使用临时文件）
+        stats: 可选的字典，提取后写入笔记数 stats["notes"]
+        output_format: "csv" 按字段名输出结构化的 提取结果.csv（可直接作为增强器输入）；
+                       "txt" 输出旧版 "卡片 N: a | b" 格式的 提取结果.txt
+        strip_html: 输出 CSV 时是否同时去除字段中的 HTML 标签
     """
     # 检查输入文件是否存在
     if not os.path.exists(apkg_path):
@@ -25,78 +330,155 @@ def extract_anki_apkg(apkg_path, output_folder=None, save_to_file=True):
         base_name = os.path.splitext(os.path.basename(apkg_path))[0]
         output_folder = f"extracted_{base_name}"
 
-    # 1. 解压 .apkg 文件
-    print(f"[解压] 正在解压: {apkg_path}")
-    if not os.path.exists(output_folder):
+    if (save_to_file or with_media) and not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
+    # 1. 按需解压媒体文件
+    if with_media:
+        try:
+            media_count = extract_media(apkg_path, output_folder)
+            print(f"[媒体] 解压 {media_count} 个媒体文件到: {os.path.join(output_folder, 'media')}")
+        except Exception as e:
+            print(f"[错误] 解压媒体文件失败: {e}")
+            return False
+
+    # 2. 只读取数据库文件 (collection.anki2)
+    print(f"[读取] 正在读取: {apkg_path}")
     try:
-        with zipfile.ZipFile(apkg_path, 'r') as zip_ref:
-            zip_ref.extractall(output_folder)
-        print(f"[完成] 解压完成，文件位于: {output_folder}")
-    except Exception as e:
-        print(f"[错误] 解压失败: {e}")
+        with open_collection(apkg_path, in_memory) as conn:
+            return _extract_notes(conn, apkg_path, output_folder, save_to_file, stats, output_format, strip_html)
+    except (FileNotFoundError, ImportError) as e:
+        print(f"[错误] {e}")
         return False
-
-    # 2. 连接到 SQLite 数据库 (collection.anki2)
-    db_path = os.path.join(output_folder, "collection.anki2")
-
-    if not os.path.exists(db_path):
-        print("[错误] 未找到数据库文件 collection.anki2")
+    except (zipfile.BadZipFile, OSError) as e:
+        print(f"[错误] 读取卡包失败: {e}")
         return False
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
 
-    # 3. 查询笔记内容 (Notes 表)
+def _extract_notes(conn, apkg_path, output_folder, save_to_file, stats=None, output_format="csv", strip_html=True):
+    """读取笔记并输出到控制台和结果文件"""
+    # 逐批读取笔记内容 (Notes 表)，边读边写入结果文件
+    output_file = os.path.join(output_folder, f"提取结果.{output_format}")
+    out = None
+    writer = None
     try:
-        cursor.execute("SELECT flds FROM notes")
-        rows = cursor.fetchall()
-
-        print(f"\n[笔记] 提取到 {len(rows)} 条笔记\n")
-
-        # 准备输出内容
-        output_lines = []
-        output_lines.append(f"=" * 60)
-        output_lines.append(f"Anki 卡包提取结果")
-        output_lines.append(f"源文件: {apkg_path}")
-        output_lines.append(f"提取时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        output_lines.append(f"卡片数量: {len(rows)}")
-        output_lines.append(f"=" * 60)
-        output_lines.append("")
-
-        for idx, row in enumerate(rows):
-            # 将分隔符替换为更容易阅读的符号
-            content = row[0].replace('\x1f', ' | ')
-
-            # 控制台输出（显示前10条和后5条）
-            if idx < 10 or idx >= len(rows) - 5:
-                print(f"卡片 {idx+1}: {content}")
+        total = count_notes(conn)
+        if stats is not None:
+            stats["notes"] = total
+        notetypes = get_notetypes(conn)
+        print(f"\n[笔记] 提取到 {total} 条笔记")
+        for notetype in notetypes.values():
+            print(f"[笔记类型] {notetype['name']}: {', '.join(notetype['fields'])}")
+        print()
 
-            # 保存到输出列表
-            output_lines.append(f"卡片 {idx+1}: {content}")
-
-        if len(rows) > 15:
-            print(f"\n... (省略中间 {len(rows) - 15} 条卡片) ...\n")
-
-        # 4. 保存到文件
         if save_to_file:
-            output_file = os.path.join(output_folder, "提取结果.txt")
             try:
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write('\n'.join(output_lines))
-                print(f"\n[保存] 结果已保存到: {output_file}")
+                if output_format == "csv":
+                    # 按字段名输出，每条笔记一行，HTML 在写入时清理
+                    # 字段列在前、元数据列在后，前两列即可作为增强器的 Front / Back 输入
+                    out = open(output_file, 'w', encoding='utf-8', newline='')
+                    writer = csv.DictWriter(
+                        out,
+                        fieldnames=get_field_columns(conn, notetypes) + ["note_id", "notetype", "tags"],
+                        restval='',
+                        extrasaction='ignore'
+                    )
+                    writer.writeheader()
+                else:
+                    out = open(output_file, 'w', encoding='utf-8')
+                    out.write('\n'.join([
+                        "=" * 60,
+                        "Anki 卡包提取结果",
+                        f"源文件: {apkg_path}",
+                        f"提取时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                        f"卡片数量: {total}",
+                        "=" * 60,
+                        ""
+                    ]))
             except Exception as e:
                 print(f"[警告] 保存文件失败: {e}")
+                if out:
+                    out.close()
+                out = writer = None
+
+        # 控制台输出前10条和后5条，后5条在读完后才能确定
+        tail = deque(maxlen=5)
+        skipped = 0
+        for idx, note in enumerate(iter_notes(conn)):
+            # 将分隔符替换为更容易阅读的符号
+            content = ' | '.join(note["fields"])
+            line = f"卡片 {idx+1}: {content}"
+
+            if idx < 10:
+                print(line)
+            else:
+                tail.append(line)
+
+            if writer:
+                # 单条异常的笔记只跳过该条，不中断整个卡包
+                try:
+                    writer.writerow(note_to_row(note, notetypes, strip_html))
+                except (ValueError, csv.Error) as e:
+                    skipped += 1
+                    print(f"[警告] 笔记 {note['id']} 写入失败，已跳过: {e}")
+            elif out:
+                out.write('\n' + line)
 
-        print(f"\n[完成] 提取完成！")
+        if total > 15:
+            print(f"\n... (省略中间 {total - 15} 条卡片) ...\n")
+        for line in tail:
+            print(line)
+        if skipped:
+            print(f"\n[警告] 共跳过 {skipped} 条无法写入的笔记")
+
+        if out:
+            out.close()
+            out = None
+            print(f"\n[保存] 结果已保存到: {output_file}")
+
+        print("\n[完成] 提取完成！")
         return True
 
     except sqlite3.Error as e:
         print(f"[错误] 读取数据库出错: {e}")
         return False
     finally:
-        conn.close()
+        if out:
+            out.close()
+
+
+def extract_deck(apkg_path, output_folder=None, save_to_file=True, with_media=False, in_memory=False,
+                 output_format="csv", strip_html=True, quiet=False):
+    """
+    提取单个卡包并返回结果摘要，可在子进程中运行
+
+    参数:
+        quiet: 为 True 时不直接打印，控制台输出保存在返回结果的 log 中
+               （并行提取时由主进程按卡包整段打印，避免多个进程的输出交错）
+
+    返回:
+        dict: {"file", "success", "notes", "seconds", "log"}
+    """
+    stats = {"notes": 0}
+    start = time.perf_counter()
+    buffer = io.StringIO()
+    if quiet:
+        with redirect_stdout(buffer):
+            success = extract_anki_apkg(
+                apkg_path, output_folder, save_to_file, with_media, in_memory, stats, output_format, strip_html
+            )
+    else:
+        success = extract_anki_apkg(
+            apkg_path, output_folder, save_to_file, with_media, in_memory, stats, output_format, strip_html
+        )
+    return {
+        "file": apkg_path,
+        "success": success,
+        "notes": stats["notes"],
+        "seconds": time.perf_counter() - start,
+        "log": buffer.getvalue()
+    }
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -107,7 +489,10 @@ def main():
   %(prog)s anki_data/120.apkg                    # 使用默认输出文件夹
   %(prog)s anki_data/120.apkg -o my_output      # 指定输出文件夹
   %(prog)s anki_data/120.apkg --no-file         # 不保存到文件
+  %(prog)s anki_data/120.apkg --format txt      # 输出旧版 提取结果.txt
   %(prog)s anki_data/*.apkg                     # 批量处理多个文件
+  %(prog)s anki_data/120.apkg --media           # 同时解压媒体文件
+  %(prog)s "anki_data/*.apkg" -j 8              # 8 个进程并行提取
         """
     )
 
@@ -124,6 +509,33 @@ def main():
         action='store_true',
         help='不保存结果到文件'
     )
+    parser.add_argument(
+        '--media',
+        action='store_true',
+        help='同时解压媒体文件（默认只读取数据库，不解压媒体）'
+    )
+    parser.add_argument(
+        '--in-memory',
+        action='store_true',
+        help='将数据库直接读入内存，不写临时文件（需要 Python 3.11+）'
+    )
+    parser.add_argument(
+        '--format',
+        choices=['csv', 'txt'],
+        default='csv',
+        help='结果文件格式：csv 按字段名输出结构化数据（默认），txt 为旧版"卡片 N: a | b"格式'
+    )
+    parser.add_argument(
+        '--keep-html',
+        action='store_true',
+        help='CSV 中保留字段的 HTML 标签（默认去除）'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='并行提取的进程数（默认: 1，逐个处理）'
+    )
 
     args = parser.parse_args()
 
@@ -137,22 +549,55 @@ def main():
 
     print(f"[搜索] 找到 {len(input_files)} 个文件\n")
 
-    # 处理每个文件
-    success_count = 0
-    for i, apkg_file in enumerate(input_files, 1):
-        print(f"\n{'='*60}")
-        print(f"处理文件 [{i}/{len(input_files)}]: {apkg_file}")
-        print(f"{'='*60}")
+    # 如果指定了输出文件夹且只有一个文件，使用指定的文件夹
+    output_folder = args.output if len(input_files) == 1 else None
+    options = (output_folder, not args.no_file, args.media, args.in_memory, args.format, not args.keep_html)
 
-        # 如果指定了输出文件夹且只有一个文件，使用指定的文件夹
-        output_folder = args.output if len(input_files) == 1 else None
+    # 处理每个文件
+    results = []
+    start = time.perf_counter()
+    if args.jobs > 1 and len(input_files) > 1:
+        jobs = min(args.jobs, len(input_files))
+        print(f"[并行] 使用 {jobs} 个进程提取")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(extract_deck, apkg_file, *options, quiet=True): apkg_file
+                for apkg_file in input_files
+            }
+            for i, future in enumerate(as_completed(futures), 1):
+                apkg_file = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"file": apkg_file, "success": False, "notes": 0, "seconds": 0.0,
+                              "log": f"[错误] 子进程异常: {e}\n"}
+                results.append(result)
 
-        if extract_anki_apkg(apkg_file, output_folder, not args.no_file):
-            success_count += 1
+                print(f"\n{'='*60}")
+                print(f"完成文件 [{i}/{len(input_files)}]: {apkg_file}")
+                print(f"{'='*60}")
+                print(result["log"], end="")
+    else:
+        for i, apkg_file in enumerate(input_files, 1):
+            print(f"\n{'='*60}")
+            print(f"处理文件 [{i}/{len(input_files)}]: {apkg_file}")
+            print(f"{'='*60}")
+            results.append(extract_deck(apkg_file, *options))
+    elapsed = time.perf_counter() - start
 
     # 总结
+    success_count = sum(1 for result in results if result["success"])
+    total_notes = sum(result["notes"] for result in results if result["success"])
+    failed = [result["file"] for result in results if not result["success"]]
+
     print(f"\n{'='*60}")
     print(f"处理完成: 成功 {success_count}/{len(input_files)} 个文件")
+    print(f"笔记总数: {total_notes}")
+    print(f"总耗时: {elapsed:.1f} 秒")
+    if failed:
+        print("失败的文件:")
+        for apkg_file in sorted(failed):
+            print(f"  - {apkg_file}")
     print(f"{'='*60}")
 
     sys.exit(0 if success_count == len(input_files) else 1)
@@ -4,100 +4,37 @@ Anki-LLM-Forge: 通用型 Anki 卡片增强工具
 """
 
 import pandas as pd
-import google.generativeai as genai
 import os
-import time
 import json
 import logging
 import argparse
 from pathlib import Path
-from tqdm import tqdm
 import re
-from typing import Dict, List, Optional, Any
-from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Set, Iterable, Iterator
 
+from checkpoint_store import CheckpointStore
+from anki_export import open_anki_writer
+from card_pipeline import CardPipeline, has_trailing_placeholder
+from stream_parser import JsonStreamScanner
+from run_metrics import build_run_record, append_run_metrics, write_prometheus, output_length_report
 
-# ================= AI 服务商接口 =================
-class AIProvider(ABC):
-    """AI 服务商抽象基类"""
 
-    def __init__(self, config: Dict):
-        self.config = config
-        self.logger = logging.getLogger(__name__)
-
-    @abstractmethod
-    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
-        """生成内容，子类必须实现"""
-        pass
-
-
-class GeminiProvider(AIProvider):
-    """Google Gemini 服务商"""
-
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        os.environ["GOOGLE_API_KEY"] = config["api_key"]
-        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-        self.model = genai.GenerativeModel(config['model'])
-        self.logger.info(f"已初始化 Gemini 模型: {config['model']}")
-
-    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
-        """使用 Gemini 生成内容"""
-        response = self.model.generate_content(prompt)
-        return response.text
-
-
-class QiniuProvider(AIProvider):
-    """七牛云 AI 服务商（DeepSeek）"""
-
-    def __init__(self, config: Dict):
-        super().__init__(config)
-        try:
-            from openai import OpenAI
-            self.client = OpenAI(
-                base_url=config["base_url"],
-                api_key=config["api_key"]
-            )
-            self.model = config['model']
-            self.logger.info(f"已初始化七牛云 AI 模型: {config['model']}")
-        except ImportError:
-            raise ImportError("请安装 openai 库: pip install openai")
-
-    def generate_content(self, prompt: str, system_prompt: str = "") -> str:
-        """使用七牛云 AI 生成内容"""
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            stream=False,
-            max_tokens=4096
-        )
-        return response.choices[0].message.content
+# ================= Profile 管理 =================
+# 批量模式提示词：固定的任务说明在前，变化的条目列表放在最后，
+# 使同一 Profile 的所有请求共享相同的前缀（便于服务商的前缀缓存命中）
+BATCH_PROMPT_TEMPLATE = """You will process a batch of items in a single response. Apply exactly the same task to every item.
 
+Task description (apply it to each item's own front_text):
+---
+{task}
+---
 
-def create_ai_provider(config: Dict, provider_name: str) -> AIProvider:
-    """
-    工厂方法：根据配置创建对应的 AI 服务商实例
-    """
-    if provider_name == "gemini":
-        if "gemini" not in config:
-            raise ValueError("配置中缺少 gemini 配置项")
-        return GeminiProvider(config["gemini"])
+Return ONLY a JSON array with one object per item. Each object must contain "id" (copied from the item) and the fields: {fields}.
 
-    elif provider_name in ["qiniu", "deepseek"]:
-        if "qiniu" not in config:
-            raise ValueError("配置中缺少 qiniu 配置项")
-        return QiniuProvider(config["qiniu"])
+Items ({count}):
+{items}"""
 
-    else:
-        raise ValueError(f"不支持的服务商: {provider_name}，请选择 'gemini' 或 'qiniu'")
 
-
-# ================= Profile 管理 =================
 class Profile:
     """任务场景配置类"""
 
@@ -109,11 +46,20 @@ class Profile:
         self.output_fields = profile_config.get("output_fields", [])
         self.anki_fields = profile_config.get("anki_fields", [])
         self.field_mapping = profile_config.get("field_mapping", {})
+        # 固定前缀（需显式开启）：提示词中的固定说明在前，卡片内容放在最后
+        self.stable_prompt_prefix = profile_config.get("stable_prompt_prefix", False)
+        # 生成参数：按任务需要的输出长度设置 max_tokens，未设置时使用服务商默认值
+        self.max_tokens = profile_config.get("max_tokens")
+        self.temperature = profile_config.get("temperature")
+        stop_sequences = profile_config.get("stop_sequences")
+        self.stop_sequences = [stop_sequences] if isinstance(stop_sequences, str) else stop_sequences
 
     def validate(self) -> bool:
         """验证 Profile 配置是否有效"""
         if not self.user_prompt_template:
             raise ValueError(f"Profile '{self.name}' 缺少 user_prompt_template")
+        if self.max_tokens is not None and (not isinstance(self.max_tokens, int) or self.max_tokens <= 0):
+            raise ValueError(f"Profile '{self.name}' 的 max_tokens 必须是正整数")
         if not self.output_fields:
             raise ValueError(f"Profile '{self.name}' 缺少 output_fields")
         if not self.anki_fields:
@@ -122,9 +68,38 @@ class Profile:
             raise ValueError(f"Profile '{self.name}' 缺少 field_mapping")
         return True
 
+    def generation_options(self) -> Dict:
+        """传给服务商的生成参数（max_tokens / temperature / stop_sequences）"""
+        return {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "stop_sequences": self.stop_sequences
+        }
+
+    def static_instructions(self) -> str:
+        """提示词的固定部分：{front_text} 替换为对 <front_text> 输入块的引用"""
+        return self.user_prompt_template.format(front_text="<front_text>")
+
     def format_prompt(self, front_text: str) -> str:
-        """格式化用户提示词"""
-        return self.user_prompt_template.format(front_text=front_text)
+        """
+        格式化用户提示词
+
+        开启 stable_prompt_prefix 且模板中 {front_text} 之后还有固定说明时，固定说明保持原位（变量处引用 <front_text>），
+        卡片内容作为 <front_text> 输入块追加在末尾，所有请求的前缀逐字节相同。
+        """
+        if not self.stable_prompt_prefix or has_trailing_placeholder(self.user_prompt_template):
+            return self.user_prompt_template.format(front_text=front_text)
+        return f"{self.static_instructions()}\n\n<front_text>\n{front_text}\n</front_text>"
+
+    def format_batch_prompt(self, front_texts: List[str]) -> str:
+        """将多个 front_text 打包为一个提示词，条目 id 为其在列表中的位置"""
+        items = [{"id": str(i), "front_text": text} for i, text in enumerate(front_texts)]
+        return BATCH_PROMPT_TEMPLATE.format(
+            task=self.static_instructions(),
+            fields=", ".join(f'"{field}"' for field in self.output_fields),
+            count=len(front_texts),
+            items=json.dumps(items, ensure_ascii=False, indent=2)
+        )
 
 
 class ProfileManager:
@@ -153,33 +128,13 @@ class ProfileManager:
 
 
 # ================= Anki 卡片生成器 =================
-class AnkiCardGenerator:
-    """Anki 卡片生成器 - 核心业务逻辑"""
-
-    def __init__(self, config: Dict):
-        self.config = config
-        self.logger = logging.getLogger(__name__)
-
-        # 初始化全局设置
-        self.global_settings = config.get("global_settings", {})
-        self.provider_name = self.global_settings.get("provider", "gemini")
+class AnkiCardGenerator(CardPipeline):
+    """Anki 卡片生成器 - 核心业务逻辑（每条输入为 front_text）"""
 
-        # 初始化 AI 服务商
-        providers_config = config.get("providers", {})
-        self.ai_provider = create_ai_provider(providers_config, self.provider_name)
+    action_label = "生成"
 
-        # 初始化 Profile 管理器
-        profiles_config = config.get("profiles", {})
-        self.profile_manager = ProfileManager(profiles_config)
-
-        # 获取当前激活的 Profile
-        active_profile_name = self.global_settings.get("active_profile")
-        if not active_profile_name:
-            raise ValueError("配置中缺少 active_profile，请指定要使用的 Profile")
-
-        self.profile = self.profile_manager.get_profile(active_profile_name)
-        self.logger.info(f"使用 Profile: {self.profile.name}")
-        self.logger.info(f"Profile 描述: {self.profile.description}")
+    def __init__(self, config: Dict):
+        super().__init__(config, ProfileManager(config.get("profiles", {})))
 
     def clean_json_response(self, response_text: str) -> str:
         """清理 LLM 返回的 JSON 字符串"""
@@ -190,21 +145,11 @@ class AnkiCardGenerator:
         clean_text = re.sub(r'/\*.*?\*/', '', clean_text, flags=re.DOTALL)
         return clean_text
 
-    def call_ai_with_retry(self, prompt: str, max_retries: int = 3, delay: float = 2) -> str:
-        """带重试机制的 AI 调用"""
-        for attempt in range(max_retries):
-            try:
-                response_text = self.ai_provider.generate_content(
-                    prompt,
-                    self.profile.system_prompt
-                )
-                return response_text
-            except Exception as e:
-                self.logger.warning(f"AI 调用失败（尝试 {attempt + 1}/{max_retries}）: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(delay * (attempt + 1))
-                else:
-                    raise
+    def _stream_scanner(self, expected_items: Optional[int] = None) -> JsonStreamScanner:
+        """单条请求在所有 output_fields 完整后结束，批量请求在收到 expected_items 条后结束"""
+        if expected_items:
+            return JsonStreamScanner(expected_items=expected_items)
+        return JsonStreamScanner(required_fields=self.profile.output_fields)
 
     def generate_card(self, front_text: str) -> Dict[str, str]:
         """
@@ -213,16 +158,40 @@ class AnkiCardGenerator:
         返回: dict，包含所有 Anki 字段
         """
         # 1. 格式化提示词
-        prompt = self.profile.format_prompt(front_text)
+        with self.timings.measure("prompt"):
+            prompt = self.profile.format_prompt(front_text)
 
         # 2. 调用 AI
         response_text = self.call_ai_with_retry(prompt)
 
+        # 3-4. 解析并映射到 Anki 字段
+        return self.build_card(front_text, prompt, response_text)
+
+    async def agenerate_card(self, front_text: str) -> Dict[str, str]:
+        """generate_card 的异步版本"""
+        with self.timings.measure("prompt"):
+            prompt = self.profile.format_prompt(front_text)
+        response_text = await self.acall_ai_with_retry(prompt)
+        return self.build_card(front_text, prompt, response_text)
+
+    def build_card(self, front_text: str, prompt: str, response_text: str) -> Dict[str, str]:
+        """清洗、解析 LLM 返回的 JSON，并映射到 Anki 字段"""
         # 3. 清洗和解析 JSON
-        clean_json = self.clean_json_response(response_text)
-        llm_output = json.loads(clean_json)
+        try:
+            with self.timings.measure("parse"):
+                llm_output = json.loads(self.clean_json_response(response_text))
+        except json.JSONDecodeError:
+            # 无法解析的响应不保留在缓存中，下次重新请求
+            if self.response_cache:
+                self.response_cache.delete(self.response_cache_key(prompt))
+            raise
 
         # 4. 映射到 Anki 字段
+        with self.timings.measure("map_fields"):
+            return self.map_fields(front_text, llm_output)
+
+    def map_fields(self, front_text: str, llm_output: Dict) -> Dict[str, str]:
+        """根据 field_mapping 将 LLM 输出映射为 Anki 卡片字段"""
         card = {"front_text": front_text}
 
         for llm_field in self.profile.output_fields:
@@ -239,6 +208,46 @@ class AnkiCardGenerator:
 
         return card
 
+    def export_columns(self) -> List[str]:
+        """导出的字段顺序：front_text 加上 output_fields 按 field_mapping 映射后的字段（与 map_fields 一致）"""
+        columns = ["front_text"]
+        for llm_field in self.profile.output_fields:
+            anki_field = self.profile.field_mapping.get(llm_field) or llm_field
+            if anki_field not in columns:
+                columns.append(anki_field)
+        return columns
+
+    def row_key(self, front_text: str) -> str:
+        """计算输入行的稳定键（Profile + 正面内容），用于断点续传"""
+        return CheckpointStore.make_key(self.profile.name, front_text)
+
+    def _process_item(self, front_text: str) -> Dict[str, str]:
+        return self.generate_card(front_text)
+
+    async def _aprocess_item(self, front_text: str) -> Dict[str, str]:
+        return await self.agenerate_card(front_text)
+
+    def _clean_batch_response(self, response_text: str) -> str:
+        return self.clean_json_response(response_text)
+
+    def _batch_card(self, front_text: str, output: Optional[Dict]) -> Optional[Dict[str, str]]:
+        """批量响应中的对象包含所有 output_fields 时映射为卡片"""
+        if output is None or not all(field in output for field in self.profile.output_fields):
+            return None
+        return self.map_fields(front_text, output)
+
+    def _error_card(self, front_text: str, error: Exception) -> Dict[str, str]:
+        """创建一个部分填充的错误卡片"""
+        if isinstance(error, json.JSONDecodeError):
+            message = f"[JSON 解析错误: {str(error)[:50]}]"
+        else:
+            message = f"[处理错误: {str(error)[:50]}]"
+        card = {"front_text": front_text}
+        for anki_field in self.profile.anki_fields:
+            if anki_field != "front_text":
+                card[anki_field] = message
+        return card
+
     def generate_cards(
         self,
         input_data: List[str],
@@ -256,77 +265,55 @@ class AnkiCardGenerator:
         Returns:
             pd.DataFrame: 包含所有生成的卡片
         """
-        # 检查是否有缓存
-        start_index = 0
-        if cache_file and Path(cache_file).exists():
-            self.logger.info(f"发现缓存文件，从断点继续...")
-            cache_df = pd.read_csv(cache_file)
-            start_index = len(cache_df)
-
-            # 确保列一致
-            expected_columns = list(self.profile.field_mapping.values())
-            if set(cache_df.columns) != set(expected_columns):
-                self.logger.warning("缓存文件的列与当前 Profile 不匹配，将重新生成")
-                start_index = 0
-                cache_df = pd.DataFrame(columns=expected_columns)
-
-            self.logger.info(f"已完成 {start_index} 条，剩余 {len(input_data) - start_index} 条")
-
-        # 初始化结果
-        results = []
-        if start_index > 0:
-            cache_df_rows = cache_df.to_dict('records')
-            results = cache_df_rows[:start_index]
-
-        # 生成卡片
-        request_delay = self.global_settings.get("request_delay", 1.0)
-        max_retries = self.global_settings.get("max_retries", 3)
-        save_interval = self.global_settings.get("save_interval", 10)
-
-        for index in tqdm(range(start_index, len(input_data)), desc="生成卡片"):
-            front_text = input_data[index]
-
-            try:
-                # 生成卡片
-                card = self.generate_card(front_text)
-                results.append(card)
-
-                self.logger.info(f"✅ 第 {index + 1}/{len(input_data)} 条生成成功")
-
-                # 定期保存进度
-                if cache_file and (index + 1) % save_interval == 0:
-                    df = pd.DataFrame(results)
-                    df.to_csv(cache_file, index=False)
-                    self.logger.info(f"💾 进度已保存（已完成 {index + 1} 条）")
-
-                # 避免触发 API 速率限制
-                time.sleep(request_delay)
-
-            except json.JSONDecodeError as e:
-                self.logger.error(f"❌ 第 {index + 1} 条 JSON 解析失败: {e}")
-                # 创建一个部分填充的卡片
-                card = {"front_text": front_text}
-                for anki_field in self.profile.anki_fields:
-                    if anki_field != "front_text":
-                        card[anki_field] = f"[JSON 解析错误: {str(e)[:50]}]"
-                results.append(card)
-
-            except Exception as e:
-                self.logger.error(f"❌ 第 {index + 1} 条处理失败: {e}")
-                # 创建一个部分填充的卡片
-                card = {"front_text": front_text}
-                for anki_field in self.profile.anki_fields:
-                    if anki_field != "front_text":
-                        card[anki_field] = f"[处理错误: {str(e)[:50]}]"
-                results.append(card)
-
-        # 最终保存
-        if cache_file:
-            df = pd.DataFrame(results)
-            df.to_csv(cache_file, index=False)
-            self.logger.info("💾 最终进度已保存")
-
-        return pd.DataFrame(results)
+        return pd.DataFrame(list(self.generate_cards_iter(input_data, cache_file=cache_file)))
+
+    def _load_checkpoint(self, checkpoint: CheckpointStore) -> Tuple[Dict[str, Dict[str, str]], Set[str], int]:
+        """
+        读取断点日志中已完成的卡片
+
+        返回: (行键 -> 卡片, 来自旧版无键记录的行键, 日志记录数)
+        """
+        expected_columns = set(self.export_columns())
+        done, legacy_keys = {}, set()
+        records = checkpoint.load()
+        for record in records:
+            # 旧版缓存没有行键，按正面内容计算
+            card = record.get("card", record)
+            key = record.get("key")
+            if key is None:
+                key = self.row_key(card.get("front_text", ""))
+                legacy_keys.add(key)
+            # 失败的卡片和字段与当前 Profile 不匹配的卡片需要重新生成
+            if record.get("error") or not expected_columns.issubset(card):
+                done.pop(key, None)
+            else:
+                done[key] = card
+        self.logger.info(f"断点日志中已完成 {len(done)} 条")
+        return done, legacy_keys, len(records)
+
+    def _reuse_legacy(self, rows: Dict[int, str], keys: Dict[int, str], results: Dict, legacy_keys: Set[str], checkpoint: CheckpointStore):
+        """旧版记录已按正面内容匹配，补写行键，日志压缩时才能保留"""
+        for index in rows:
+            if results[index] is not None and keys[index] in legacy_keys:
+                checkpoint.append({"key": keys[index], "card": results[index], "error": False})
+                legacy_keys.discard(keys[index])
+
+    def generate_cards_iter(
+        self,
+        input_rows: Iterable[str],
+        cache_file: Optional[str] = None
+    ) -> Iterator[Dict[str, str]]:
+        """
+        流式生成 Anki 卡片：分块读取输入，按输入顺序逐块产出卡片
+
+        Args:
+            input_rows: 输入数据的可迭代对象（列表或 iter_input_data 返回的生成器）
+            cache_file: 缓存文件路径（支持断点续传）
+
+        Yields:
+            Dict[str, str]: 按输入顺序产出的卡片
+        """
+        return self._iter_cards(input_rows, cache_file)
 
 
 # ================= 工具函数 =================
@@ -393,32 +380,98 @@ def load_input_data(source: str) -> List[str]:
         raise ValueError(f"不支持的文件格式: {source_path.suffix}")
 
 
-def export_to_anki(df: pd.DataFrame, filename: str, encoding: str = 'utf-8'):
-    """导出为 Anki 可识别的格式"""
+def iter_input_data(source, chunksize: int = 1000) -> Iterator[str]:
+    """
+    流式读取输入数据，逐条产出，内存占用与文件大小无关
+    支持: list, .txt（逐行）, .csv（分块）, .xlsx（openpyxl 只读模式）, .xls
+    """
+    logger = logging.getLogger(__name__)
+
+    if isinstance(source, list):
+        logger.info(f"从列表加载 {len(source)} 条数据")
+        yield from source
+        return
+
+    source_path = Path(source)
+    if not source_path.exists():
+        raise FileNotFoundError(f"文件不存在: {source}")
+
+    if source_path.suffix == '.txt':
+        logger.info(f"从 TXT 文件流式读取数据: {source}")
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+    elif source_path.suffix == '.csv':
+        logger.info(f"从 CSV 文件分块读取数据: {source}")
+        for chunk in pd.read_csv(source, usecols=[0], chunksize=chunksize):
+            yield from chunk.iloc[:, 0].tolist()
+
+    elif source_path.suffix == '.xlsx':
+        logger.info(f"从 Excel 文件流式读取数据: {source}")
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            # 与 pd.read_excel 一致：第一行为表头，取第一列
+            rows = workbook.active.iter_rows(min_row=2, max_col=1, values_only=True)
+            for (value,) in rows:
+                if value is not None:
+                    yield value
+        finally:
+            workbook.close()
+
+    elif source_path.suffix == '.xls':
+        # openpyxl 不支持旧版 .xls，整体读取
+        yield from load_input_data(source)
+
+    else:
+        raise ValueError(f"不支持的文件格式: {source_path.suffix}")
+
+
+def export_to_anki(
+    cards,
+    filename: str,
+    encoding: str = 'utf-8',
+    columns: Optional[List[str]] = None,
+    **apkg_options
+) -> int:
+    """
+    导出为 Anki 可识别的格式
+
+    cards 可以是 DataFrame，也可以是逐张产出卡片的可迭代对象（如 generate_cards_iter），
+    后者每生成一张卡片就清理并写入一行，不在内存中保留全部卡片。
+    filename 以 .apkg 结尾时直接生成卡包（apkg_options 传给 AnkiApkgWriter，如 deck_name），
+    否则导出 Tab 分隔文本。
+
+    Returns:
+        int: 导出的卡片数
+    """
     logger = logging.getLogger(__name__)
 
-    # 创建副本，避免修改原数据
-    export_df = df.copy()
+    if isinstance(cards, pd.DataFrame):
+        columns = columns or list(cards.columns)
+        cards = (dict(zip(cards.columns, row)) for row in cards.itertuples(index=False, name=None))
 
-    # 替换换行符和制表符
-    for col in export_df.columns:
-        export_df[col] = export_df[col].astype(str).str.replace('\n', '<br>', regex=False)
-        export_df[col] = export_df[col].astype(str).str.replace('\r', '', regex=False)
-        export_df[col] = export_df[col].astype(str).str.replace('\t', '    ', regex=False)
+    # 逐张写入，换行符和制表符在写入时一次替换
+    with open_anki_writer(filename, columns=columns, encoding=encoding, **apkg_options) as writer:
+        for card in cards:
+            writer.write(card)
+    columns = writer.columns or []
 
-    # 导出
-    export_df.to_csv(filename, sep='\t', index=False, header=False, encoding=encoding)
     logger.info(f"✅ 文件已保存: {filename}")
-    logger.info(f"📊 共 {len(df)} 张卡片")
+    logger.info(f"📊 共 {writer.count} 张卡片")
 
     # 生成统计报告
     print("\n" + "="*50)
     print("处理完成！统计信息：")
-    print(f"  总卡片数: {len(df)}")
-    print(f"  字段数: {len(df.columns)}")
-    print(f"  字段列表: {', '.join(df.columns)}")
+    print(f"  总卡片数: {writer.count}")
+    print(f"  字段数: {len(columns)}")
+    print(f"  字段列表: {', '.join(columns)}")
     print(f"  导出文件: {filename}")
     print("="*50)
+    return writer.count
 
 
 # ================= 主程序 =================
@@ -545,25 +598,79 @@ def main():
             print("请通过命令行参数 -i 指定，或在配置文件中设置 input_file")
             return 1
 
-        logger.info("开始加载数据...")
-        input_data = load_input_data(input_file)
-        logger.info(f"数据加载完成，共 {len(input_data)} 条")
+        if not Path(input_file).exists():
+            raise FileNotFoundError(f"文件不存在: {input_file}")
+        input_rows = iter_input_data(input_file)
 
-        # 8. 生成卡片
+        # 流式模式下实时显示第一条响应（逐段打印模型输出）
+        if generator.stream_responses and global_settings.get("stream_preview", True):
+            preview_started = []
+
+            def live_preview(chunk: str):
+                if not preview_started:
+                    print("\n--- 实时预览（第一条响应）---")
+                    preview_started.append(True)
+                print(chunk, end="", flush=True)
+
+            generator.preview_callback = live_preview
+
+        # 8. 生成卡片并逐张导出（边读取、边生成、边写入）
         logger.info("开始生成 Anki 卡片...")
-        df_cards = generator.generate_cards(
-            input_data,
-            cache_file=cache_file
+        output_file = global_settings.get("output_file", "anki_cards.txt")
+        output_encoding = global_settings.get("output_encoding", "utf-8")
+
+        preview_cards = []
+
+        def keep_preview(cards: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+            for card in cards:
+                if len(preview_cards) < 3:
+                    preview_cards.append(card)
+                yield card
+
+        export_to_anki(
+            keep_preview(generator.generate_cards_iter(input_rows, cache_file=cache_file)),
+            output_file,
+            encoding=output_encoding,
+            columns=generator.export_columns(),
+            deck_name=global_settings.get("deck_name"),
+            model_name=f"Anki-LLM-Forge: {generator.profile.name}"
         )
 
         # 9. 打印预览
         print("\n--- 数据预览（前3条）---")
-        print(df_cards.head(3).to_string())
-
-        # 10. 导出
-        output_file = global_settings.get("output_file", "anki_cards.txt")
-        output_encoding = global_settings.get("output_encoding", "utf-8")
-        export_to_anki(df_cards, output_file, encoding=output_encoding)
+        print(pd.DataFrame(preview_cards).to_string())
+
+        # 10. 各阶段耗时汇总（可选输出 Prometheus 文本格式）
+        if generator.timings.stages:
+            print("\n--- 各阶段耗时 ---")
+            print(generator.timings.summary_table())
+        prometheus_file = global_settings.get("prometheus_file")
+        if prometheus_file:
+            write_prometheus(prometheus_file, generator.timings, labels={"tool": "anki_llm_forge", "profile": generator.profile.name})
+            logger.info(f"阶段耗时已写入 {prometheus_file}（Prometheus 文本格式）")
+
+        # 输出长度测量模式：按每次调用的输出 token 分布建议 Profile 的 max_tokens
+        if generator.measure_output_length:
+            print("\n--- 输出长度测量 ---")
+            print(output_length_report(
+                generator.ai_provider.usage,
+                current_limit=generator.profile.max_tokens,
+                batch_size=max(1, int(global_settings.get("batch_size", 1)))
+            ))
+
+        # 11. 写入运行指标（按 Profile 记录 token 用量与耗时）
+        metrics_file = global_settings.get("metrics_file", "run_metrics.jsonl")
+        if metrics_file:
+            record = build_run_record(
+                "anki_llm_forge", generator.profile.name, generator.provider_name, generator.ai_provider, generator.run_stats
+            )
+            append_run_metrics(metrics_file, record)
+            usage = record["usage"]
+            logger.info(
+                f"运行指标已写入 {metrics_file}: {usage['calls']} 次调用，"
+                f"平均耗时 {usage['avg_latency_seconds']} 秒，"
+                f"{record['cards_per_second']} 张/秒"
+            )
 
         logger.info("="*50)
         logger.info("程序执行完成！")
@@ -8,7 +8,10 @@ import argparse
 from pathlib import Path
 from tqdm import tqdm
 import re
-from typing import Dict, Optional
+from typing import Dict
+
+from rate_limiter import RateLimiter, estimate_tokens, is_rate_limit_error, get_retry_after
+from retry_policy import RetryPolicy
 
 # ================= AI 服务商接口 =================
 class AIProvider:
@@ -17,9 +20,26 @@ class AIProvider:
     def __init__(self, config: Dict):
         self.config = config
         self.logger = logging.getLogger(__name__)
+        # 按服务商配置中的 requests_per_minute / tokens_per_minute 限速
+        self.rate_limiter = RateLimiter.from_config(config)
 
     def generate_content(self, prompt: str) -> str:
-        """生成内容，子类必须实现"""
+        """生成内容：调用前申请速率预算，遇到 429 时通知限速器降速"""
+        self.rate_limiter.acquire(estimate_tokens(prompt))
+        try:
+            response_text = self._generate_content(prompt)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.logger.warning("服务商返回速率限制 (429)，自动降低请求速率")
+                self.rate_limiter.on_rate_limited(get_retry_after(e))
+            raise
+        # 预留时只计入了输入，按响应长度补扣输出消耗的 TPM 预算
+        self.rate_limiter.charge_tokens(estimate_tokens(response_text))
+        self.rate_limiter.on_success()
+        return response_text
+
+    def _generate_content(self, prompt: str) -> str:
+        """实际调用服务商接口，子类必须实现"""
         raise NotImplementedError
 
 class GeminiProvider(AIProvider):
@@ -32,7 +52,7 @@ class GeminiProvider(AIProvider):
         self.model = genai.GenerativeModel(config['model'])
         self.logger.info(f"✅ 已初始化 Gemini 模型: {config['model']}")
 
-    def generate_content(self, prompt: str) -> str:
+    def _generate_content(self, prompt: str) -> str:
         """使用 Gemini 生成内容"""
         response = self.model.generate_content(prompt)
         return response.text
@@ -53,7 +73,7 @@ class QiniuProvider(AIProvider):
         except ImportError:
             raise ImportError("请安装 openai 库: pip install openai")
 
-    def generate_content(self, prompt: str) -> str:
+    def _generate_content(self, prompt: str) -> str:
         """使用七牛云 AI 生成内容"""
         messages = [{"role": "user", "content": prompt}]
         response = self.client.chat.completions.create(
@@ -92,7 +112,7 @@ def load_config(config_file='config.json'):
         return config
     except FileNotFoundError:
         print(f"❌ 配置文件 {config_file} 未找到！")
-        print(f"💡 请复制 config.example.json 为 config.json 并填写你的 API KEY")
+        print("💡 请复制 config.example.json 为 config.json 并填写你的 API KEY")
         raise
     except json.JSONDecodeError as e:
         print(f"❌ 配置文件格式错误: {e}")
@@ -173,20 +193,9 @@ def clean_json_response(response_text):
 
 def call_ai_with_retry(ai_provider: AIProvider, prompt: str, max_retries: int = 3, delay: float = 2):
     """
-    带重试机制的 AI 调用
+    带重试机制的 AI 调用（按错误类型决定是否重试，抖动指数退避）
     """
-    logger = logging.getLogger(__name__)
-
-    for attempt in range(max_retries):
-        try:
-            response_text = ai_provider.generate_content(prompt)
-            return response_text
-        except Exception as e:
-            logger.warning(f"AI 调用失败（尝试 {attempt + 1}/{max_retries}）: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(delay * (attempt + 1))  # 指数退避
-            else:
-                raise
+    return RetryPolicy(max_retries=max_retries, base_delay=delay).call(ai_provider.generate_content, prompt)
 
 def enrich_data_with_llm(df, config, logger):
     """
@@ -207,7 +216,7 @@ def enrich_data_with_llm(df, config, logger):
     start_index = 0
 
     if Path(cache_file).exists():
-        logger.info(f"发现缓存文件，从断点继续...")
+        logger.info("发现缓存文件，从断点继续...")
         cache_df = pd.read_csv(cache_file)
         start_index = len(cache_df)
         df = pd.concat([cache_df, df.iloc[start_index:]], ignore_index=True)
@@ -268,8 +277,9 @@ def enrich_data_with_llm(df, config, logger):
                 df.to_csv(cache_file, index=False)
                 logger.info(f"💾 进度已保存（已完成 {index + 1} 条）")
 
-            # 避免触发 API 速率限制
-            time.sleep(request_delay)
+            # 未配置 RPM/TPM 预算时沿用固定间隔，避免触发 API 速率限制
+            if not ai_provider.rate_limiter.enabled:
+                time.sleep(request_delay)
 
         except json.JSONDecodeError as e:
             logger.error(f"❌ 第 {index + 1} 条 JSON 解析失败: {e}")
@@ -0,0 +1,197 @@
+"""
+离线基准测试：用 MockProvider 驱动 AnkiCardGenerator.generate_cards 与 AnkiCardEnhancer.enhance_cards
+在合成数据上测量吞吐量（卡片/秒）、峰值内存（RSS）和断点日志的开销，全程不访问网络
+
+每个用例在独立的子进程中运行，峰值内存互不影响；
+同一规模分别在不启用 / 启用断点日志时各运行一次，两者的耗时差即断点日志的开销。
+
+用法:
+    python benchmark.py
+    python benchmark.py --rows 1000 10000 100000 --batch-size 10 --concurrency 8
+    python benchmark.py --tool enhancer --latency-ms 200 --error-rate 0.02 --async
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+
+FORGE_PROFILE = {
+    "description": "基准测试（合成数据）",
+    "system_prompt": "You are a vocabulary assistant.",
+    "user_prompt_template": "Explain the word {front_text}. Return JSON with definition and example.",
+    "output_fields": ["definition", "example"],
+    "anki_fields": ["front_text", "definition", "example"],
+    "field_mapping": {"definition": "definition", "example": "example"}
+}
+
+ENHANCER_PROFILE = {
+    "description": "基准测试（合成数据）",
+    "system_prompt": "You are a flashcard editor.",
+    "user_prompt_template": "Improve the back of this card.\nFront: {front_text}\nBack: {back_text}",
+    "output_format": "text"
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB），无法获取时返回 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
+
+def build_config(tool: str, settings: Dict, mock_config: Dict) -> Dict:
+    """构造使用 MockProvider 和基准测试 Profile 的配置"""
+    if tool == "forge":
+        profile = FORGE_PROFILE
+        mock = dict(mock_config, output_fields=FORGE_PROFILE["output_fields"], response_format="json")
+    else:
+        profile = ENHANCER_PROFILE
+        mock = dict(mock_config, output_fields=["enhanced_back"], response_format="text")
+    return {
+        "global_settings": dict(settings, provider="mock", active_profile="benchmark", request_delay=0),
+        "providers": {"mock": mock},
+        "profiles": {"benchmark": profile}
+    }
+
+
+def run_case(tool: str, rows: int, settings: Dict, mock_config: Dict, with_checkpoint: bool) -> Dict:
+    """在当前进程中运行一个用例，返回测量结果"""
+    os.environ["TQDM_DISABLE"] = "1"
+    logging.disable(logging.CRITICAL)
+    import pandas as pd
+
+    config = build_config(tool, settings, mock_config)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_file = str(Path(tmp_dir) / "checkpoint.jsonl") if with_checkpoint else None
+
+        if tool == "forge":
+            from anki_llm_forge import AnkiCardGenerator
+            runner = AnkiCardGenerator(config)
+            input_data = [f"word{i}" for i in range(rows)]
+            start = time.perf_counter()
+            cards = runner.generate_cards(input_data, cache_file=cache_file)
+        else:
+            from anki_enhancer import AnkiCardEnhancer
+            runner = AnkiCardEnhancer(config)
+            input_df = pd.DataFrame({
+                "front_text": [f"word{i}" for i in range(rows)],
+                "back_text": [f"<b>word{i}</b><br>meaning {i}" for i in range(rows)]
+            })
+            start = time.perf_counter()
+            cards = runner.enhance_cards(input_df, cache_file=cache_file)
+        elapsed = time.perf_counter() - start
+
+        checkpoint_stage = runner.timings.stages.get("checkpoint")
+        journal_size = Path(cache_file).stat().st_size if cache_file and Path(cache_file).exists() else 0
+
+    return {
+        "tool": tool,
+        "rows": rows,
+        "checkpoint": with_checkpoint,
+        "cards": len(cards),
+        "failed": runner.run_stats.get("failed", 0),
+        "calls": runner.ai_provider.usage.calls,
+        "elapsed": elapsed,
+        "cards_per_second": len(cards) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "checkpoint_seconds": checkpoint_stage.total if checkpoint_stage else 0.0,
+        "journal_mb": journal_size / 1024 / 1024
+    }
+
+
+def run_isolated(*case_args) -> Dict:
+    """在新的子进程中运行用例，使峰值内存只反映该用例"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_case, *case_args).result()
+
+
+def print_results(results: List[Dict]):
+    """打印结果表，并计算断点日志相对于无断点运行的耗时开销"""
+    baseline = {
+        (result["tool"], result["rows"]): result["elapsed"]
+        for result in results if not result["checkpoint"]
+    }
+    print(f"\n{'工具':<10}{'行数':>9}{'断点':>6}{'失败':>7}{'调用':>9}{'耗时(s)':>10}"
+          f"{'卡片/秒':>11}{'峰值RSS(MB)':>13}{'断点写入(s)':>13}{'日志(MB)':>10}{'开销':>9}")
+    print("-" * 107)
+    for result in results:
+        rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "n/a"
+        overhead = ""
+        base = baseline.get((result["tool"], result["rows"]))
+        if result["checkpoint"] and base:
+            overhead = f"{(result['elapsed'] / base - 1):+.1%}"
+        print(f"{result['tool']:<10}{result['rows']:>9}{'是' if result['checkpoint'] else '否':>6}"
+              f"{result['failed']:>7}{result['calls']:>9}{result['elapsed']:>10.2f}"
+              f"{result['cards_per_second']:>11.1f}{rss:>13}{result['checkpoint_seconds']:>13.2f}"
+              f"{result['journal_mb']:>10.2f}{overhead:>9}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="生成流水线离线基准测试（MockProvider，不访问网络）",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--tool", choices=["forge", "enhancer", "all"], default="all",
+                        help="测试 anki_llm_forge、anki_enhancer 或两者（默认: all）")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000],
+                        help="合成数据行数，可指定多个（默认: 1000 10000）")
+    parser.add_argument("--batch-size", type=int, default=1, help="每个请求打包的条目数")
+    parser.add_argument("--concurrency", type=int, default=1, help="最大并发请求数")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="使用异步模式")
+    parser.add_argument("--latency-ms", type=float, default=0, help="模拟延迟的中位数（毫秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="模拟延迟的对数正态离散度")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务商错误的概率")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--no-checkpoint-compare", action="store_true",
+                        help="只运行启用断点日志的用例")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    tools = ["forge", "enhancer"] if args.tool == "all" else [args.tool]
+    settings = {
+        "batch_size": args.batch_size,
+        "max_concurrency": args.concurrency,
+        "async_mode": args.async_mode
+    }
+    mock_config = {
+        "latency_ms": args.latency_ms,
+        "latency_sigma": args.latency_sigma,
+        "error_rate": args.error_rate,
+        "seed": args.seed
+    }
+    checkpoint_modes = [True] if args.no_checkpoint_compare else [False, True]
+
+    results = []
+    for tool in tools:
+        for rows in args.rows:
+            for with_checkpoint in checkpoint_modes:
+                print(f"运行: {tool} {rows} 行，断点日志{'开启' if with_checkpoint else '关闭'}...", flush=True)
+                results.append(run_isolated(tool, rows, settings, mock_config, with_checkpoint))
+
+    print_results(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
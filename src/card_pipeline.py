@@ -0,0 +1,648 @@
+"""
+卡片处理流水线：anki_llm_forge.py 与 anki_enhancer.py 共用的执行引擎
+负责服务商与响应缓存的初始化、带重试的 AI 调用（含流式）、批量请求、去重、断点日志，
+以及串行 / 线程池 / 异步三种执行模式；子类只实现与 Profile 相关的提示词、解析和错误卡片
+"""
+
+import time
+import json
+import string
+import asyncio
+import logging
+import functools
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from ai_providers import HedgedProvider, create_ai_provider
+from response_cache import ResponseCache
+from checkpoint_store import CheckpointStore
+from dedup import Deduplicator
+from retry_policy import RetryPolicy, ERROR_KIND_LABELS
+from stream_parser import collect_stream, acollect_stream
+
+
+def has_trailing_placeholder(template: str) -> bool:
+    """
+    模板的变量是否都位于末尾（其后没有固定说明），此时原样格式化即可得到固定前缀
+
+    第一个变量之后的固定文本只有空白和标点（如结尾的句号、引号、括号）时也视为位于末尾：
+    这些字符不构成说明，没有必要为它们改写提示词；只要出现文字或数字就按有固定说明处理。
+    """
+    segments = list(string.Formatter().parse(template))
+    first_field = next((i for i, (_, field, _, _) in enumerate(segments) if field is not None), None)
+    if first_field is None:
+        return True
+    trailing = "".join(literal for literal, _, _, _ in segments[first_field + 1:])
+    return not any(char.isalnum() for char in trailing)
+
+
+class _EventLoopThread:
+    """
+    在后台线程中运行的事件循环，异步模式下整个输入共用一个
+
+    异步客户端绑定在创建它的事件循环上，共用一个循环才能让连接池在各块之间保持复用。
+    接口与 ThreadPoolExecutor.submit 类似：submit 返回 concurrent.futures.Future，可在主线程等待或取消。
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="card-pipeline-loop", daemon=True)
+        self._thread.start()
+        # 信号量须在事件循环内创建（Python 3.8/3.9 的 Semaphore 会绑定创建时的循环）
+        self.semaphore = self.submit(self._make_semaphore(max_concurrency)).result()
+
+    @staticmethod
+    async def _make_semaphore(value: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(value)
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _shutdown(self, aclose):
+        # 等已取消的任务退出后再关闭客户端
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await aclose()
+
+    def close(self, aclose):
+        """取消未完成的任务，调用 aclose() 关闭异步客户端后停止事件循环"""
+        try:
+            self.submit(self._shutdown(aclose)).result()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+
+
+class CardPipeline(ABC):
+    """
+    卡片处理流水线基类
+
+    每条输入（item）由子类定义：生成器为 front_text，增强器为 (front_text, back_text)。
+    子类实现单条处理、批量响应拆分、错误卡片和断点日志读取，其余流程由基类完成。
+    """
+
+    # 日志与进度条中的动作名称（"生成" / "增强"）
+    action_label = "处理"
+
+    def __init__(self, config: Dict, profile_manager):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+
+        # 初始化全局设置
+        self.global_settings = config.get("global_settings", {})
+        self.provider_name = self.global_settings.get("provider", "gemini")
+
+        # 初始化 AI 服务商
+        providers_config = config.get("providers", {})
+        # failover_providers: 备用服务商（按优先级），配置后每个服务商带熔断器并自动切换
+        failover = self.global_settings.get("failover_providers")
+        if failover is None and self.global_settings.get("circuit_breaker", False):
+            failover = []
+        self.ai_provider = create_ai_provider(providers_config, self.provider_name, failover)
+        # hedge_requests: 慢请求超过已观测的 p95 延迟时发出对冲请求，取先返回的结果
+        if self.global_settings.get("hedge_requests", False):
+            self.ai_provider = HedgedProvider.from_settings(self.ai_provider, providers_config, self.global_settings)
+
+        # 初始化响应缓存（按提示词内容寻址，与输入顺序无关）
+        self.response_cache = None
+        response_cache_file = self.global_settings.get("response_cache_file")
+        if response_cache_file:
+            self.response_cache = ResponseCache(
+                response_cache_file,
+                max_entries=self.global_settings.get("response_cache_max_entries"),
+                max_age_days=self.global_settings.get("response_cache_max_age_days")
+            )
+            self.logger.info(f"已启用响应缓存: {response_cache_file}")
+
+        # 获取当前激活的 Profile
+        self.profile_manager = profile_manager
+        active_profile_name = self.global_settings.get("active_profile")
+        if not active_profile_name:
+            raise ValueError("配置中缺少 active_profile，请指定要使用的 Profile")
+
+        self.profile = self.profile_manager.get_profile(active_profile_name)
+        self.logger.info(f"使用 Profile: {self.profile.name}")
+        self.logger.info(f"Profile 描述: {self.profile.description}")
+
+        # 生成参数按 Profile 设置；measure_output_length 模式下不限制 max_tokens，
+        # 统计每次调用的输出长度分布，运行结束后给出建议的 max_tokens
+        self.measure_output_length = self.global_settings.get("measure_output_length", False)
+        generation_options = self.profile.generation_options()
+        if self.measure_output_length:
+            generation_options["max_tokens"] = None
+            self.logger.info("输出长度测量模式：本次运行不限制 max_tokens")
+        self.ai_provider.set_generation_options(generation_options)
+
+        # 最近一次运行的统计（卡片数、耗时等）
+        self.run_stats = {}
+        # 热路径各阶段耗时，与服务商记录的调用耗时合并在同一个 StageTimer 中
+        self.timings = self.ai_provider.timings
+        # 重试策略：按错误类型决定是否重试（max_retries / retry_* 设置）
+        self.retry_policy = RetryPolicy.from_settings(self.global_settings, timings=self.timings)
+
+        # 流式响应：结果完整后立即停止生成；preview_callback 由 main 设置，实时显示第一条响应
+        self.stream_responses = self.global_settings.get("stream_responses", False)
+        self.preview_callback = None
+
+    # ---------- 子类实现 ----------
+    @abstractmethod
+    def row_key(self, item) -> str:
+        """计算输入行的稳定键，用于断点续传"""
+
+    @abstractmethod
+    def _process_item(self, item) -> Dict[str, str]:
+        """处理单条输入，返回卡片"""
+
+    @abstractmethod
+    async def _aprocess_item(self, item) -> Dict[str, str]:
+        """_process_item 的异步版本"""
+
+    @abstractmethod
+    def _error_card(self, item, error: Exception) -> Dict[str, str]:
+        """处理失败时的错误卡片"""
+
+    @abstractmethod
+    def _clean_batch_response(self, response_text: str) -> str:
+        """批量响应解析前的清洗（去除代码块标记等）"""
+
+    @abstractmethod
+    def _batch_card(self, item, output: Optional[Dict]) -> Optional[Dict[str, str]]:
+        """由批量响应中的一个对象构建卡片，缺失或字段不完整时返回 None"""
+
+    @abstractmethod
+    def _stream_scanner(self, expected_items: Optional[int] = None):
+        """流式模式下判断响应是否完整的 scanner"""
+
+    @abstractmethod
+    def _load_checkpoint(self, checkpoint: CheckpointStore) -> Tuple[Dict[str, Dict[str, str]], Any, int]:
+        """
+        读取断点日志中已完成的卡片
+
+        返回: (行键 -> 卡片, 旧版无键记录（交给 _reuse_legacy）, 日志记录数)
+        """
+
+    def _reuse_legacy(self, rows: Dict[int, Any], keys: Dict[int, str], results: Dict, legacy, checkpoint: CheckpointStore):
+        """采用旧版断点记录并补写行键（子类按旧版日志格式实现）"""
+
+    def _front_text(self, item) -> str:
+        """输入的正面内容（去重时复制卡片用）"""
+        return item
+
+    # ---------- AI 调用 ----------
+    def response_cache_key(self, prompt: str) -> str:
+        """计算提示词对应的响应缓存键"""
+        return ResponseCache.make_key(
+            self.provider_name,
+            self.ai_provider.config.get("model", ""),
+            self.profile.system_prompt,
+            prompt,
+            self.ai_provider.generation_options
+        )
+
+    def _lookup_response_cache(self, prompt: str) -> Tuple[bool, Optional[str]]:
+        """
+        查询响应缓存
+
+        返回: (是否命中, 缓存的响应)；命中时不会请求服务商，调用方据此跳过 request_delay
+        """
+        if not self.response_cache:
+            return False, None
+        with self.timings.measure("response_cache"):
+            cached = self.response_cache.get(self.response_cache_key(prompt))
+        return cached is not None, cached
+
+    def _pace_request(self):
+        """未配置 RPM/TPM 预算时，每次实际请求服务商后休眠 request_delay，避免触发 API 速率限制"""
+        if not self.ai_provider.rate_limiter.enabled:
+            time.sleep(self.global_settings.get("request_delay", 1.0))
+
+    async def _apace_request(self):
+        """_pace_request 的异步版本"""
+        if not self.ai_provider.rate_limiter.enabled:
+            await asyncio.sleep(self.global_settings.get("request_delay", 1.0))
+
+    def _claim_preview(self):
+        """实时预览只显示第一条流式响应"""
+        preview, self.preview_callback = self.preview_callback, None
+        return preview
+
+    def _stream_response(self, prompt: str, expected_items: Optional[int] = None) -> str:
+        """流式读取响应，结果完整后关闭连接"""
+        stream = self.ai_provider.generate_content_stream(prompt, self.profile.system_prompt)
+        return collect_stream(stream, self._stream_scanner(expected_items), self._claim_preview())
+
+    async def _astream_response(self, prompt: str, expected_items: Optional[int] = None) -> str:
+        """_stream_response 的异步版本"""
+        stream = self.ai_provider.agenerate_content_stream(prompt, self.profile.system_prompt)
+        return await acollect_stream(stream, self._stream_scanner(expected_items), self._claim_preview())
+
+    def call_ai_with_retry(self, prompt: str, expected_items: Optional[int] = None) -> str:
+        """
+        按重试策略调用 AI（区分错误类型，抖动指数退避），命中响应缓存时直接返回（不休眠 request_delay）
+
+        expected_items: 批量请求的条目数（流式模式下用于判断响应是否完整）
+        """
+        hit, cached = self._lookup_response_cache(prompt)
+        if hit:
+            return cached
+
+        if self.stream_responses:
+            response_text = self.retry_policy.call(self._stream_response, prompt, expected_items)
+        else:
+            response_text = self.retry_policy.call(
+                self.ai_provider.generate_content,
+                prompt,
+                self.profile.system_prompt
+            )
+        if self.response_cache:
+            self.response_cache.set(self.response_cache_key(prompt), response_text)
+        self._pace_request()
+        return response_text
+
+    async def acall_ai_with_retry(self, prompt: str, expected_items: Optional[int] = None) -> str:
+        """call_ai_with_retry 的异步版本"""
+        hit, cached = self._lookup_response_cache(prompt)
+        if hit:
+            return cached
+
+        if self.stream_responses:
+            response_text = await self.retry_policy.acall(self._astream_response, prompt, expected_items)
+        else:
+            response_text = await self.retry_policy.acall(
+                self.ai_provider.agenerate_content,
+                prompt,
+                self.profile.system_prompt
+            )
+        if self.response_cache:
+            self.response_cache.set(self.response_cache_key(prompt), response_text)
+        await self._apace_request()
+        return response_text
+
+    # ---------- 单条与批量处理 ----------
+    def _process_row(self, index: int, rows: Dict[int, Any]) -> Tuple[Dict[str, str], bool]:
+        """
+        处理单条输入，失败时返回错误卡片而不是抛出异常
+
+        串行和线程池模式共用此方法；未配置速率预算时，每个工作线程在请求服务商后自行休眠 request_delay
+        （见 call_ai_with_retry，命中响应缓存时不休眠）
+
+        返回: (卡片, 是否失败)
+        """
+        try:
+            card = self._process_item(rows[index])
+            self.logger.info(f"✅ 第 {index + 1} 条{self.action_label}成功")
+            return card, False
+
+        except json.JSONDecodeError as e:
+            self.logger.error(f"❌ 第 {index + 1} 条 JSON 解析失败: {e}")
+            return self._error_card(rows[index], e), True
+
+        except Exception as e:
+            self.logger.error(f"❌ 第 {index + 1} 条处理失败: {e}")
+            return self._error_card(rows[index], e), True
+
+    async def _aprocess_row(self, index: int, rows: Dict[int, Any]) -> Tuple[Dict[str, str], bool]:
+        """_process_row 的异步版本"""
+        try:
+            card = await self._aprocess_item(rows[index])
+            self.logger.info(f"✅ 第 {index + 1} 条{self.action_label}成功")
+            return card, False
+
+        except json.JSONDecodeError as e:
+            self.logger.error(f"❌ 第 {index + 1} 条 JSON 解析失败: {e}")
+            return self._error_card(rows[index], e), True
+
+        except Exception as e:
+            self.logger.error(f"❌ 第 {index + 1} 条处理失败: {e}")
+            return self._error_card(rows[index], e), True
+
+    def _parse_batch(
+        self,
+        indices: List[int],
+        rows: Dict[int, Any],
+        prompt: str,
+        response_text: str
+    ) -> Tuple[List[Tuple[int, Dict[str, str]]], List[int]]:
+        """
+        将批量响应按 id 拆分为逐条卡片
+
+        返回: (已完成的 [(index, 卡片)], 缺失或字段不完整的 index 列表)
+        """
+        try:
+            with self.timings.measure("parse"):
+                items = json.loads(self._clean_batch_response(response_text))
+        except json.JSONDecodeError:
+            items = None
+        # 兼容 {"items": [...]} 这类外层包装
+        if isinstance(items, dict):
+            items = next((value for value in items.values() if isinstance(value, list)), None)
+        if not isinstance(items, list):
+            if self.response_cache:
+                self.response_cache.delete(self.response_cache_key(prompt))
+            self.logger.warning(f"批量响应无法解析为 JSON 数组，{len(indices)} 条逐条重试")
+            return [], list(indices)
+
+        by_id = {str(item.get("id")): item for item in items if isinstance(item, dict)}
+        done, missing = [], []
+        with self.timings.measure("map_fields"):
+            for position, index in enumerate(indices):
+                card = self._batch_card(rows[index], by_id.get(str(position)))
+                if card is None:
+                    missing.append(index)
+                else:
+                    done.append((index, card))
+        if missing:
+            self.logger.warning(f"批量响应缺少 {len(missing)}/{len(indices)} 条，逐条重试")
+        return done, missing
+
+    def _process_batch(self, indices: List[int], rows: Dict[int, Any]) -> List[Tuple[int, Dict[str, str], bool]]:
+        """
+        一次请求处理多条输入，缺失的条目逐条重试
+
+        返回: [(index, 卡片, 是否失败)]
+        """
+        if len(indices) == 1:
+            return [(indices[0], *self._process_row(indices[0], rows))]
+
+        with self.timings.measure("prompt"):
+            prompt = self.profile.format_batch_prompt([rows[index] for index in indices])
+        try:
+            response_text = self.call_ai_with_retry(prompt, expected_items=len(indices))
+            done, missing = self._parse_batch(indices, rows, prompt, response_text)
+        except Exception as e:
+            self.logger.error(f"❌ 批量请求失败，{len(indices)} 条逐条重试: {e}")
+            done, missing = [], list(indices)
+
+        if done:
+            self.logger.info(f"✅ 批量{self.action_label}成功 {len(done)} 条（第 {indices[0] + 1} 条起）")
+
+        outputs = [(index, card, False) for index, card in done]
+        outputs += [(index, *self._process_row(index, rows)) for index in missing]
+        return outputs
+
+    async def _aprocess_batch(self, indices: List[int], rows: Dict[int, Any]) -> List[Tuple[int, Dict[str, str], bool]]:
+        """_process_batch 的异步版本"""
+        if len(indices) == 1:
+            return [(indices[0], *await self._aprocess_row(indices[0], rows))]
+
+        with self.timings.measure("prompt"):
+            prompt = self.profile.format_batch_prompt([rows[index] for index in indices])
+        try:
+            response_text = await self.acall_ai_with_retry(prompt, expected_items=len(indices))
+            done, missing = self._parse_batch(indices, rows, prompt, response_text)
+        except Exception as e:
+            self.logger.error(f"❌ 批量请求失败，{len(indices)} 条逐条重试: {e}")
+            done, missing = [], list(indices)
+
+        if done:
+            self.logger.info(f"✅ 批量{self.action_label}成功 {len(done)} 条（第 {indices[0] + 1} 条起）")
+
+        outputs = [(index, card, False) for index, card in done]
+        for index in missing:
+            outputs.append((index, *await self._aprocess_row(index, rows)))
+        return outputs
+
+    # ---------- 执行模式 ----------
+    async def _aprocess_batch_limited(self, semaphore: asyncio.Semaphore, indices: List[int],
+                                      rows: Dict[int, Any]) -> List[Tuple[int, Dict[str, str], bool]]:
+        """在信号量限制下处理一个批次，同时进行的请求不超过 max_concurrency"""
+        async with semaphore:
+            return await self._aprocess_batch(indices, rows)
+
+    def _submit_batches(self, batches: List[List[int]], rows: Dict[int, Any], runner) -> Optional[List[Future]]:
+        """
+        把批次提交给线程池或事件循环，立即返回与 batches 一一对应的 Future 列表
+
+        串行模式（runner 为 None）返回 None，批次在 _collect_batches 中逐个处理。
+        """
+        if isinstance(runner, _EventLoopThread):
+            return [runner.submit(self._aprocess_batch_limited(runner.semaphore, batch, rows)) for batch in batches]
+        if runner:
+            return [runner.submit(self._process_batch, batch, rows) for batch in batches]
+        return None
+
+    def _collect_batches(self, batches: List[List[int]], rows: Dict[int, Any],
+                         futures: Optional[List[Future]], on_result):
+        """等待已提交的批次，按提交顺序通过 on_result(index, card, error) 回调结果"""
+        if futures is None:
+            for batch in batches:
+                for index, card, error in self._process_batch(batch, rows):
+                    on_result(index, card, error)
+            return
+
+        # 按提交顺序取结果，保证输出顺序与输入一致；出错或中断时取消尚未开始的批次
+        try:
+            for future in futures:
+                for index, card, error in future.result():
+                    on_result(index, card, error)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _iter_cards(self, input_rows: Iterable, cache_file: Optional[str] = None) -> Iterator[Dict[str, str]]:
+        """
+        分块读取输入，按输入顺序逐块产出卡片
+
+        内存占用只与块大小有关（断点续传时另需保存日志中已完成的卡片）。
+        第一块只包含一轮并发的量，第一张卡片可以尽快产出，之后块大小逐步翻倍。
+        等待当前块之前先提交下一块，并发流水线不会在块边界排空；
+        异步模式下整个输入共用一个事件循环，异步客户端的连接池在块之间保持复用。
+        """
+        save_interval = self.global_settings.get("save_interval", 10)
+
+        # 检查是否有缓存（按行键匹配，输入增删、重排或修改后只处理变化的行）
+        done, legacy, journal_size = {}, None, 0
+        checkpoint = CheckpointStore(cache_file, fsync_interval=save_interval) if cache_file else None
+        if checkpoint and checkpoint.path.exists():
+            self.logger.info("发现缓存文件，从断点继续...")
+            done, legacy, journal_size = self._load_checkpoint(checkpoint)
+
+        # batch_size > 1 时每个请求打包多条输入
+        max_concurrency = max(1, int(self.global_settings.get("max_concurrency", 1)))
+        batch_size = max(1, int(self.global_settings.get("batch_size", 1)))
+        chunk_size = max_concurrency * batch_size
+        max_chunk_size = max(1000, chunk_size * 10)
+
+        runner = None
+        if self.global_settings.get("async_mode", False):
+            self.logger.info(f"异步模式: 最多 {max_concurrency} 个请求同时进行")
+            runner = _EventLoopThread(max_concurrency)
+        elif max_concurrency > 1:
+            self.logger.info(f"并发模式: 最多 {max_concurrency} 个请求同时进行")
+            runner = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        # 去重：规范化后相同（或近似）的输入只处理一次，卡片复制给所有重复行
+        # 已完成的卡片与 Deduplicator 一样最多保留 dedup_max_entries 组，超出时丢弃最早的
+        dedup = Deduplicator.from_settings(self.global_settings)
+        dedup_cards = {}
+        # 已提交但所在块尚未完成的首条：后一块中的重复行跟随它，不再重复请求
+        inflight = set()
+
+        progress = tqdm(desc=f"{self.action_label}卡片")
+        rows_iter = iter(input_rows)
+        seen_keys = set()
+        offset = reused = deduplicated = failures = 0
+        start_time = time.perf_counter()
+
+        def record_result(chunk: Dict[str, Any], index: int, card: Dict[str, str], error: bool):
+            chunk["results"][index] = card
+            if error:
+                chunk["failed"].add(index)
+            # 每张卡片追加一行，每 save_interval 条落盘一次
+            if checkpoint:
+                with self.timings.measure("checkpoint"):
+                    checkpoint.append({"key": chunk["keys"][index], "card": card, "error": error})
+            progress.update(1)
+
+        def remember_card(group: str, card: Dict[str, str]):
+            if group in dedup_cards:
+                return
+            dedup_cards[group] = card
+            if dedup.max_entries and len(dedup_cards) > dedup.max_entries:
+                del dedup_cards[next(iter(dedup_cards))]
+
+        def start_chunk(items: List[Any], first_index: int) -> Dict[str, Any]:
+            """整理一块输入（断点复用、去重）并提交其中需要请求的批次"""
+            nonlocal reused
+            rows = {first_index + i: item for i, item in enumerate(items)}
+            keys = {index: self.row_key(item) for index, item in rows.items()}
+            seen_keys.update(keys.values())
+            results = {index: done.get(key) for index, key in keys.items()}
+            if legacy:
+                self._reuse_legacy(rows, keys, results, legacy, checkpoint)
+            pending = [index for index, card in results.items() if card is None]
+            reused += len(rows) - len(pending)
+            progress.update(len(rows) - len(pending))
+
+            # 每组重复行只把第一条交给 LLM，其余行在本块完成后复制结果
+            followers, groups, leaders = {}, {}, {}
+            if dedup:
+                groups = {index: dedup.canonical(item) for index, item in rows.items()}
+                for index, card in results.items():
+                    if card is not None:
+                        remember_card(groups[index], card)
+                for index in pending:
+                    group = groups[index]
+                    if group in dedup_cards or group in leaders or group in inflight:
+                        followers[index] = group
+                    else:
+                        leaders[group] = index
+                pending = list(leaders.values())
+                inflight.update(leaders)
+
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            return {
+                "rows": rows, "keys": keys, "results": results, "failed": set(),
+                "pending": pending, "followers": followers, "groups": groups, "leaders": leaders,
+                "batches": batches, "futures": self._submit_batches(batches, rows, runner)
+            }
+
+        def finish_chunk(chunk: Dict[str, Any]) -> Iterator[Dict[str, str]]:
+            """等待一块的批次完成，补齐重复行后按输入顺序产出"""
+            nonlocal journal_size, deduplicated, failures
+            rows, results, failed = chunk["rows"], chunk["results"], chunk["failed"]
+            on_result = functools.partial(record_result, chunk)
+            self._collect_batches(chunk["batches"], rows, chunk["futures"], on_result)
+            journal_size += len(chunk["pending"])
+
+            if dedup:
+                groups, leaders, followers = chunk["groups"], chunk["leaders"], chunk["followers"]
+                for index in chunk["pending"]:
+                    inflight.discard(groups[index])
+                    if index not in failed:
+                        remember_card(groups[index], results[index])
+                retry = []
+                copied = 0
+                for index, group in followers.items():
+                    front_text = self._front_text(rows[index])
+                    if group in dedup_cards:
+                        record_result(chunk, index, dict(dedup_cards[group], front_text=front_text), False)
+                        copied += 1
+                    elif group in leaders:
+                        # 同一块中的首条失败时，重复行同样记为失败（计入 failed，不计入去重）
+                        leader = leaders[group]
+                        record_result(chunk, index, dict(results[leader], front_text=front_text), leader in failed)
+                        copied += leader not in failed
+                    else:
+                        # 跟随的是上一块中失败的首条，或其卡片已超出 dedup_max_entries 被丢弃：重新处理
+                        retry.append(index)
+                if retry:
+                    batches = [retry[i:i + batch_size] for i in range(0, len(retry), batch_size)]
+                    self._collect_batches(batches, rows, self._submit_batches(batches, rows, runner), on_result)
+                journal_size += len(followers)
+                deduplicated += copied
+            failures += len(failed)
+
+            for index in rows:
+                yield results[index]
+
+        submitted = []
+        try:
+            while True:
+                items = list(itertools.islice(rows_iter, chunk_size))
+                if items:
+                    submitted.append(start_chunk(items, offset))
+                    offset += len(items)
+                    chunk_size = min(max_chunk_size, chunk_size * 2)
+                # 下一块已提交后再等待当前块；输入读完后依次处理剩余的块
+                if len(submitted) > 1 or (submitted and not items):
+                    yield from finish_chunk(submitted.pop(0))
+                elif not items:
+                    break
+        finally:
+            for chunk in submitted:
+                for future in chunk["futures"] or []:
+                    future.cancel()
+            progress.close()
+            if isinstance(runner, _EventLoopThread):
+                runner.close(self.ai_provider.aclose)
+            elif runner:
+                runner.shutdown(wait=True)
+            if checkpoint:
+                checkpoint.close()
+                self.logger.info("💾 最终进度已保存")
+
+        if reused:
+            self.logger.info(f"共 {offset} 条，其中 {reused} 条来自断点日志")
+        if deduplicated:
+            self.logger.info(f"去重: {deduplicated} 条重复输入复用了已{self.action_label}的卡片")
+
+        # 日志中的过期记录（已删除或已修改的行）过多时压缩
+        if checkpoint and journal_size > 2 * len(seen_keys):
+            checkpoint.compact(seen_keys)
+
+        if self.response_cache:
+            self.logger.info(
+                f"响应缓存命中 {self.response_cache.hits} 次，"
+                f"未命中 {self.response_cache.misses} 次"
+            )
+
+        # 本次运行的统计，供 main 写入指标文件
+        self.run_stats = {
+            "cards": offset,
+            "reused": reused,
+            "deduplicated": deduplicated,
+            "failed": failures,
+            "errors_by_kind": dict(self.retry_policy.error_counts),
+            "elapsed_seconds": round(time.perf_counter() - start_time, 3)
+        }
+
+        if self.retry_policy.error_counts:
+            self.logger.info("调用错误: " + "，".join(
+                f"{ERROR_KIND_LABELS[kind]} {count} 次" for kind, count in self.retry_policy.error_counts.items()
+            ))
+
+        usage = self.ai_provider.usage
+        if usage.prompt_tokens:
+            self.logger.info(
+                f"Token 用量: 输入 {usage.prompt_tokens}（前缀缓存命中 {usage.cached_tokens}，"
+                f"{usage.cache_hit_ratio:.1%}），输出 {usage.completion_tokens}"
+            )
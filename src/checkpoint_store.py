@@ -0,0 +1,130 @@
+"""
+断点续传存储：追加写入的 JSONL 日志，每完成一张卡片追加一行
+每次保存的代价与已完成条数无关，写入中途崩溃最多丢失最后一行
+"""
+
+import os
+import csv
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Set
+
+
+class CheckpointStore:
+    """追加写入的断点日志，按 fsync_interval 批量落盘"""
+
+    def __init__(self, path: str, fsync_interval: int = 10):
+        self.path = Path(path)
+        self.fsync_interval = max(1, int(fsync_interval))
+        self.logger = logging.getLogger(__name__)
+        self._file = None
+        self._pending = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """计算输入行的稳定键：各部分以 \\x1f 分隔后取 SHA-256"""
+        raw = "\x1f".join("" if part is None else str(part) for part in parts)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def load(self) -> List[Dict]:
+        """
+        读取已完成的记录
+
+        兼容旧版本的 CSV 缓存：检测到后转换为 JSONL 并覆盖原文件。
+        末尾写了一半的行（崩溃导致）会被丢弃并从文件中截断。
+        """
+        if not self.path.exists():
+            return []
+
+        records = []
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for raw_line in f:
+                try:
+                    records.append(json.loads(raw_line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    if not records and self.path.suffix == '.csv':
+                        return self._migrate_csv()
+                    self.logger.warning(f"断点日志 {self.path} 末尾存在不完整记录，已忽略")
+                    break
+                valid_size += len(raw_line)
+
+        if valid_size < self.path.stat().st_size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+        return records
+
+    def _migrate_csv(self) -> List[Dict]:
+        """将旧版 CSV 缓存转换为 JSONL 日志"""
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            records = list(csv.DictReader(f))
+        self.logger.info(f"检测到旧版 CSV 缓存，已转换为追加日志格式（{len(records)} 条）")
+        self.reset()
+        for record in records:
+            self.append(record)
+        self.flush()
+        return records
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, record: Dict):
+        """追加一条记录，每 fsync_interval 条强制落盘一次"""
+        self._open()
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._pending += 1
+        if self._pending >= self.fsync_interval:
+            self.flush()
+
+    def flush(self):
+        """将缓冲区写入磁盘（fsync）"""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def compact(self, keep_keys: Set[str]):
+        """
+        只保留 keep_keys 中每个键的最后一条记录，用于清理过期记录
+
+        两遍扫描：第一遍只记录行号，内存占用只与键的数量有关；
+        先写临时文件再原子替换，压缩中途崩溃不会损坏原日志。
+        """
+        self.close()
+        last_line = {}
+        with open(self.path, 'rb') as f:
+            for line_no, raw_line in enumerate(f):
+                try:
+                    key = json.loads(raw_line).get("key")
+                except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                    continue
+                if key in keep_keys:
+                    last_line[key] = line_no
+        keep_lines = set(last_line.values())
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for line_no, raw_line in enumerate(src):
+                if line_no in keep_lines:
+                    dst.write(raw_line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+        self.logger.info(f"断点日志已压缩，保留 {len(keep_lines)} 条记录")
+
+    def reset(self):
+        """清空日志"""
+        self.close()
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+
+    def close(self):
+        """落盘并关闭文件"""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,127 @@
+"""
+熔断器：服务商连续失败达到阈值后暂停向其发送请求，冷却后放行少量探测请求
+探测成功则恢复，失败则继续熔断；配合 FailoverProvider 在多个服务商之间自动切换
+"""
+
+import time
+import logging
+import threading
+from typing import Dict
+
+from retry_policy import classify_error, get_status_code, RATE_LIMIT, TRANSIENT
+
+
+class CircuitOpenError(Exception):
+    """所有服务商都处于熔断状态，暂时没有可用的服务商"""
+
+
+def is_health_failure(error: Exception) -> bool:
+    """
+    错误是否说明服务商本身不可用
+
+    速率限制、5xx、超时和认证失败计入熔断；单个请求的问题（400、内容过滤）
+    说明服务商仍能正常响应，不计入
+    """
+    return classify_error(error) in (RATE_LIMIT, TRANSIENT) or get_status_code(error) in (401, 403)
+
+
+class CircuitBreaker:
+    """
+    单个服务商的熔断器（多线程共享）
+
+    closed: 正常放行，连续失败 failure_threshold 次后转为 open
+    open: 拒绝所有请求，recovery_timeout 秒后转为 half_open
+    half_open: 最多放行 half_open_max_calls 个探测请求，成功则 closed，失败则重新 open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self.logger = logging.getLogger(__name__)
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, name: str, config: Dict) -> "CircuitBreaker":
+        """按服务商配置（providers.*）中的 circuit_* 设置创建"""
+        return cls(
+            name,
+            failure_threshold=config.get("circuit_failure_threshold", 5),
+            recovery_timeout=config.get("circuit_recovery_seconds", 30.0),
+            half_open_max_calls=config.get("circuit_half_open_calls", 1)
+        )
+
+    def _refresh(self):
+        """open 状态冷却结束后转为 half_open（调用方持有锁）"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def allow_request(self) -> bool:
+        """是否放行本次请求；half_open 状态下放行的请求计为探测"""
+        with self._lock:
+            self._refresh()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                self.logger.info(f"服务商 {self.name} 探测成功，恢复使用")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                if self._state == self.CLOSED:
+                    self.logger.warning(
+                        f"服务商 {self.name} 连续失败 {self._failures} 次，熔断 {self.recovery_timeout:g} 秒"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_neutral(self):
+        """
+        调用以不说明服务商健康状况的错误结束（400、内容过滤等）：不改变状态和失败计数，
+        half_open 状态下归还探测名额，让下一个请求继续探测
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, error: Exception):
+        """按错误类型记录一次调用结果"""
+        if is_health_failure(error):
+            self.record_failure()
+        else:
+            self.record_neutral()
@@ -1,10 +1,17 @@
 """
 数据清洗脚本：从提取的 Anki 卡片中提取古文词语和释义
+
+推荐直接从卡包读取（extract_cards_from_apkg），一次遍历完成字段拆分和 HTML 清洗；
+anki_extractor.py 默认输出的 提取结果.csv 用 extract_cards_from_csv 读取；
+extract_cards 保留用于解析旧版 提取结果.txt。
 """
 import re
+import csv
 import pandas as pd
 from pathlib import Path
 
+from anki_extractor import iter_apkg_notes, clean_html
+
 def clean_html_tags(text):
     """移除HTML标签"""
     # 移除 <b> 和 </b>
@@ -16,6 +23,61 @@ def clean_html_tags(text):
     text = text.replace('<br/>', ' ').replace('<br />', ' ')
     return text
 
+def _write_cleaned_cards(field_rows, output_file):
+    """
+    将 (第一个字段, 第二个字段, ...) 逐行清洗后写入 CSV 和 Tab 分隔的 txt
+    第一个字段为句子，第二个字段为释义，缺少任一项的行跳过
+
+    返回:
+        int: 写入的卡片数
+    """
+    txt_file = output_file.replace('.csv', '.txt')
+    count = 0
+
+    with open(output_file, 'w', encoding='utf-8', newline='') as csv_out, \
+            open(txt_file, 'w', encoding='utf-8', newline='') as txt_out:
+        csv_writer = csv.writer(csv_out)
+        txt_writer = csv.writer(txt_out, delimiter='\t')
+        csv_writer.writerow(['front_text', 'back_text'])
+
+        for fields in field_rows:
+            sentence = clean_html(fields[0]) if fields else ''              # 包含词语的句子
+            meaning = clean_html(fields[1]) if len(fields) > 1 else ''      # 词语释义
+            if sentence and meaning:
+                csv_writer.writerow([sentence, meaning])
+                txt_writer.writerow([sentence, meaning])
+                count += 1
+
+    print(f"共提取 {count} 张卡片")
+    print(f"数据已保存到: {output_file}")
+    print(f"Tab分隔格式已保存到: {txt_file}")
+    return count
+
+def extract_cards_from_apkg(apkg_path, output_file):
+    """
+    直接从 .apkg 卡包提取并清洗卡片数据，不经过 提取结果.txt
+    边读取边写入 CSV 和 Tab 分隔的 txt
+
+    返回:
+        int: 提取的卡片数
+    """
+    print(f"正在读取卡包: {apkg_path}")
+    return _write_cleaned_cards((note["fields"] for note in iter_apkg_notes(apkg_path)), output_file)
+
+def extract_cards_from_csv(input_file, output_file):
+    """
+    从 anki_extractor.py 输出的 提取结果.csv 提取卡片数据
+    字段列在前、元数据列（note_id / notetype / tags）在后，取前两列作为句子和释义
+
+    返回:
+        int: 提取的卡片数
+    """
+    print(f"正在读取文件: {input_file}")
+    with open(input_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # 跳过表头
+        return _write_cleaned_cards(reader, output_file)
+
 def extract_cards(input_file, output_file):
     """提取并清洗卡片数据"""
     print(f"正在读取文件: {input_file}")
@@ -86,10 +148,15 @@ def extract_cards(input_file, output_file):
     return df
 
 if __name__ == '__main__':
-    input_file = r'C:\Users\user\WPSDrive\203612604\WPS云盘\申悦文档\高考准备-anki\Github\anki-assistant\extracted_120\提取结果.txt'
+    input_file = r'C:\Users\user\WPSDrive\203612604\WPS云盘\申悦文档\高考准备-anki\Github\anki-assistant\extracted_120\提取结果.csv'
     output_file = r'C:\Users\user\WPSDrive\203612604\WPS云盘\申悦文档\高考准备-anki\Github\anki-assistant\cleaned_ancient_words.csv'
 
-    df = extract_cards(input_file, output_file)
+    if input_file.endswith('.txt'):
+        # 旧版 anki_extractor.py --format txt 的输出
+        df = extract_cards(input_file, output_file)
+    else:
+        extract_cards_from_csv(input_file, output_file)
+        df = pd.read_csv(output_file, encoding='utf-8')
 
     # 显示前5条数据
     print("\n数据预览（前5条）:")
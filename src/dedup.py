@@ -0,0 +1,162 @@
+"""
+输入去重：规范化文本后合并重复行，可选 MinHash 近似重复检测
+重复的行只调用一次 LLM，结果复制给所有重复行
+"""
+
+import re
+import html
+import random
+import hashlib
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+
+_HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+# 斜杠或方括号中的音标（含 IPA 字符），如 /ˈæpəl/、[ˈæpl]
+_PHONETIC_PATTERN = re.compile(r'[/\[][^/\[\]]*[ˈˌːəæɪʊʌɒɔɑɜɛʃʒθðŋɡ][^/\[\]]*[/\]]')
+
+
+def normalize_text(text) -> str:
+    """规范化文本：去除 HTML 和音标，统一全角/半角与大小写，合并空白"""
+    text = html.unescape(_HTML_TAG_PATTERN.sub(' ', str(text)))
+    text = unicodedata.normalize('NFKC', text)
+    text = _PHONETIC_PATTERN.sub(' ', text)
+    return ' '.join(text.casefold().split())
+
+
+def _choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """选择 LSH 分段 (bands, rows)，使候选阈值 (1/bands)^(1/rows) 最接近相似度阈值"""
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class Deduplicator:
+    """
+    重复行检测
+
+    默认只合并规范化后完全相同的文本；设置 similarity 后，
+    用字符 shingle 的 MinHash + LSH 找出候选，再按 Jaccard 相似度确认近似重复。
+
+    内存占用与记住的不同文本数成正比，最多 max_entries 条：超出时忘记最久未出现的文本
+    （及其 shingle 和 LSH 分桶），之后再出现的重复行会重新处理一次。
+
+    Args:
+        similarity: 近似重复的 Jaccard 相似度阈值（0-1），为空则只做精确去重
+        num_perm: MinHash 的哈希函数个数
+        shingle_size: 字符 shingle 的长度（按字符切分，中英文都适用）
+        max_entries: 最多记住的不同（规范化后）文本数，为空则不限制
+    """
+
+    def __init__(self, similarity: Optional[float] = None, num_perm: int = 64, shingle_size: int = 3,
+                 max_entries: Optional[int] = None):
+        self.similarity = similarity
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.duplicates = 0
+
+        # 规范化文本 -> 代表文本（同组的第一条），按最近出现的顺序排列
+        self._canonical: Dict[str, str] = {}
+
+        if similarity:
+            rng = random.Random(0)
+            # 每个哈希函数为 64 位哈希值与一个随机掩码异或（候选最终按 Jaccard 相似度确认）
+            self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+            self._bands, self._rows = _choose_bands(num_perm, similarity)
+            self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+            self._shingles: Dict[str, Set[str]] = {}
+            # 代表文本 -> 所在的 LSH 分桶，忘记代表时从分桶中移除
+            self._band_keys: Dict[str, List[Tuple[int, Tuple[int, ...]]]] = {}
+
+    @classmethod
+    def from_settings(cls, global_settings: Dict) -> Optional["Deduplicator"]:
+        """按 global_settings 中的 dedup / dedup_similarity / dedup_max_entries 创建，未启用时返回 None"""
+        if not global_settings.get("dedup", False):
+            return None
+        return cls(
+            similarity=global_settings.get("dedup_similarity"),
+            max_entries=global_settings.get("dedup_max_entries", 100000)
+        )
+
+    def _shingle(self, text: str) -> Set[str]:
+        size = self.shingle_size
+        if len(text) <= size:
+            return {text}
+        return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+    def _minhash(self, shingles: Set[str]) -> List[int]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+            for shingle in shingles
+        ]
+        return [min(map(mask.__xor__, hashes)) for mask in self._masks]
+
+    def _find_similar(self, text: str) -> str:
+        """在已登记的代表文本中查找近似重复，找不到时登记为新的代表"""
+        shingles = self._shingle(text)
+        signature = self._minhash(shingles)
+        band_keys = [
+            (band, tuple(signature[band * self._rows:(band + 1) * self._rows]))
+            for band in range(self._bands)
+        ]
+
+        checked = set()
+        for band_key in band_keys:
+            for candidate in self._buckets.get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                other = self._shingles[candidate]
+                if len(shingles & other) >= self.similarity * len(shingles | other):
+                    return candidate
+
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(text)
+        self._shingles[text] = shingles
+        self._band_keys[text] = band_keys
+        return text
+
+    def _forget(self, normalized: str):
+        """忘记一条文本；它是近似去重的代表时同时移除 shingle 和 LSH 分桶"""
+        canonical = self._canonical.pop(normalized)
+        if not self.similarity or canonical != normalized:
+            return
+        self._shingles.pop(normalized, None)
+        for band_key in self._band_keys.pop(normalized, ()):
+            bucket = self._buckets[band_key]
+            bucket.remove(normalized)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def canonical(self, text) -> str:
+        """
+        返回文本所属重复组的代表（规范化后的文本）
+
+        text 可以是多个字段组成的元组（如 (front_text, back_text)），各字段分别规范化后
+        以 \\x1f 连接（规范化会把 \\x1f 当作空白去掉，字段边界不会与内容混淆）。
+        同一组的行返回相同的值；规范化后为空的文本不参与去重。
+        """
+        if isinstance(text, tuple):
+            parts = [normalize_text(part) for part in text]
+            normalized = "\x1f".join(parts) if any(parts) else ""
+        else:
+            normalized = normalize_text(text)
+        if not normalized:
+            return "\x00" + str(text)
+
+        canonical = self._canonical.pop(normalized, None)
+        if canonical is None:
+            canonical = self._find_similar(normalized) if self.similarity else normalized
+        # 重新插入到末尾，最久未出现的文本排在最前
+        self._canonical[normalized] = canonical
+        if self.max_entries and len(self._canonical) > self.max_entries:
+            self._forget(next(iter(self._canonical)))
+        return canonical
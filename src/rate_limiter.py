@@ -0,0 +1,207 @@
+"""
+速率限制器：按每分钟请求数 (RPM) 和每分钟 Token 数 (TPM) 预算控制 API 调用
+采用令牌桶算法，多线程共享，遇到 429 时自动降速并逐步恢复
+"""
+
+import re
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充，允许预留后透支（等待时间由透支量决定）"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        """按经过的时间补充令牌"""
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """预留 amount 个令牌，返回需要等待的秒数"""
+        self.refill(now)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate
+
+
+class RateLimiter:
+    """
+    RPM/TPM 双预算速率限制器
+
+    调用方在每次请求前调用 acquire()，成功后调用 on_success()，
+    收到 429 时调用 on_rate_limited()。未配置任何预算时只在 429 后暂停。
+    TPM 预算在请求前按输入加输出上限预留，请求结束后 release_tokens() 退还预留、
+    charge_tokens() 按服务商返回的实际用量扣减。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        min_rate_ratio: float = 0.1,
+        recovery_ratio: float = 0.05
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_rate_ratio = min_rate_ratio
+        self.recovery_ratio = recovery_ratio
+
+        # 当前速率相对于配置预算的比例，429 时减半，成功时逐步恢复
+        self.rate_scale = 1.0
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # 桶容量为一秒的预算，避免突发请求一次性耗尽整分钟的配额
+        self._request_bucket = None
+        if requests_per_minute:
+            rate = requests_per_minute / 60.0
+            self._request_bucket = TokenBucket(rate, max(1.0, rate))
+
+        self._token_bucket = None
+        if tokens_per_minute:
+            rate = tokens_per_minute / 60.0
+            self._token_bucket = TokenBucket(rate, max(1.0, rate))
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "RateLimiter":
+        """从服务商配置（providers.*）创建速率限制器"""
+        return cls(
+            requests_per_minute=config.get("requests_per_minute"),
+            tokens_per_minute=config.get("tokens_per_minute")
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """是否配置了 RPM 或 TPM 预算"""
+        return self._request_bucket is not None or self._token_bucket is not None
+
+    def _apply_scale(self):
+        """根据 rate_scale 更新令牌桶的补充速率"""
+        if self._request_bucket:
+            self._request_bucket.rate = self.requests_per_minute / 60.0 * self.rate_scale
+        if self._token_bucket:
+            self._token_bucket.rate = self.tokens_per_minute / 60.0 * self.rate_scale
+
+    def _reserve(self, tokens: int) -> float:
+        """预留本次请求的预算，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.blocked_until)
+
+            wait = start - now
+            if self._request_bucket:
+                wait = max(wait, start - now + self._request_bucket.reserve(1, start))
+            if self._token_bucket and tokens:
+                # 单次请求超过桶容量时允许透支，由后续请求分摊等待
+                wait = max(wait, start - now + self._token_bucket.reserve(tokens, start))
+        return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        请求前调用，阻塞到预算允许为止
+
+        Args:
+            tokens: 本次请求预计消耗的 token 数
+
+        Returns:
+            float: 实际等待的秒数
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def _adjust_tokens(self, amount: float):
+        """从 TPM 令牌桶中扣减 amount 个令牌（负数为退还），退还后不超过桶容量"""
+        if not self._token_bucket or not amount:
+            return
+        with self._lock:
+            bucket = self._token_bucket
+            bucket.refill(time.monotonic())
+            bucket.level = min(bucket.capacity, bucket.level - amount)
+
+    def charge_tokens(self, tokens: int):
+        """按服务商返回（或估算）的实际 token 用量扣减 TPM 预算"""
+        self._adjust_tokens(tokens)
+
+    def release_tokens(self, tokens: int):
+        """请求结束后退还 acquire() 时预留的 TPM 预算（实际用量由 charge_tokens 另行扣减）"""
+        self._adjust_tokens(-tokens)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """收到 429 时调用：暂停所有调用方并将速率减半"""
+        with self._lock:
+            now = time.monotonic()
+            self.rate_scale = max(self.min_rate_ratio, self.rate_scale / 2)
+            self._apply_scale()
+
+            if retry_after is None:
+                if self._request_bucket:
+                    retry_after = 1.0 / self._request_bucket.rate
+                else:
+                    retry_after = 1.0
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+            # 清空已积累的令牌，恢复后从零开始补充
+            if self._request_bucket:
+                self._request_bucket.refill(now)
+                self._request_bucket.level = min(self._request_bucket.level, 0.0)
+
+    def on_success(self):
+        """请求成功时调用：速率逐步恢复到配置的预算"""
+        if self.rate_scale >= 1.0:
+            return
+        with self._lock:
+            self.rate_scale = min(1.0, self.rate_scale + self.recovery_ratio)
+            self._apply_scale()
+
+
+_RATE_LIMIT_PATTERN = re.compile(r'\b429\b|\brate[ _-]?limit|\bresource[ _-]?exhausted\b', re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中日韩字符按 1 个计，其余字符按 4 个计 1 个"""
+    cjk_count = len(re.findall(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]', text))
+    return cjk_count + (len(text) - cjk_count) // 4 + 1
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为服务商返回的 429 速率限制错误"""
+    for attr in ("status_code", "code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    name = type(error).__name__
+    if name in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        return True
+    # 只匹配独立的 429 和明确的限速措辞，避免把请求 ID、token 数中的 "429" 误判为限速
+    return bool(_RATE_LIMIT_PATTERN.search(str(error)))
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """从异常附带的 HTTP 响应头中读取 Retry-After（秒）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,134 @@
+"""
+LLM 响应缓存：以 (服务商, 模型, 系统提示词, 用户提示词, 生成参数) 的哈希为键，持久化存储在 SQLite 中
+与输入顺序无关，重复出现的卡片不再调用 API
+"""
+
+import json
+import sqlite3
+import hashlib
+import threading
+import time
+import logging
+from typing import Dict, Optional
+
+
+class ResponseCache:
+    """基于 SQLite 的内容寻址响应缓存，支持按条数和时间淘汰"""
+
+    # 每写入多少条执行一次淘汰检查
+    EVICT_INTERVAL = 100
+
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: Optional[int] = None,
+        max_age_days: Optional[float] = None
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # 并发模式下多个工作线程共用同一个连接，由 _lock 串行化访问
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str,
+        system_prompt: str,
+        prompt: str,
+        generation_options: Optional[Dict] = None
+    ) -> str:
+        """
+        计算缓存键：各部分以 \\x1f 分隔后取 SHA-256
+
+        generation_options（max_tokens / temperature / stop_sequences）不同的响应分别缓存；
+        未设置生成参数时键与之前相同，已有的缓存仍然有效
+        """
+        parts = [provider or "", model or "", system_prompt or "", prompt or ""]
+        if generation_options:
+            parts.append(json.dumps(generation_options, sort_keys=True, ensure_ascii=False))
+        raw = "\x1f".join(parts)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，过期的条目视为未命中"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str):
+        """写入缓存"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self.conn.commit()
+            self._writes += 1
+            need_evict = self._writes % self.EVICT_INTERVAL == 0
+        if need_evict:
+            self.evict()
+
+    def delete(self, key: str):
+        """删除缓存条目（例如响应无法解析时）"""
+        with self._lock:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def evict(self):
+        """淘汰过期条目，以及超出 max_entries 的最久未访问条目"""
+        with self._lock:
+            removed = 0
+            if self.max_age_seconds:
+                cursor = self.conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?",
+                    (time.time() - self.max_age_seconds,)
+                )
+                removed += cursor.rowcount
+            if self.max_entries:
+                count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    cursor = self.conn.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        " SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+                    removed += cursor.rowcount
+            self.conn.commit()
+        if removed:
+            self.logger.info(f"响应缓存淘汰 {removed} 条记录")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,213 @@
+"""
+重试策略：按错误类型决定是否重试，采用完全抖动 (full jitter) 的指数退避
+anki_llm_forge.py、anki_enhancer.py 与 anki_process.py 共用
+
+- 速率限制 (429)：重试，等待时间不少于服务商返回的 Retry-After
+- 临时错误（5xx、超时、连接错误）：重试
+- 永久错误（400/401/403/404 等，如 API Key 无效）：立即失败
+- 内容过滤（被安全策略拦截）：立即失败，重试只会得到相同结果
+- 熔断（所有服务商的熔断器都处于 open 状态）：立即失败，冷却结束前重试不会有结果
+"""
+
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+import itertools
+from typing import Dict, Optional
+
+from rate_limiter import is_rate_limit_error, get_retry_after
+
+
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+CONTENT_FILTER = "content_filter"
+CIRCUIT_OPEN = "circuit_open"
+
+# 不重试的错误类型
+NON_RETRYABLE = (PERMANENT, CONTENT_FILTER, CIRCUIT_OPEN)
+
+ERROR_KIND_LABELS = {
+    RATE_LIMIT: "速率限制",
+    TRANSIENT: "临时错误",
+    PERMANENT: "永久错误",
+    CONTENT_FILTER: "内容过滤",
+    CIRCUIT_OPEN: "服务商熔断",
+}
+
+# 按异常类名判断（openai / httpx / google.api_core 的异常类型）
+_TRANSIENT_NAMES = ("Timeout", "Connection", "ServiceUnavailable", "InternalServer", "ServerError",
+                    "DeadlineExceeded", "BadGateway", "GatewayTimeout", "RemoteProtocolError")
+_PERMANENT_NAMES = ("Authentication", "PermissionDenied", "NotFound", "BadRequest", "InvalidArgument",
+                    "Unauthenticated", "UnprocessableEntity", "FailedPrecondition")
+_CONTENT_FILTER_NAMES = ("BlockedPrompt", "StopCandidate", "ContentFilter")
+_CONTENT_FILTER_PATTERN = re.compile(r'content[_ ]filter|content[_ ]policy|safety', re.IGNORECASE)
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """读取异常或其 HTTP 响应上的状态码"""
+    for source in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "code"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+
+def classify_error(error: Exception) -> str:
+    """将服务商调用的异常归类为 RATE_LIMIT / TRANSIENT / PERMANENT / CONTENT_FILTER / CIRCUIT_OPEN"""
+    # circuit_breaker 依赖本模块，按类名判断 CircuitOpenError 以避免循环导入
+    if type(error).__name__ == "CircuitOpenError":
+        return CIRCUIT_OPEN
+    if is_rate_limit_error(error):
+        return RATE_LIMIT
+
+    name = type(error).__name__
+    status = get_status_code(error)
+    if (
+        any(part in name for part in _CONTENT_FILTER_NAMES)
+        or getattr(error, "code", None) == "content_filter"
+        or (status in (None, 400) and _CONTENT_FILTER_PATTERN.search(str(error)))
+    ):
+        return CONTENT_FILTER
+
+    if status is not None:
+        if status >= 500 or status in (408, 409, 425):
+            return TRANSIENT
+        if 400 <= status < 500:
+            return PERMANENT
+
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return TRANSIENT
+    if any(part in name for part in _TRANSIENT_NAMES):
+        return TRANSIENT
+    if any(part in name for part in _PERMANENT_NAMES):
+        return PERMANENT
+    # 无法判断的错误按临时错误处理，保持原有的重试行为
+    return TRANSIENT
+
+
+class RetryPolicy:
+    """
+    服务商调用的重试策略
+
+    第 n 次重试前等待 uniform(0, min(max_delay, base_delay * 2^n)) 秒（完全抖动），
+    多个并发请求同时失败时不会在同一时刻一起重试；速率限制时至少等待 Retry-After。
+    从第一次调用起超过 deadline 秒后不再安排重试。
+
+    Args:
+        max_retries: 最多尝试次数（含第一次）
+        base_delay: 退避的基准时间（秒）
+        max_delay: 单次退避的上限（秒）
+        deadline: 单个请求（含所有重试）的总时限（秒），为空则不限
+        timings: 可选的 StageTimer，记录每次退避等待的时间（retry_backoff 阶段）
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 2.0,
+        max_delay: float = 60.0,
+        deadline: Optional[float] = None,
+        timings=None
+    ):
+        self.max_retries = max(1, int(max_retries))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.timings = timings
+        self.logger = logging.getLogger(__name__)
+
+        # 各类错误出现的次数，用于运行结束后的统计
+        self.error_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, global_settings: Dict, timings=None) -> "RetryPolicy":
+        """按 global_settings 中的 max_retries / retry_base_delay / retry_max_delay / retry_deadline 创建"""
+        return cls(
+            max_retries=global_settings.get("max_retries", 3),
+            base_delay=global_settings.get("retry_base_delay", 2.0),
+            max_delay=global_settings.get("retry_max_delay", 60.0),
+            deadline=global_settings.get("retry_deadline", 300),
+            timings=timings
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的退避时间（完全抖动）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, error: Exception, attempt: int, elapsed: float) -> Optional[float]:
+        """
+        计算下一次重试前的等待时间
+
+        Args:
+            error: 本次失败的异常
+            attempt: 本次是第几次尝试（从 0 开始）
+            elapsed: 从第一次尝试开始经过的秒数
+
+        Returns:
+            等待秒数，不应再重试时返回 None
+        """
+        kind = classify_error(error)
+        if kind in NON_RETRYABLE or attempt + 1 >= self.max_retries:
+            return None
+
+        delay = self.backoff(attempt)
+        if kind == RATE_LIMIT:
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+        if self.deadline is not None and elapsed + delay > self.deadline:
+            return None
+        return delay
+
+    def _on_failure(self, error: Exception, attempt: int, start: float) -> Optional[float]:
+        """记录并记日志，返回等待时间（None 表示放弃）"""
+        kind = classify_error(error)
+        with self._lock:
+            self.error_counts[kind] = self.error_counts.get(kind, 0) + 1
+
+        delay = self.next_delay(error, attempt, time.monotonic() - start)
+        label = ERROR_KIND_LABELS[kind]
+        if delay is None and kind in NON_RETRYABLE:
+            self.logger.warning(f"AI 调用失败（{label}，不再重试）: {error}")
+        elif delay is None:
+            self.logger.warning(f"AI 调用失败（{label}，尝试 {attempt + 1}/{self.max_retries}，放弃）: {error}")
+        else:
+            self.logger.warning(
+                f"AI 调用失败（{label}，尝试 {attempt + 1}/{self.max_retries}，{delay:.1f} 秒后重试）: {error}"
+            )
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """按重试策略调用 func，最终失败时抛出最后一次的异常"""
+        start = time.monotonic()
+        for attempt in itertools.count():
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_failure(e, attempt, start)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            if self.timings:
+                self.timings.add("retry_backoff", delay)
+
+    async def acall(self, func, *args, **kwargs):
+        """call 的异步版本，func 为协程函数"""
+        start = time.monotonic()
+        for attempt in itertools.count():
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_failure(e, attempt, start)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            if self.timings:
+                self.timings.add("retry_backoff", delay)
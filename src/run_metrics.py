@@ -0,0 +1,296 @@
+"""
+运行指标：每次运行结束后向指标文件追加一行 JSON 记录
+记录 Profile、服务商、卡片数、耗时与 token 用量，用于比较不同 Profile 和批量设置的开销
+StageTimer 记录热路径各阶段的耗时分布（p50/p95/p99），可输出汇总表或 Prometheus 文本格式
+
+查看按 Profile 汇总的结果:
+    python run_metrics.py run_metrics.jsonl
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+
+# 阶段名称（Prometheus 标签）及汇总表中的说明，按流水线顺序排列
+STAGE_LABELS = {
+    "prompt": "提示词格式化",
+    "response_cache": "响应缓存查询",
+    "rate_limit_wait": "速率限制等待",
+    "first_token": "首段响应等待",
+    "network": "服务商调用",
+    "retry_backoff": "重试退避",
+    "parse": "清洗/解析响应",
+    "map_fields": "字段映射",
+    "checkpoint": "断点日志写入",
+}
+
+
+class LatencyHistogram:
+    """对数分桶的耗时直方图：内存占用与样本数无关，分位数的相对误差约 2.5%（也用于统计输出 token 数）"""
+
+    GROWTH = 1.05
+    MIN_SECONDS = 1e-6
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        index = int(math.log(max(seconds, self.MIN_SECONDS) / self.MIN_SECONDS, self.GROWTH))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """返回第 q 分位（0-1）的耗时，取所在桶的几何中点"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** (index + 0.5))
+        return self.max
+
+
+class StageTimer:
+    """按阶段累计耗时直方图（多线程共享）"""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, LatencyHistogram] = {}
+
+    def add(self, stage: str, seconds: float):
+        """记录某阶段的一次耗时（秒）"""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        """统计 with 块的耗时（抛出异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def percentile(self, stage: str, q: float) -> Optional[float]:
+        """某阶段耗时的第 q 分位，尚无样本时返回 None"""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None or not histogram.count:
+                return None
+            return histogram.percentile(q)
+
+    def _ordered(self):
+        order = list(STAGE_LABELS)
+        return sorted(self.stages.items(), key=lambda item: (
+            order.index(item[0]) if item[0] in order else len(order), item[0]
+        ))
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """导出各阶段的次数、总耗时与分位数（秒）"""
+        with self._lock:
+            return {
+                stage: {
+                    "count": histogram.count,
+                    "total": round(histogram.total, 3),
+                    "p50": round(histogram.percentile(0.5), 6),
+                    "p95": round(histogram.percentile(0.95), 6),
+                    "p99": round(histogram.percentile(0.99), 6),
+                    "max": round(histogram.max, 6)
+                }
+                for stage, histogram in self._ordered()
+            }
+
+    def summary_table(self) -> str:
+        """各阶段耗时汇总表（毫秒）"""
+        lines = [
+            f"{'阶段':<16}{'次数':>8}{'总耗时(s)':>12}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}",
+            "-" * 76
+        ]
+        for stage, stats in self.to_dict().items():
+            label = STAGE_LABELS.get(stage, stage)
+            lines.append(
+                f"{label:<16}{stats['count']:>8}{stats['total']:>12.2f}{stats['p50'] * 1000:>10.1f}"
+                f"{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}"
+            )
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix: str = "anki_assistant", labels: Optional[Dict[str, str]] = None) -> str:
+        """导出为 Prometheus 文本格式（summary 类型，按 stage 标签区分）"""
+        name = f"{prefix}_stage_seconds"
+        base = "".join(f'{key}="{value}",' for key, value in (labels or {}).items())
+        lines = [
+            f"# HELP {name} Time spent in each pipeline stage.",
+            f"# TYPE {name} summary"
+        ]
+        with self._lock:
+            for stage, histogram in self._ordered():
+                for q in self.QUANTILES:
+                    lines.append(f'{name}{{{base}stage="{stage}",quantile="{q}"}} {histogram.percentile(q):.6f}')
+                lines.append(f'{name}_sum{{{base}stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'{name}_count{{{base}stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+def suggest_max_tokens(
+    lengths: LatencyHistogram,
+    percentile: float = 0.99,
+    headroom: float = 1.25,
+    step: int = 64
+) -> Optional[int]:
+    """
+    按观测到的每次调用输出 token 数建议 max_tokens
+
+    取第 percentile 分位并留出 headroom 倍余量，向上取整到 step 的倍数；
+    少数失控的超长输出会被截断，正常响应不受影响。尚无样本时返回 None
+    """
+    if not lengths.count:
+        return None
+    target = lengths.percentile(percentile) * headroom
+    return max(step, math.ceil(target / step) * step)
+
+
+def output_length_report(usage, current_limit: Optional[int] = None, batch_size: int = 1) -> str:
+    """输出长度测量模式的报告：每次调用的输出 token 分布与建议的 max_tokens（usage 为 UsageStats）"""
+    lengths = usage.completion_lengths
+    if not lengths.count:
+        return "没有可用的输出长度样本（所有响应均来自缓存或调用失败）"
+    lines = [
+        f"输出长度（每次调用，{lengths.count} 个样本）: "
+        f"p50 {lengths.percentile(0.5):.0f} / p95 {lengths.percentile(0.95):.0f} / "
+        f"p99 {lengths.percentile(0.99):.0f} / max {lengths.max} token",
+        f"建议在 Profile 中设置 \"max_tokens\": {suggest_max_tokens(lengths)}"
+        f"（当前: {current_limit if current_limit else '服务商默认值'}）"
+    ]
+    if batch_size > 1:
+        lines.append(f"注意: 按 batch_size={batch_size} 的每次请求统计，调整 batch_size 后需重新测量")
+    if usage.truncated:
+        lines.append(f"⚠️  {usage.truncated} 个响应达到 max_tokens 上限被截断，实际分布可能更长")
+    return "\n".join(lines)
+
+
+def estimate_cost(usage: Dict, prices: Optional[Dict]) -> Optional[float]:
+    """
+    按服务商配置的单价估算费用
+
+    prices 为每百万 token 的单价: {"input": ..., "cached_input": ..., "output": ...}，
+    未配置 cached_input 时缓存命中的 token 按 input 计价
+    """
+    if not prices:
+        return None
+    input_price = prices.get("input", 0)
+    cached_price = prices.get("cached_input", input_price)
+    uncached_tokens = usage["prompt_tokens"] - usage["cached_tokens"]
+    cost = (
+        uncached_tokens * input_price
+        + usage["cached_tokens"] * cached_price
+        + usage["completion_tokens"] * prices.get("output", 0)
+    ) / 1_000_000
+    return round(cost, 6)
+
+
+def build_run_record(
+    tool: str,
+    profile_name: str,
+    provider_name: str,
+    provider,
+    run_stats: Dict
+) -> Dict:
+    """汇总一次运行的指标记录（provider 为 AIProvider 实例，用量与阶段耗时取自 provider.usage / provider.timings）"""
+    usage = provider.usage.to_dict()
+    elapsed = run_stats.get("elapsed_seconds", 0)
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "tool": tool,
+        "profile": profile_name,
+        "provider": provider_name,
+        "model": provider.config.get("model"),
+        **run_stats,
+        "cards_per_second": round(run_stats.get("cards", 0) / elapsed, 3) if elapsed else 0.0,
+        "usage": usage,
+        "estimated_cost": estimate_cost(usage, provider.config.get("price_per_million_tokens")),
+        "stages": provider.timings.to_dict(),
+        "provider_stats": provider.provider_stats()
+    }
+
+
+def append_run_metrics(path: str, record: Dict):
+    """向指标文件追加一条记录（JSONL，每次运行一行）"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def write_prometheus(path: str, timings: StageTimer, labels: Optional[Dict[str, str]] = None):
+    """写入 Prometheus 文本格式文件（先写临时文件再替换，可供 node_exporter 的 textfile 采集器读取）"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(timings.to_prometheus(labels=labels))
+    os.replace(tmp_path, path)
+
+
+def summarize_by_profile(path: str) -> Dict[str, Dict]:
+    """读取指标文件，按 (工具, Profile) 汇总所有运行"""
+    summary = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            name = f"{record.get('tool')}:{record.get('profile')}"
+            total = summary.setdefault(name, {
+                "runs": 0, "cards": 0, "calls": 0, "errors": 0,
+                "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                "elapsed_seconds": 0.0, "estimated_cost": 0.0
+            })
+            usage = record.get("usage", {})
+            total["runs"] += 1
+            total["cards"] += record.get("cards", 0)
+            total["elapsed_seconds"] += record.get("elapsed_seconds", 0)
+            total["estimated_cost"] += record.get("estimated_cost") or 0
+            for key in ("calls", "errors", "prompt_tokens", "cached_tokens", "completion_tokens"):
+                total[key] += usage.get(key, 0)
+    return summary
+
+
+def main():
+    """打印按 Profile 汇总的运行指标"""
+    path = sys.argv[1] if len(sys.argv) > 1 else "run_metrics.jsonl"
+    if not Path(path).exists():
+        print(f"❌ 指标文件不存在: {path}")
+        return 1
+
+    summary = summarize_by_profile(path)
+    print(f"\n{'Profile':<40}{'运行':>6}{'卡片':>9}{'调用':>8}{'输入 token':>14}"
+          f"{'缓存命中':>12}{'输出 token':>14}{'token/卡':>10}{'卡/秒':>9}{'费用':>10}")
+    print("-" * 132)
+    for name, total in sorted(summary.items()):
+        cards = total["cards"]
+        tokens_per_card = (total["prompt_tokens"] + total["completion_tokens"]) / cards if cards else 0
+        cards_per_second = cards / total["elapsed_seconds"] if total["elapsed_seconds"] else 0
+        print(f"{name:<40}{total['runs']:>6}{cards:>9}{total['calls']:>8}{total['prompt_tokens']:>14}"
+              f"{total['cached_tokens']:>12}{total['completion_tokens']:>14}{tokens_per_card:>10.0f}"
+              f"{cards_per_second:>9.2f}{total['estimated_cost']:>10.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
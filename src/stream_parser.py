@@ -0,0 +1,234 @@
+"""
+流式响应解析：逐段接收模型输出，判断结果是否已经完整
+完整后立即关闭流，服务商停止生成，不再为 JSON 之后的多余 token 付费
+
+- JsonStreamScanner: JSON 对象在所有 output_fields 的值结束后即视为完整（补上右括号），
+  批量请求的 JSON 数组在收到预期条数后即视为完整
+- TextSectionScanner: v4 纯文本 Profile 按模板中的【小节】标题判断，
+  所有小节都已出现后，再出现重复/多余的标题或包裹整个响应的代码块结束标记时截断
+"""
+
+import re
+import string
+from typing import Callable, Iterable, List, Optional, Set
+
+
+class JsonStreamScanner:
+    """
+    增量扫描 JSON 文本（只跟踪括号深度和字符串状态，不做完整解析）
+
+    Args:
+        required_fields: 顶层对象中必须完整的字段，全部完整后即可提前结束
+        expected_items: 顶层数组的预期条数，收到这么多条后即可提前结束
+    """
+
+    def __init__(self, required_fields: Optional[List[str]] = None, expected_items: Optional[int] = None):
+        self.required_fields = set(required_fields or [])
+        self.expected_items = expected_items
+        self.text = ""
+        self.complete = False
+
+        self._pos = 0
+        self._start = None
+        self._root = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._key = None
+        self._done_keys: Set[str] = set()
+        self._element_open = False
+        self._items = 0
+        self._result = None
+
+    def feed(self, chunk: str) -> bool:
+        """追加一段文本，返回结果是否已经完整"""
+        if self.complete:
+            return True
+        self.text += chunk
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._root == "{" and self._expect_key:
+                        self._key = text[self._string_start:pos]
+                        self._expect_key = False
+                continue
+
+            if self._start is None:
+                # 跳过 JSON 之前的内容（如 ```json）
+                if char in "{[":
+                    self._start, self._root, self._depth = pos, char, 1
+                    self._expect_key = char == "{"
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos + 1
+                self._element_open = True
+            elif char in "{[":
+                self._depth += 1
+                self._element_open = True
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._finish(text[self._start:pos + 1], pos + 1)
+            elif self._depth == 1 and char == ",":
+                if self._root == "{":
+                    self._done_keys.add(self._key)
+                    self._expect_key = True
+                    if self.required_fields and self.required_fields <= self._done_keys:
+                        return self._finish(text[self._start:pos] + "}", pos)
+                else:
+                    self._items += self._element_open
+                    self._element_open = False
+                    if self.expected_items and self._items >= self.expected_items:
+                        return self._finish(text[self._start:pos] + "]", pos)
+            elif not char.isspace():
+                self._element_open = True
+        self._pos = len(text)
+        return False
+
+    def _finish(self, result: str, end: int) -> bool:
+        self._result = result
+        self._pos = end
+        self.complete = True
+        return True
+
+    def result(self) -> str:
+        """完整时返回截取（必要时补全括号）后的 JSON，否则返回收到的全部文本"""
+        return self._result if self.complete else self.text
+
+
+_HEADING_PATTERN = re.compile(r'【([^】\n]+)】')
+_LINE_HEADING_PATTERN = re.compile(r'^\s*【([^】\n]+)】', re.MULTILINE)
+_FENCE_PATTERN = re.compile(r'^\s*```\s*$', re.MULTILINE)
+_OPEN_FENCE_PATTERN = re.compile(r'^\s*```')
+
+
+def output_sections(template: str) -> List[str]:
+    """模板中最后一个占位符之后出现的【小节】标题，即要求模型输出的小节"""
+    segments = list(string.Formatter().parse(template))
+    last_field = max((i for i, (_, field, _, _) in enumerate(segments) if field is not None), default=-1)
+    trailing = "".join(literal for literal, _, _, _ in segments[last_field + 1:])
+    sections = []
+    for heading in _HEADING_PATTERN.findall(trailing):
+        if heading not in sections:
+            sections.append(heading)
+    return sections
+
+
+class TextSectionScanner:
+    """
+    增量扫描按【小节】组织的纯文本
+
+    所有预期小节都出现之后，遇到重复或模板之外的标题、或单独一行的 ``` 时视为结束；
+    没有预期小节时只在代码块结束标记处截断。响应开头的 ``` / ```text 视为包裹整个响应的代码块。
+    小节内的代码块（```python … ```）单独跟踪，其中的标题和结束标记不会截断响应。
+    """
+
+    def __init__(self, sections: Optional[List[str]] = None):
+        self.sections = list(sections or [])
+        self.text = ""
+        self.complete = False
+        self._seen: Set[str] = set()
+        self._line_start = 0
+        self._content_started = False
+        self._in_code_block = False
+        self._end = None
+
+    def feed(self, chunk: str) -> bool:
+        """追加一段文本，返回结果是否已经完整"""
+        if self.complete:
+            return True
+        self.text += chunk
+        # 只检查已经完整的行，标题可能被拆在两段中
+        last_newline = self.text.rfind("\n")
+        if last_newline < self._line_start:
+            return False
+        block = self.text[self._line_start:last_newline + 1]
+        base = self._line_start
+        self._line_start = last_newline + 1
+
+        for line_match in re.finditer(r'[^\n]*\n', block):
+            line = line_match.group()
+            position = base + line_match.start()
+            if self._in_code_block:
+                if _FENCE_PATTERN.match(line):
+                    self._in_code_block = False
+                continue
+            if not self._content_started and _OPEN_FENCE_PATTERN.match(line):
+                # 包裹整个响应的代码块开始标记（``` 或 ```text 等）
+                continue
+            if _FENCE_PATTERN.match(line):
+                if not self.sections or len(self._seen) == len(self.sections):
+                    return self._finish(position)
+                # 还有小节未出现：这是小节内代码块的开始标记
+                self._in_code_block = True
+                continue
+            if _OPEN_FENCE_PATTERN.match(line):
+                self._in_code_block = True
+                self._content_started = True
+                continue
+            heading = _LINE_HEADING_PATTERN.match(line)
+            if heading:
+                name = heading.group(1)
+                all_seen = self.sections and len(self._seen) == len(self.sections)
+                if all_seen and (name in self._seen or name not in self.sections):
+                    return self._finish(position)
+                if name in self.sections:
+                    self._seen.add(name)
+            if line.strip():
+                self._content_started = True
+        return False
+
+    def _finish(self, end: int) -> bool:
+        self._end = end
+        self.complete = True
+        return True
+
+    def result(self) -> str:
+        """完整时返回截断后的文本，否则返回收到的全部文本"""
+        return self.text[:self._end].rstrip() if self.complete else self.text
+
+
+def collect_stream(stream: Iterable[str], scanner, preview: Optional[Callable[[str], None]] = None) -> str:
+    """
+    读取流式响应直到结束或 scanner 判断结果完整，随后关闭流
+
+    preview 为可选的实时预览回调，逐段接收文本，结束时收到 "\\n"
+    """
+    try:
+        for chunk in stream:
+            if preview:
+                preview(chunk)
+            if scanner.feed(chunk):
+                break
+    finally:
+        stream.close()
+        if preview:
+            preview("\n")
+    return scanner.result()
+
+
+async def acollect_stream(stream, scanner, preview: Optional[Callable[[str], None]] = None) -> str:
+    """collect_stream 的异步版本，stream 为异步迭代器"""
+    try:
+        async for chunk in stream:
+            if preview:
+                preview(chunk)
+            if scanner.feed(chunk):
+                break
+    finally:
+        await stream.aclose()
+        if preview:
+            preview("\n")
+    return scanner.result()
@@ -0,0 +1,10 @@
+"""
+测试公共设置：src/ 下的模块以脚本方式互相导入，测试时将 src/ 加入 sys.path
+"""
+
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
@@ -0,0 +1,85 @@
+"""CheckpointStore：旧版 CSV 迁移、末尾不完整行的截断、压缩"""
+
+import csv
+import json
+
+from checkpoint_store import CheckpointStore
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_missing_file_loads_empty(tmp_path):
+    assert CheckpointStore(str(tmp_path / "none.jsonl")).load() == []
+
+
+def test_append_and_load_round_trip(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    store = CheckpointStore(str(path), fsync_interval=2)
+    for i in range(3):
+        store.append({"key": str(i), "value": f"值{i}"})
+    store.close()
+
+    assert CheckpointStore(str(path)).load() == [{"key": str(i), "value": f"值{i}"} for i in range(3)]
+
+
+def test_legacy_csv_is_migrated_to_jsonl(tmp_path):
+    path = tmp_path / "cache.csv"
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["front_text", "definition"])
+        writer.writeheader()
+        writer.writerow({"front_text": "apple", "definition": "苹果"})
+        writer.writerow({"front_text": "pear", "definition": "梨, 水果"})
+
+    records = CheckpointStore(str(path)).load()
+
+    expected = [{"front_text": "apple", "definition": "苹果"}, {"front_text": "pear", "definition": "梨, 水果"}]
+    assert records == expected
+    # 文件已改写为 JSONL，再次读取不再走迁移
+    assert read_lines(path) == expected
+    assert CheckpointStore(str(path)).load() == expected
+
+
+def test_truncated_last_line_is_dropped_and_cut(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    complete = json.dumps({"key": "a", "value": 1}) + "\n"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(complete + '{"key": "b", "val')
+
+    store = CheckpointStore(str(path))
+    assert store.load() == [{"key": "a", "value": 1}]
+    assert path.read_text(encoding="utf-8") == complete
+
+    # 截断后追加的记录紧接在最后一条完整记录之后
+    store.append({"key": "b", "value": 2})
+    store.close()
+    assert CheckpointStore(str(path)).load() == [{"key": "a", "value": 1}, {"key": "b", "value": 2}]
+
+
+def test_compact_keeps_last_record_of_each_kept_key(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    store = CheckpointStore(str(path))
+    for record in [
+        {"key": "a", "value": 1},
+        {"key": "b", "value": 1},
+        {"key": "a", "value": 2},
+        {"key": "stale", "value": 1},
+        {"key": "b", "value": 2},
+    ]:
+        store.append(record)
+
+    store.compact({"a", "b"})
+
+    assert read_lines(path) == [{"key": "a", "value": 2}, {"key": "b", "value": 2}]
+    assert not (tmp_path / "journal.jsonl.tmp").exists()
+    # 压缩后可以继续追加
+    store.append({"key": "c", "value": 1})
+    store.close()
+    assert [record["key"] for record in CheckpointStore(str(path)).load()] == ["a", "b", "c"]
+
+
+def test_make_key_separates_parts():
+    assert CheckpointStore.make_key("ab", "c") != CheckpointStore.make_key("a", "bc")
+    assert CheckpointStore.make_key("a", None) == CheckpointStore.make_key("a", "")
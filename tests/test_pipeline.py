@@ -0,0 +1,125 @@
+"""CardPipeline：结果顺序与断点续传（MockProvider，不访问网络）"""
+
+import logging
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+pd = pytest.importorskip("pandas")
+
+from anki_enhancer import AnkiCardEnhancer  # noqa: E402
+from anki_llm_forge import AnkiCardGenerator  # noqa: E402
+
+FORGE_PROFILE = {
+    "user_prompt_template": "Explain the word {front_text}. Return JSON with definition and example.",
+    "output_fields": ["definition", "example"],
+    "anki_fields": ["front_text", "definition", "example"],
+    "field_mapping": {"definition": "definition", "example": "example"}
+}
+
+ENHANCER_PROFILE = {
+    "user_prompt_template": "Improve the back of this card.\nFront: {front_text}\nBack: {back_text}",
+    "output_format": "text"
+}
+
+SETTINGS = [
+    {"max_concurrency": 1},
+    {"max_concurrency": 4},
+    {"max_concurrency": 4, "async_mode": True},
+]
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setenv("TQDM_DISABLE", "1")
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def forge_config(settings, **mock):
+    return {
+        "global_settings": dict(
+            settings, provider="mock", active_profile="test", request_delay=0, max_retries=1, save_interval=2
+        ),
+        "providers": {"mock": dict(mock, output_fields=FORGE_PROFILE["output_fields"], response_format="json")},
+        "profiles": {"test": FORGE_PROFILE}
+    }
+
+
+def enhancer_config(settings, **mock):
+    return {
+        "global_settings": dict(
+            settings, provider="mock", active_profile="test", request_delay=0, max_retries=1, save_interval=2
+        ),
+        "providers": {"mock": dict(mock, output_fields=["enhanced_back"], response_format="text")},
+        "profiles": {"test": ENHANCER_PROFILE}
+    }
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_forge_keeps_input_order(settings):
+    words = [f"word{i}" for i in range(40)]
+    generator = AnkiCardGenerator(forge_config(settings, latency_ms=2, latency_sigma=1.0, seed=1))
+
+    cards = generator.generate_cards(words)
+
+    assert list(cards["front_text"]) == words
+    assert cards["definition"].str.startswith("mock definition").all()
+    assert generator.ai_provider.usage.calls == len(words)
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_forge_resumes_from_checkpoint(settings, tmp_path):
+    cache_file = str(tmp_path / "checkpoint.jsonl")
+    words = [f"word{i}" for i in range(12)]
+
+    first = AnkiCardGenerator(forge_config(settings)).generate_cards(words[:8], cache_file=cache_file)
+
+    resumed = AnkiCardGenerator(forge_config(settings))
+    cards = resumed.generate_cards(words[::-1], cache_file=cache_file)
+
+    # 只为新增的 4 行调用服务商，已完成的行原样取自断点日志，顺序跟随本次输入
+    assert resumed.ai_provider.usage.calls == 4
+    assert list(cards["front_text"]) == words[::-1]
+    previous = dict(zip(first["front_text"], first["definition"]))
+    for word, definition in zip(cards["front_text"], cards["definition"]):
+        if word in previous:
+            assert definition == previous[word]
+
+
+def test_forge_retries_failed_rows_on_resume(tmp_path):
+    cache_file = str(tmp_path / "checkpoint.jsonl")
+    words = [f"word{i}" for i in range(10)]
+
+    failing = AnkiCardGenerator(forge_config({"max_concurrency": 2}, error_rate=1.0))
+    failing.generate_cards(words, cache_file=cache_file)
+    assert failing.run_stats["failed"] == len(words)
+
+    resumed = AnkiCardGenerator(forge_config({"max_concurrency": 2}))
+    cards = resumed.generate_cards(words, cache_file=cache_file)
+
+    assert resumed.ai_provider.usage.calls == len(words)
+    assert resumed.run_stats["failed"] == 0
+    assert list(cards["front_text"]) == words
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_enhancer_keeps_order_and_resumes(settings, tmp_path):
+    cache_file = str(tmp_path / "checkpoint.jsonl")
+    input_df = pd.DataFrame({
+        "front_text": [f"word{i}" for i in range(10)],
+        "back_text": [f"meaning {i}" for i in range(10)]
+    })
+
+    first = AnkiCardEnhancer(enhancer_config(settings, latency_ms=2, seed=2))
+    cards = first.enhance_cards(input_df, cache_file=cache_file)
+    assert list(cards["front_text"]) == list(input_df["front_text"])
+
+    reversed_df = input_df.iloc[::-1].reset_index(drop=True)
+    resumed = AnkiCardEnhancer(enhancer_config(settings))
+    resumed_cards = resumed.enhance_cards(reversed_df, cache_file=cache_file)
+
+    assert resumed.ai_provider.usage.calls == 0
+    assert list(resumed_cards["front_text"]) == list(reversed_df["front_text"])
+    assert list(resumed_cards["enhanced_back"]) == list(cards["enhanced_back"][::-1])
@@ -0,0 +1,106 @@
+"""错误分类与重试等待时间"""
+
+import pytest
+
+from circuit_breaker import CircuitOpenError
+from rate_limiter import is_rate_limit_error
+from retry_policy import (
+    CIRCUIT_OPEN, CONTENT_FILTER, PERMANENT, RATE_LIMIT, TRANSIENT, RetryPolicy, classify_error
+)
+
+
+class StatusError(Exception):
+    def __init__(self, message="", status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        if headers is not None:
+            self.response = type("Response", (), {"headers": headers})()
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error, kind", [
+    (StatusError("too many", 429), RATE_LIMIT),
+    (RateLimitError("slow down"), RATE_LIMIT),
+    (Exception("429 Resource has been exhausted"), RATE_LIMIT),
+    (Exception("Rate limit reached for requests"), RATE_LIMIT),
+    (StatusError("bad gateway", 502), TRANSIENT),
+    (StatusError("request timeout", 408), TRANSIENT),
+    (APITimeoutError("timed out"), TRANSIENT),
+    (ConnectionError("reset"), TRANSIENT),
+    (Exception("unknown"), TRANSIENT),
+    (StatusError("invalid key", 401), PERMANENT),
+    (StatusError("bad request", 400), PERMANENT),
+    (AuthenticationError("invalid key"), PERMANENT),
+    (StatusError("blocked by content_filter", 400), CONTENT_FILTER),
+    (Exception("response blocked for safety reasons"), CONTENT_FILTER),
+    (CircuitOpenError("所有服务商均处于熔断状态"), CIRCUIT_OPEN),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+@pytest.mark.parametrize("message", [
+    "request id 84290 failed",
+    "prompt has 4291 tokens",
+    "moderate limits apply",
+])
+def test_rate_limit_requires_whole_words(message):
+    assert not is_rate_limit_error(Exception(message))
+
+
+def test_non_retryable_errors_are_not_retried():
+    policy = RetryPolicy(max_retries=5)
+    assert policy.next_delay(StatusError("invalid key", 401), attempt=0, elapsed=0) is None
+    assert policy.next_delay(CircuitOpenError("open"), attempt=0, elapsed=0) is None
+
+
+def test_retries_stop_at_max_retries():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01)
+    error = StatusError("unavailable", 503)
+    assert policy.next_delay(error, attempt=1, elapsed=0) is not None
+    assert policy.next_delay(error, attempt=2, elapsed=0) is None
+
+
+def test_backoff_is_capped_full_jitter():
+    policy = RetryPolicy(base_delay=1.0, max_delay=4.0)
+    delays = [policy.backoff(10) for _ in range(200)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_rate_limit_waits_at_least_retry_after():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.02)
+    error = StatusError("too many", 429, headers={"retry-after": "7"})
+    assert policy.next_delay(error, attempt=0, elapsed=0) == 7.0
+
+
+def test_deadline_stops_retries():
+    policy = RetryPolicy(max_retries=10, base_delay=0.01, deadline=5)
+    error = StatusError("too many", 429, headers={"retry-after": "3"})
+    assert policy.next_delay(error, attempt=0, elapsed=1) == 3.0
+    assert policy.next_delay(error, attempt=0, elapsed=3) is None
+
+
+def test_call_retries_transient_errors_and_counts_them():
+    policy = RetryPolicy(max_retries=3, base_delay=0, max_delay=0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise StatusError("unavailable", 503)
+        return "ok"
+
+    assert policy.call(flaky) == "ok"
+    assert policy.error_counts == {TRANSIENT: 2}
@@ -0,0 +1,92 @@
+"""流式响应扫描：JSON 对象/数组与【小节】纯文本的提前结束判断"""
+
+import json
+
+from stream_parser import JsonStreamScanner, TextSectionScanner, collect_stream, output_sections
+
+
+def feed_all(scanner, text, size=3):
+    """按 size 个字符一段喂入，返回判断完整时已喂入的字符数（未完整则为 None）"""
+    for start in range(0, len(text), size):
+        if scanner.feed(text[start:start + size]):
+            return start + size
+    return None
+
+
+def test_json_object_completes_after_required_fields():
+    text = '```json\n{"definition": "a, b {c}", "example": "say \\"hi\\"", "extra": "long tail'
+    scanner = JsonStreamScanner(required_fields=["definition", "example"])
+
+    assert feed_all(scanner, text) is not None
+    assert json.loads(scanner.result()) == {"definition": "a, b {c}", "example": 'say "hi"'}
+
+
+def test_json_object_waits_for_closing_brace_of_last_required_field():
+    scanner = JsonStreamScanner(required_fields=["definition", "example"])
+
+    assert not scanner.feed('{"definition": "x", "example": "y')
+    assert scanner.result() == '{"definition": "x", "example": "y'
+    assert scanner.feed('"}')
+    assert json.loads(scanner.result()) == {"definition": "x", "example": "y"}
+
+
+def test_json_array_completes_after_expected_items():
+    items = [{"id": str(i), "value": [i, {"n": i}]} for i in range(5)]
+    scanner = JsonStreamScanner(expected_items=3)
+
+    assert feed_all(scanner, json.dumps(items)) is not None
+    assert json.loads(scanner.result()) == items[:3]
+
+
+def test_output_sections_come_from_template_tail():
+    template = "【示例】忽略\n单词: {front_text}\n请输出:\n【释义】\n【例句】\n【释义】"
+    assert output_sections(template) == ["释义", "例句"]
+
+
+def test_text_scanner_stops_at_repeated_heading():
+    text = "【释义】\n苹果\n【例句】\nAn apple.\n【释义】\n重复输出\n"
+    scanner = TextSectionScanner(["释义", "例句"])
+
+    assert feed_all(scanner, text) is not None
+    assert scanner.result() == "【释义】\n苹果\n【例句】\nAn apple."
+
+
+def test_text_scanner_stops_at_closing_fence_of_text_wrapper():
+    text = "```text\n【释义】\n苹果\n【例句】\nAn apple.\n```\n多余的说明\n"
+    scanner = TextSectionScanner(["释义", "例句"])
+
+    assert feed_all(scanner, text) is not None
+    assert scanner.result() == "```text\n【释义】\n苹果\n【例句】\nAn apple."
+
+
+def test_text_scanner_ignores_headings_inside_code_blocks():
+    text = "【释义】\n```python\n【释义】\n```\n【例句】\nx = 1\n"
+    scanner = TextSectionScanner(["释义", "例句"])
+
+    assert feed_all(scanner, text) is None
+    assert scanner.result() == text
+
+
+def test_collect_stream_closes_stream_after_completion():
+    class Stream:
+        def __init__(self, chunks):
+            self.chunks = iter(chunks)
+            self.consumed = 0
+            self.closed = False
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            self.consumed += 1
+            return next(self.chunks)
+
+        def close(self):
+            self.closed = True
+
+    stream = Stream(['{"a": "1", ', '"b": "2"', ', "c": "3"}', "never read"])
+    result = collect_stream(stream, JsonStreamScanner(required_fields=["a", "b"]))
+
+    assert json.loads(result) == {"a": "1", "b": "2"}
+    assert stream.closed
+    assert stream.consumed == 3